@@ -0,0 +1,21 @@
+import os
+
+import pytest
+
+from travel.graph import Graph, process_routes
+
+SAMPLE_DATA = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'sample_data')
+FEEDS = ['wizzair', 'ryanair']
+
+
+def load_sample(cache_size=0):
+    graph = Graph(cache_size=cache_size)
+    for name in FEEDS:
+        with open(os.path.join(SAMPLE_DATA, '{}.csv'.format(name))) as f:
+            process_routes(f, name, graph)
+    return graph
+
+
+@pytest.fixture
+def sample_graph():
+    return load_sample()
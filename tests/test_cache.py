@@ -0,0 +1,103 @@
+import os
+import random
+from datetime import timedelta
+
+import numpy as np
+
+from travel.cache import RouteCache
+from travel.loader import read_feed
+from travel.search import DEPARTURE_FROM
+
+from conftest import SAMPLE_DATA, load_sample
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def queries(graph, count, seed=0):
+    rnd = random.Random(seed)
+    origins = [node.id for node in graph.nodes if len(graph.store.outgoing(node.id))]
+    return [(rnd.choice(origins), rnd.randrange(graph.store.node_count), rnd.choice((2, 3))) for _ in range(count)]
+
+
+def answers(graph, queries, **options):
+    result = []
+    for origin, destination, hops in queries:
+        route = graph.path(graph.nodes[origin], graph.nodes[destination], max_hops=hops, **options)
+        result.append(route and (route['price'], [connection.index for connection in route['path']]))
+    return result
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = RouteCache(2)
+    cache.put('a', 1, [0], 0, 10)
+    cache.put('b', 2, [1], 0, 10)
+    assert cache.get('a') == (True, 1)
+    cache.put('c', 3, [2], 0, 10)
+    assert cache.get('b') == (False, None)
+    assert cache.get('a') == (True, 1) and cache.get('c') == (True, 3)
+    assert cache.evictions == 1 and len(cache) == 2
+
+
+def test_entries_expire():
+    clock = Clock()
+    cache = RouteCache(ttl=60, clock=clock)
+    cache.put('a', 1, [0], 0, 10)
+    clock.now = 59
+    assert cache.get('a') == (True, 1)
+    clock.now = 60
+    assert cache.get('a') == (False, None)
+    assert cache.expirations == 1 and len(cache) == 0
+
+
+def test_invalidate_drops_entries_by_region_and_window():
+    cache = RouteCache()
+    cache.put('near', 1, [0, 1], 0, 10)
+    cache.put('far', 2, [5], 0, 10)
+    cache.put('later', 3, [0], 20, 30)
+    cache.put('unbounded', 4, None, 0, 10)
+    assert cache.invalidate([1], [5]) == 2
+    assert cache.get('near') == (False, None) and cache.get('unbounded') == (False, None)
+    assert cache.get('far') == (True, 2) and cache.get('later') == (True, 3)
+    assert cache.invalidate([0], [25]) == 1
+    assert cache.get('later') == (False, None)
+
+
+def test_cached_routes_follow_new_connections(sample_graph):
+    cached = load_sample(cache_size=1024)
+    asked = queries(cached, 150)
+    assert answers(cached, asked) == answers(sample_graph, asked)
+    rnd = random.Random(1)
+    for _ in range(10):
+        origin, destination, _ = rnd.choice(asked)
+        departure = DEPARTURE_FROM + timedelta(days=rnd.randrange(40), hours=rnd.randrange(24))
+        price = rnd.choice((1, 5, 20))
+        for graph in (cached, sample_graph):
+            graph.edge(graph.nodes[origin], graph.nodes[destination], price, 'wizzair', departure,
+                       departure + timedelta(hours=2))
+        assert answers(cached, asked) == answers(sample_graph, asked)
+    assert cached.cache.hits and cached.cache.invalidations
+
+
+def test_cached_routes_follow_feed_updates(sample_graph):
+    cached = load_sample(cache_size=1024)
+    asked = queries(cached, 150, seed=2)
+    before = answers(cached, asked)
+    with open(os.path.join(SAMPLE_DATA, 'wizzair.csv')) as f:
+        feed = read_feed(f)
+    rnd = np.random.default_rng(0)
+    feed = feed.select(rnd.random(len(feed)) > 0.1)
+    feed.price = np.where(rnd.random(len(feed)) < 0.2, feed.price // 3, feed.price)
+    for graph in (cached, sample_graph):
+        graph.apply_feed(feed, 'wizzair')
+    after = answers(sample_graph, asked)
+    assert answers(cached, asked) == after != before
+    assert cached.cache.invalidations
+    hits = cached.cache.hits
+    assert answers(cached, asked) == after
+    assert cached.cache.hits > hits
@@ -0,0 +1,85 @@
+import csv
+import json
+import os
+import subprocess
+import sys
+
+from scrapy.http import Request, TextResponse
+
+from travel import ryanair, wizzair
+from travel.replay import request_key, save_recording
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+JSON = [(b'Content-Type', b'application/json')]
+
+RYANAIR_AIRPORTS = {'airports': [
+    {'iataCode': 'RIX', 'name': 'Riga', 'countryCode': 'lv', 'coordinates': {'latitude': 56.92, 'longitude': 23.97}},
+    {'iataCode': 'SXF', 'name': 'Berlin Schoenefeld', 'countryCode': 'de',
+     'coordinates': {'latitude': 52.38, 'longitude': 13.52}},
+]}
+WIZZAIR_MAP = {'cities': [
+    {'iata': 'TLL', 'shortName': 'Tallinn', 'countryCode': 'EE', 'latitude': 59.41, 'longitude': 24.83,
+     'connections': [{'iata': 'KTW'}]},
+    {'iata': 'KTW', 'shortName': 'Katowice', 'countryCode': 'PL', 'latitude': 50.47, 'longitude': 19.08,
+     'connections': [{'iata': 'TLL'}]},
+]}
+
+
+def ryanair_fares(destination, days):
+    return {'fares': [{'outbound': {
+        'arrivalAirport': {'iataCode': destination, 'name': destination},
+        'departureDate': '2018-01-{:02d}T06:30:00'.format(day),
+        'arrivalDate': '2018-01-{:02d}T09:00:00'.format(day),
+        'price': {'value': 19.99 + day, 'currencyCode': 'EUR'},
+    }} for day in days] + [{'summary': {}}]}
+
+
+def wizzair_timetable(days):
+    return {'outboundFlights': [
+        {'departureDate': '2018-01-{:02d}T07:10:00'.format(day), 'price': {'amount': 9.99, 'currencyCode': 'EUR'}}
+        for day in days
+    ] + [{'departureDate': '2018-01-31T07:10:00', 'price': None}]}
+
+
+def record(directory, request, body):
+    body = json.dumps(body).encode('utf-8')
+    save_recording(directory, request_key(request.method, request.url, request.body), request.url,
+                   request.method, 200, JSON, body)
+    return TextResponse(request.url, body=body, headers=dict(JSON), request=request)
+
+
+def record_crawl(directory):
+    """
+    Records the responses of a small crawl of both airlines, following
+    the requests the spiders make from them
+    """
+    spider = ryanair.RyanairSpider()
+    requests = list(spider.parse(record(directory, Request(ryanair.AIRPORTS_URL), RYANAIR_AIRPORTS)))
+    for request, (destination, days) in zip(requests, [('SXF', range(1, 6)), ('RIX', range(3, 5))]):
+        record(directory, request, ryanair_fares(destination, days))
+
+    spider = wizzair.WizzairSpider()
+    start = spider.start_requests()[0]
+    for request, days in zip(spider.parse(record(directory, start, WIZZAIR_MAP)), [range(1, 8), range(2, 4)]):
+        record(directory, request, wizzair_timetable(days))
+
+
+def rows(path):
+    with open(path) as f:
+        return list(csv.DictReader(f))
+
+
+def test_replayed_crawl(tmp_path):
+    recordings = str(tmp_path / 'recordings')
+    output = str(tmp_path / 'feeds')
+    record_crawl(recordings)
+    result = subprocess.run(
+        [sys.executable, '-m', 'travel.crawl', 'ryanair', 'wizzair', '--replay', recordings,
+         '--output', output, '--fares', output, '--cache', ''],
+        cwd=ROOT, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True, timeout=120,
+    )
+    assert result.returncode == 0, result.stdout
+    assert 'replayed 6 responses, 0 missing' in result.stdout
+    assert len(rows(os.path.join(output, 'ryanair.csv'))) == 7
+    assert len(rows(os.path.join(output, 'wizzair.csv'))) == 9
+    assert sorted(os.listdir(output)) == ['ryanair.csv', 'ryanair.fares', 'wizzair.csv', 'wizzair.fares']
@@ -0,0 +1,52 @@
+from datetime import datetime
+
+import numpy as np
+import pytest
+
+from travel.currency import RateTable, default_rates, from_minor, to_minor
+from travel.store import to_minutes
+
+JANUARY = to_minutes(datetime(2018, 1, 1))
+FEBRUARY = to_minutes(datetime(2018, 2, 1))
+
+
+def write_rates(tmp_path):
+    path = tmp_path / 'rates.csv'
+    path.write_text('date,currency,rate\n'
+                    '2018-02-01,PLN,0.25\n'
+                    '2018-01-01,eur,1.0\n'
+                    '2018-01-01,PLN,0.2\n'
+                    '2018-01-01,UAH,0.03\n')
+    return str(path)
+
+
+def test_to_minor_rounds_to_whole_cents():
+    assert to_minor(19.99) == 1999
+    assert to_minor(0.296) == 30
+    assert to_minor(np.array([19.99, 0.1 + 0.2, 1e-9])).tolist() == [1999, 30, 0]
+    assert to_minor(np.array([19.99])).dtype == np.int64
+    assert from_minor(1999) == 19.99
+
+
+def test_prices_convert_at_the_rate_of_their_departure_day(tmp_path):
+    rates = RateTable.load(write_rates(tmp_path))
+    prices = np.array([100.0, 100.0, 100.0, 100.0, 12.34, 1000.0])
+    currencies = np.array(['PLN', 'PLN', 'PLN', 'EUR', 'EUR', '31'])
+    when = np.array([JANUARY - 60, JANUARY + 60, FEBRUARY, FEBRUARY, JANUARY, JANUARY], dtype=np.int64)
+    assert rates.to_minor(prices, currencies, when).tolist() == [2000, 2000, 2500, 10000, 1234, 3000]
+    assert rates.to_minor(prices[:3], currencies[:3], when[:3]).tolist() == [2000, 2000, 2500]
+    assert rates.rate('pln', FEBRUARY + 1) == 0.25
+
+
+def test_unknown_currency_is_an_error(tmp_path):
+    rates = RateTable.load(write_rates(tmp_path))
+    with pytest.raises(ValueError):
+        rates.to_minor(np.array([1.0]), np.array(['GBP']), np.array([JANUARY], dtype=np.int64))
+
+
+def test_default_rates_cover_the_sample_currencies():
+    rates = default_rates()
+    for currency in ('EUR', 'PLN', 'UAH'):
+        assert rates.rate(currency, JANUARY) > 0
+    assert default_rates() is rates
+    assert rates.to_minor(np.array([10.0]), np.array(['EUR']), np.array([JANUARY], dtype=np.int64)).tolist() == [1000]
@@ -0,0 +1,72 @@
+import os
+from datetime import datetime
+
+import numpy as np
+
+from travel.fares import FareWriter, convert, read_fares, row_groups
+from travel.graph import Graph
+from travel.loader import DEFAULT_FLIGHT_MINUTES, load_parallel, read_feed
+from travel.store import to_minutes
+
+from conftest import FEEDS, SAMPLE_DATA
+
+ITEM = {
+    'origin_airport': 'RIX', 'origin_title': 'Riga', 'origin_state': 'LV', 'origin_lat': 56.92, 'origin_lon': 23.97,
+    'destination_airport': 'KTW', 'destination_title': 'Katowice', 'destination_state': 'PL',
+    'destination_lat': 50.47, 'destination_lon': 19.08,
+}
+
+
+def test_fares_read_back_like_the_csv(tmp_path):
+    for name in FEEDS:
+        source = os.path.join(SAMPLE_DATA, '{}.csv'.format(name))
+        target = str(tmp_path / '{}.fares'.format(name))
+        rows = convert(source, target, row_group=500)
+        with open(source) as f:
+            expected = read_feed(f)
+        assert sum(row_groups(target)) == rows == len(expected)
+        assert len(row_groups(target)) == -(-rows // 500)
+        feed = read_fares(target)
+        for column in ('origin_lat', 'origin_lon', 'destination_lat', 'destination_lon', 'departure', 'arrival',
+                       'price'):
+            assert np.array_equal(getattr(feed, column), getattr(expected, column)), (name, column)
+        assert feed.origin_title == expected.origin_title
+        assert feed.destination_state == expected.destination_state
+
+
+def test_fares_load_into_the_same_graph(tmp_path):
+    csv_feeds = [(os.path.join(SAMPLE_DATA, '{}.csv'.format(name)), name) for name in FEEDS]
+    fare_feeds = []
+    for source, name in csv_feeds:
+        target = str(tmp_path / '{}.fares'.format(name))
+        convert(source, target, row_group=700)
+        fare_feeds.append((target, name))
+    graphs = []
+    for feeds in (csv_feeds, fare_feeds):
+        graph = Graph()
+        progress = list(load_parallel(graph, feeds, workers=1, chunk_size=700))
+        graphs.append(graph)
+        assert sum(chunk.rows for chunk in progress) == sum(chunk.added + chunk.duplicates for chunk in progress)
+    from_csv, from_fares = graphs
+    assert from_fares.store.cities == from_csv.store.cities
+    for column in ('origin', 'destination', 'departure', 'arrival', 'price', 'carrier'):
+        assert np.array_equal(from_fares.store.column(column), from_csv.store.column(column))
+
+
+def test_writer_takes_spider_items(tmp_path):
+    path = str(tmp_path / 'items.fares')
+    with open(path, 'wb') as f:
+        writer = FareWriter(f, row_group=2)
+        writer.add(dict(ITEM, departureDate=datetime(2018, 1, 10, 6), arrivalDate=datetime(2018, 1, 10, 8),
+                        price='19.99', currencyCode='EUR'))
+        writer.add(dict(ITEM, departureDate=datetime(2018, 1, 11, 6), price=39.0, currencyCode='PLN'))
+        writer.add(dict(ITEM, departureDate=datetime(2018, 1, 12, 6), arrivalDate=None, price=25, currencyCode='EUR'))
+        writer.close()
+    assert row_groups(path) == [2, 1]
+    feed = read_fares(path)
+    departures = [to_minutes(datetime(2018, 1, day, 6)) for day in (10, 11, 12)]
+    assert feed.departure.tolist() == departures
+    assert feed.arrival.tolist() == [departures[0] + 120] + [d + DEFAULT_FLIGHT_MINUTES for d in departures[1:]]
+    assert feed.price[0] == 1999 and feed.price[2] == 2500
+    assert 0 < feed.price[1] < 3900
+    assert feed.origin_title == ['Riga'] * 3 and feed.destination_state == ['PL'] * 3
@@ -0,0 +1,101 @@
+import os
+import time
+
+import pytest
+from scrapy import Spider
+from scrapy.exceptions import NotConfigured
+from scrapy.http import Request, TextResponse
+from scrapy.utils.test import get_crawler
+
+from travel.httpcache import DAY, ReferenceCacheMiddleware
+from travel.replay import recording_path, request_key
+
+REFERENCE = 'https://example.com/api/cities'
+FARES = 'https://example.com/api/fares'
+BODY = b'{"cities": ["Riga", "Katowice"]}'
+HEADERS = {'ETag': '"v1"', 'Last-Modified': 'Mon, 01 Jan 2018 00:00:00 GMT', 'Content-Type': 'application/json'}
+
+
+def middleware(directory, ttl=DAY):
+    crawler = get_crawler(Spider, {
+        'REFERENCE_CACHE_DIR': str(directory),
+        'REFERENCE_CACHE_TTL': ttl,
+        'REFERENCE_URLS': [REFERENCE],
+    })
+    return ReferenceCacheMiddleware.from_crawler(crawler), crawler.stats
+
+
+def fetch(cache, url, status=200, body=BODY):
+    """
+    Sends a request through the middleware, answering it with `status`
+    unless the cache answers it
+    :return: (request, response)
+    """
+    request = Request(url)
+    response = cache.process_request(request, None)
+    if response is None:
+        response = TextResponse(url, status=status, headers=HEADERS, body=body if status == 200 else b'',
+                                request=request)
+        response = cache.process_response(request, response, None)
+    return request, response
+
+
+def expire(directory, url):
+    path = recording_path(str(directory), request_key('GET', url))
+    stored = time.time() - 2 * DAY
+    os.utime(path, (stored, stored))
+    return path
+
+
+def test_unconfigured_cache_is_disabled():
+    with pytest.raises(NotConfigured):
+        middleware('')
+
+
+def test_fresh_response_is_served_from_the_cache(tmp_path):
+    cache, stats = middleware(tmp_path)
+    _, response = fetch(cache, REFERENCE)
+    assert 'cached' not in response.flags
+    request, response = fetch(cache, REFERENCE, status=500)
+    assert response.status == 200 and response.body == BODY and 'cached' in response.flags
+    assert b'If-None-Match' not in request.headers
+    _, response = fetch(cache, FARES)
+    _, response = fetch(cache, FARES, body=b'{}')
+    assert response.body == b'{}' and 'cached' not in response.flags
+    assert stats.get_value('referencecache/miss') == 1
+    assert stats.get_value('referencecache/hit') == 1
+    assert stats.get_value('referencecache/stored') == 1
+    assert stats.get_value('referencecache/hit_rate') == 0.5
+    assert stats.get_value('referencecache/bytes_saved') == len(BODY)
+
+
+def test_expired_response_is_revalidated(tmp_path):
+    cache, stats = middleware(tmp_path)
+    fetch(cache, REFERENCE)
+    path = expire(tmp_path, REFERENCE)
+    request, response = fetch(cache, REFERENCE, status=304)
+    assert request.headers['If-None-Match'] == HEADERS['ETag'].encode()
+    assert request.headers['If-Modified-Since'] == HEADERS['Last-Modified'].encode()
+    assert response.status == 200 and response.body == BODY and 'cached' in response.flags
+    assert time.time() - os.path.getmtime(path) < DAY
+    _, response = fetch(cache, REFERENCE, status=500)
+    assert response.body == BODY and 'cached' in response.flags
+    assert stats.get_value('referencecache/revalidated') == 1
+    assert stats.get_value('referencecache/hit') == 1
+    assert stats.get_value('referencecache/miss') == 1
+    assert stats.get_value('referencecache/hit_rate') == round(2 / 3, 4)
+    assert stats.get_value('referencecache/bytes_saved') == 2 * len(BODY)
+
+
+def test_changed_response_replaces_the_expired_one(tmp_path):
+    cache, stats = middleware(tmp_path)
+    fetch(cache, REFERENCE)
+    expire(tmp_path, REFERENCE)
+    changed = b'{"cities": ["Riga", "Katowice", "Vilnius"]}'
+    request, response = fetch(cache, REFERENCE, body=changed)
+    assert b'If-None-Match' in request.headers
+    assert response.body == changed and 'cached' not in response.flags
+    _, response = fetch(cache, REFERENCE, status=500)
+    assert response.body == changed and 'cached' in response.flags
+    assert stats.get_value('referencecache/miss') == 2
+    assert stats.get_value('referencecache/stored') == 2
@@ -0,0 +1,56 @@
+import io
+import os
+
+import numpy as np
+
+from travel.graph import Graph
+from travel.loader import FareSet, load_parallel, load_routes
+from travel.store import CONNECTION_COLUMNS, NODE_COLUMNS
+
+from conftest import FEEDS, SAMPLE_DATA, load_sample
+
+SAMPLE = 'sample_data/wizzair.csv'
+
+
+def test_fare_set_matches_a_set_of_tuples():
+    rnd = np.random.default_rng(0)
+    fares = FareSet()
+    seen = set()
+    for _ in range(30):
+        columns = rnd.integers(0, 4, (5, rnd.integers(0, 200)))
+        expected = []
+        for fare in zip(*[column.tolist() for column in columns]):
+            expected.append(fare not in seen)
+            seen.add(fare)
+        assert fares.new(*columns).tolist() == expected
+    assert len(fares) == len(seen)
+
+
+def test_load_routes_skips_fares_repeated_across_chunks():
+    with open(SAMPLE) as f:
+        header, body = f.read().split('\n', 1)
+    once = Graph()
+    rows = sum(chunk.added for chunk in load_routes(once, io.StringIO(header + '\n' + body), 'wizzair'))
+    graph = Graph()
+    doubled = io.StringIO(header + '\n' + body + body)
+    progress = list(load_routes(graph, doubled, 'wizzair', chunk_size=700))
+    assert sum(chunk.rows for chunk in progress) == 2 * rows
+    assert sum(chunk.added for chunk in progress) == rows
+    assert sum(chunk.duplicates for chunk in progress) == rows
+    assert len(graph.store) == rows
+
+
+def test_parallel_load_does_not_depend_on_the_workers():
+    expected = load_sample().store
+    feeds = [(os.path.join(SAMPLE_DATA, '{}.csv'.format(name)), name) for name in FEEDS]
+    for workers in (1, 2, 4):
+        graph = Graph()
+        progress = list(load_parallel(graph, feeds, workers, chunk_size=500))
+        assert len(progress) > len(feeds)
+        store = graph.store
+        assert store.cities == expected.cities and store.carriers == expected.carriers
+        for column, _ in CONNECTION_COLUMNS:
+            assert np.array_equal(store.column(column), expected.column(column)), (workers, column)
+        for column, _ in NODE_COLUMNS:
+            assert np.array_equal(getattr(store, column)[:store.node_count],
+                                  getattr(expected, column)[:expected.node_count]), (workers, column)
@@ -0,0 +1,39 @@
+import pytest
+
+from travel.currency import to_minor
+from travel.matrix import UNREACHABLE
+
+ORIGINS = ['Riga', 'Katowice', 'Vilnius', 'Kiev - Zhulyany']
+
+
+def origins(graph):
+    return [graph.nodes[graph.store.cities.index(city)] for city in ORIGINS]
+
+
+def test_cheapest_from_matches_path(sample_graph):
+    reachable = 0
+    for n1 in origins(sample_graph):
+        routes = sample_graph.cheapest_from(n1, max_hops=2)
+        reachable += len(routes)
+        for n2 in sample_graph.nodes:
+            route = sample_graph.path(n1, n2, max_hops=2)
+            found = routes.get(n2)
+            assert (found and found['price']) == (route and route['price']), (n1.city, n2.city)
+    assert reachable > 0
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_matrix_matches_path(sample_graph, workers):
+    matrix = sample_graph.matrix(origins(sample_graph), max_hops=2, workers=workers)
+    assert matrix.prices.dtype.kind == 'i'
+    assert matrix.reachable > 0
+    for i, n1 in enumerate(origins(sample_graph)):
+        for j, n2 in enumerate(sample_graph.nodes):
+            route = sample_graph.path(n1, n2, max_hops=2)
+            if route is None:
+                assert matrix.get(n1.id, n2.id) is None and matrix.prices[i, j] == UNREACHABLE
+                continue
+            price, arrival, hops = matrix.get(n1.id, n2.id)
+            assert matrix.prices[i, j] == to_minor(route['price'])
+            assert price == route['price'] and hops == route['hops']
+            assert arrival == route['path'][-1].arrival
@@ -0,0 +1,56 @@
+import random
+from datetime import timedelta
+
+from travel.search import DEPARTURE_FROM
+
+METHODS = ('dijkstra', 'astar', 'bidirectional', 'patterns')
+
+
+def pairs(graph, count, seed=0):
+    """
+    Random node pairs, every other one starting at a node with connections
+    """
+    rnd = random.Random(seed)
+    origins = [node for node in graph.nodes if len(graph.store.outgoing(node.id))]
+    result = []
+    for i in range(count):
+        n1, n2 = rnd.sample(graph.nodes, 2)
+        result.append((rnd.choice(origins) if i % 2 else n1, n2))
+    return result
+
+
+def prices(graph, n1, n2, **options):
+    found = {}
+    for method in METHODS:
+        route = graph.path(n1, n2, method=method, **options)
+        found[method] = None if route is None else round(route['price'], 2)
+    return found
+
+
+def test_every_method_finds_the_same_price(sample_graph, tmp_path):
+    sample_graph.load_patterns(str(tmp_path / 'graph.patterns'), max_hops=3)
+    options = [
+        {'max_hops': 1}, {'max_hops': 2}, {'max_hops': 3}, {'max_hops': 3, 'max_price': 60},
+        {'max_hops': 2, 'departure_to': DEPARTURE_FROM + timedelta(days=15)},
+        {'max_hops': 3, 'min_layover': timedelta(hours=3), 'max_layover': timedelta(days=2)},
+    ]
+    found = 0
+    for n1, n2 in pairs(sample_graph, 80):
+        for option in options:
+            result = prices(sample_graph, n1, n2, **option)
+            assert len(set(result.values())) == 1, (n1, n2, option, result)
+            found += result['dijkstra'] is not None
+    assert found > 50
+
+
+def test_methods_agree_after_an_update(sample_graph, tmp_path):
+    sample_graph.load_patterns(str(tmp_path / 'graph.patterns'), max_hops=3)
+    rnd = random.Random(1)
+    asked = pairs(sample_graph, 40, seed=2)
+    for n1, n2 in rnd.sample(asked, 5):
+        departure = DEPARTURE_FROM + timedelta(days=rnd.randrange(30))
+        sample_graph.edge(n1, n2, 2, 'ryanair', departure, departure + timedelta(hours=3))
+    assert sample_graph.current_patterns() is None
+    for n1, n2 in asked:
+        result = prices(sample_graph, n1, n2, max_hops=3)
+        assert len(set(result.values())) == 1, (n1, n2, result)
@@ -0,0 +1,84 @@
+import random
+from datetime import timedelta
+
+from travel.search import SearchStats, Window, cheapest_path, pareto_paths
+
+
+def itineraries(graph, origin, destination, max_hops, window):
+    """
+    (price in EUR cents, minutes from first departure to last arrival,
+    hops) of every itinerary that keeps the window and the layovers
+    """
+    store = graph.store
+    outgoing = {}
+    for i in store.live().tolist():
+        outgoing.setdefault(int(store.origin[i]), []).append(i)
+    stack = [(origin, None, None, 0, 0)]
+    while stack:
+        node, start, arrival, price, hops = stack.pop()
+        if hops and node == destination:
+            yield price, arrival - start, hops
+            continue
+        if hops == max_hops:
+            continue
+        earliest, latest = window.bounds(arrival)
+        for i in outgoing.get(node, ()):
+            if earliest <= store.departure[i] <= latest and store.destination[i] != origin:
+                stack.append((
+                    int(store.destination[i]), int(store.departure[i]) if start is None else start,
+                    int(store.arrival[i]), price + int(store.price[i]), hops + 1,
+                ))
+
+
+def front(criteria):
+    result = []
+    for price, duration, hops in sorted(set(criteria)):
+        if not any(other[1] <= duration and other[2] <= hops for other in result):
+            result.append((price, duration, hops))
+    return result
+
+
+def criteria(route):
+    return round(route['price'] * 100), int(route['duration'].total_seconds()) // 60, route['hops']
+
+
+def connected_pairs(graph, count, seed=0):
+    rnd = random.Random(seed)
+    store = graph.store
+    origins = [node for node in graph.nodes if len(store.outgoing(node.id))]
+    result = []
+    while len(result) < count:
+        n1 = rnd.choice(origins)
+        node = n1.id
+        for _ in range(rnd.randint(1, 3)):
+            outgoing = store.outgoing(node).tolist()
+            if outgoing:
+                node = int(store.destination[rnd.choice(outgoing)])
+        if node != n1.id:
+            result.append((n1, graph.nodes[node]))
+    return result
+
+
+def check_front(graph, n1, n2, window):
+    routes = pareto_paths(graph, n1, n2, max_hops=3, max_labels=10 ** 6, window=window)
+    assert [criteria(route) for route in routes] == front(itineraries(graph, n1.id, n2.id, 3, window))
+    cheapest = cheapest_path(graph, n1, n2, max_hops=3, window=window)
+    assert (routes[0]['price'] if routes else None) == (cheapest['price'] if cheapest else None)
+    return len(routes)
+
+
+def test_pareto_front_matches_brute_force(sample_graph):
+    sizes = []
+    for n1, n2 in connected_pairs(sample_graph, 40):
+        for window in (Window(), Window(min_layover=timedelta(hours=1))):
+            sizes.append(check_front(sample_graph, n1, n2, window))
+    assert max(sizes) > 2
+
+
+def test_pareto_bags_keep_at_most_max_labels(sample_graph):
+    for n1, n2 in connected_pairs(sample_graph, 20, seed=1):
+        stats = SearchStats()
+        routes = sample_graph.pareto(n1, n2, max_hops=3, max_labels=4, stats=stats)
+        assert max(stats.label_counts.values()) <= 4
+        assert len(routes) <= 4
+        assert [route['price'] for route in routes] == sorted(route['price'] for route in routes)
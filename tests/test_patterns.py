@@ -0,0 +1,117 @@
+import csv
+import os
+import random
+from datetime import timedelta
+
+import numpy as np
+
+from travel.patterns import TransferPatterns
+from travel.profiling import INSTRUMENTS
+from travel.search import DEPARTURE_FROM, Window, cheapest_path
+
+from conftest import SAMPLE_DATA
+
+
+def pairs(graph, count=150, seed=0):
+    rnd = random.Random(seed)
+    return [rnd.sample(graph.nodes, 2) for _ in range(count)]
+
+
+def connected_pairs(graph, count=150, seed=0):
+    rnd = random.Random(seed)
+    origins = [node for node in graph.nodes if len(graph.store.outgoing(node.id))]
+    return [(rnd.choice(origins), rnd.choice(graph.nodes)) for _ in range(count)]
+
+
+def repriced_feed(tmp_path, name, seed=0):
+    """
+    The sample feed of `name` with a third of its fares cheaper or dearer
+    """
+    rnd = random.Random(seed)
+    with open(os.path.join(SAMPLE_DATA, '{}.csv'.format(name))) as f:
+        reader = csv.DictReader(f)
+        header, rows = reader.fieldnames, list(reader)
+    for row in rows:
+        if rnd.random() < 0.3:
+            row['price'] = '{:.2f}'.format(float(row['price']) * rnd.choice((0.3, 0.7, 1.5, 3)))
+    path = str(tmp_path / '{}.csv'.format(name))
+    with open(path, 'w') as f:
+        writer = csv.DictWriter(f, header)
+        writer.writeheader()
+        writer.writerows(rows)
+    return path
+
+
+def price(route):
+    return None if route is None else round(route['price'], 2)
+
+
+def test_patterns_find_the_cheapest_route(sample_graph, tmp_path):
+    patterns = sample_graph.load_patterns(str(tmp_path / 'graph.patterns'), max_hops=3)
+    assert sample_graph.current_patterns() is patterns
+    for hops in (1, 2, 3):
+        for n1, n2 in pairs(sample_graph):
+            expected = sample_graph.path(n1, n2, max_hops=hops)
+            assert price(patterns.path(sample_graph, n1, n2, max_hops=hops)) == price(expected)
+
+
+def test_patterns_round_trip(sample_graph, tmp_path):
+    path = str(tmp_path / 'graph.patterns')
+    built = sample_graph.load_patterns(path, max_hops=2)
+    loaded = TransferPatterns.load(path)
+    assert (loaded.sequences == built.sequences).all()
+    assert (loaded.digests == built.digests).all()
+    assert (loaded.max_hops, loaded.window_key) == (2, Window().key)
+
+
+def test_stale_patterns_fall_back_to_search(sample_graph, tmp_path):
+    path = str(tmp_path / 'graph.patterns')
+    sample_graph.load_patterns(path, max_hops=2)
+    n1, n2 = pairs(sample_graph, 1)[0]
+    departure = DEPARTURE_FROM + timedelta(days=3)
+    sample_graph.edge(n1, n2, 0.5, 'wizzair', departure, departure + timedelta(hours=2))
+    assert sample_graph.current_patterns() is None
+    INSTRUMENTS.enable()
+    try:
+        assert sample_graph.path(n1, n2, method='patterns')['price'] == 0.5
+        sample_graph.path(n2, n1, max_layover=timedelta(days=3), method='patterns')
+        counters = INSTRUMENTS.as_dict()['counters']
+    finally:
+        INSTRUMENTS.disable()
+        INSTRUMENTS.reset()
+    assert counters['search/patterns_stale'] == 2
+
+    assert 0 < sample_graph.refresh_patterns() < sample_graph.store.node_count
+    patterns = sample_graph.current_patterns()
+    assert patterns is not None
+    assert patterns.path(sample_graph, n1, n2)['price'] == 0.5
+    assert (TransferPatterns.load(path).digests == patterns.digests).all()
+    assert sample_graph.load_patterns(path, max_hops=2).current(sample_graph.store)
+
+
+def test_repriced_patterns_stay_current(sample_graph, tmp_path):
+    path = str(tmp_path / 'graph.patterns')
+    built = sample_graph.load_patterns(path, max_hops=3)
+    with open(repriced_feed(tmp_path, 'wizzair')) as f:
+        delta = sample_graph.update(f, 'wizzair')
+    assert delta.updated > 0 and delta.added == 0
+    patterns = sample_graph.current_patterns()
+    assert patterns is not None and patterns is not built
+    assert (patterns.digests != built.digests).any()
+    for hops in (1, 2, 3):
+        for n1, n2 in connected_pairs(sample_graph):
+            expected = cheapest_path(sample_graph, n1, n2, max_hops=hops)
+            assert price(sample_graph.path(n1, n2, max_hops=hops, method='patterns')) == price(expected)
+    rebuilt = TransferPatterns.build(sample_graph.store, max_hops=3)
+    assert np.array_equal(patterns.sequences, rebuilt.sequences)
+
+
+def test_patterns_search_other_windows(sample_graph, tmp_path):
+    sample_graph.load_patterns(str(tmp_path / 'graph.patterns'), max_hops=2)
+    departure_to = DEPARTURE_FROM + timedelta(days=10)
+    for n1, n2 in pairs(sample_graph, 50):
+        for hops, layover in ((3, None), (2, timedelta(days=4))):
+            expected = sample_graph.path(n1, n2, max_hops=hops, departure_to=departure_to, max_layover=layover)
+            found = sample_graph.path(n1, n2, max_hops=hops, departure_to=departure_to, max_layover=layover,
+                                      method='patterns')
+            assert price(found) == price(expected)
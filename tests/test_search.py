@@ -0,0 +1,173 @@
+import random
+from datetime import timedelta
+
+from travel.currency import to_minor
+from travel.search import DEPARTURE_FROM, MINUTE, Window, cheapest_path, round_trips
+from travel.store import to_minutes
+
+
+def brute_force(graph, origin, destination, max_hops, window):
+    """
+    Price in EUR cents of the cheapest itinerary, trying every chain of
+    connections that keeps the window and the layovers
+    """
+    store = graph.store
+    outgoing = {}
+    for i in store.live().tolist():
+        if window.departure_from <= store.departure[i] <= window.departure_to:
+            outgoing.setdefault(int(store.origin[i]), []).append(i)
+    best = None
+    stack = [(origin, None, 0, 0)]
+    while stack:
+        node, arrival, price, hops = stack.pop()
+        if hops and node == destination:
+            best = price if best is None else min(best, price)
+            continue
+        if hops == max_hops:
+            continue
+        earliest, latest = window.bounds(arrival)
+        for i in outgoing.get(node, ()):
+            if earliest <= store.departure[i] <= latest and store.destination[i] != origin:
+                stack.append((int(store.destination[i]), int(store.arrival[i]), price + int(store.price[i]), hops + 1))
+    return best
+
+
+def itineraries(graph, origin, max_hops, window, destination=None):
+    """
+    (last node, first departure, last arrival, price in EUR cents) of every
+    chain of connections from `origin` that keeps the window and the
+    layovers, never comes back to `origin` and stops at `destination`
+    """
+    store = graph.store
+    outgoing = {}
+    for i in store.live().tolist():
+        outgoing.setdefault(int(store.origin[i]), []).append(i)
+    stack = [(origin, None, None, 0, 0)]
+    while stack:
+        node, departure, arrival, price, hops = stack.pop()
+        if hops:
+            yield node, departure, arrival, price
+        if hops == max_hops or node == destination:
+            continue
+        earliest, latest = window.bounds(arrival)
+        for i in outgoing.get(node, ()):
+            if earliest <= store.departure[i] <= latest and store.destination[i] != origin:
+                stack.append((
+                    int(store.destination[i]), int(store.departure[i]) if departure is None else departure,
+                    int(store.arrival[i]), price + int(store.price[i]), hops + 1,
+                ))
+
+
+def brute_force_round_trips(graph, origin, max_price, max_hops, window, return_window, min_stay, max_stay):
+    """
+    Price in EUR cents of the cheapest round trip to every node, trying
+    every outbound itinerary with every return itinerary
+    """
+    budget = to_minor(max_price)
+    best = {}
+    outbound = {}
+    for node, _, arrival, price in itineraries(graph, origin, max_hops, window):
+        outbound.setdefault(node, []).append((arrival, price))
+    for node, arrivals in outbound.items():
+        for end, departure, _, back in itineraries(graph, node, max_hops, return_window, origin):
+            if end != origin:
+                continue
+            for arrival, price in arrivals:
+                if min_stay <= departure - arrival <= max_stay and price + back <= budget:
+                    best[node] = min(best.get(node, budget), price + back)
+    return best
+
+
+def pairs(graph, count, seed=0):
+    """
+    Random node pairs, every other one from a node with connections to a
+    node a few random connections away
+    """
+    rnd = random.Random(seed)
+    store = graph.store
+    origins = [node for node in graph.nodes if len(store.outgoing(node.id))]
+    result = []
+    for i in range(count):
+        n1, n2 = rnd.sample(graph.nodes, 2)
+        if i % 2:
+            n1 = rnd.choice(origins)
+            node = n1.id
+            for _ in range(rnd.randint(1, 3)):
+                outgoing = store.outgoing(node)
+                if len(outgoing):
+                    node = int(store.destination[rnd.choice(outgoing.tolist())])
+            if node != n1.id:
+                n2 = graph.nodes[node]
+        result.append((n1, n2))
+    return result
+
+
+def check_route(graph, route, origin, destination, window):
+    path = route['path']
+    assert path[0].n1.id == origin and path[-1].n2.id == destination
+    assert all(a.n2 == b.n1 for a, b in zip(path, path[1:]))
+    arrival = None
+    for connection in path:
+        earliest, latest = window.bounds(arrival)
+        assert earliest <= to_minutes(connection.departure) <= latest
+        arrival = to_minutes(connection.arrival)
+    assert round(sum(connection.price for connection in path), 2) == round(route['price'], 2)
+
+
+def test_cheapest_path_matches_brute_force(sample_graph):
+    windows = [
+        Window(),
+        Window(departure_to=DEPARTURE_FROM + timedelta(days=12), min_layover=timedelta(hours=2)),
+        Window(min_layover=timedelta(hours=1), max_layover=timedelta(days=3)),
+    ]
+    for n1, n2 in pairs(sample_graph, 60):
+        for window in windows:
+            for hops in (1, 2, 3):
+                route = cheapest_path(sample_graph, n1, n2, max_hops=hops, window=window)
+                expected = brute_force(sample_graph, n1.id, n2.id, hops, window)
+                if expected is None:
+                    assert route is None
+                    continue
+                assert round(route['price'] * 100) == expected
+                assert route['hops'] <= hops
+                check_route(sample_graph, route, n1.id, n2.id, window)
+
+
+def test_cheapest_path_keeps_the_price_limit(sample_graph):
+    for n1, n2 in pairs(sample_graph, 30, seed=1):
+        route = cheapest_path(sample_graph, n1, n2, max_hops=3)
+        if route is None:
+            continue
+        assert cheapest_path(sample_graph, n1, n2, max_price=route['price'], max_hops=3)['price'] == route['price']
+        assert cheapest_path(sample_graph, n1, n2, max_price=route['price'] - 0.01, max_hops=3) is None
+
+
+def test_round_trips_match_brute_force(sample_graph):
+    cities = sample_graph.store.cities
+    limits = [
+        (1000, timedelta(days=2), timedelta(days=14)),
+        (1000, timedelta(days=1), timedelta(days=3)),
+        (80, timedelta(days=2), timedelta(days=7)),
+    ]
+    found = 0
+    for city in ('Riga', 'Katowice', 'Kiev - Zhulyany'):
+        origin = sample_graph.nodes[cities.index(city)]
+        for max_price, min_stay, max_stay in limits:
+            for max_hops in (1, 2):
+                window = Window(min_layover=timedelta(hours=2))
+                return_window = Window(DEPARTURE_FROM + min_stay, min_layover=timedelta(hours=2))
+                trips = round_trips(sample_graph, origin, max_price=max_price, max_hops=max_hops, window=window,
+                                    return_window=return_window, min_stay=min_stay, max_stay=max_stay)
+                expected = brute_force_round_trips(sample_graph, origin.id, max_price, max_hops, window,
+                                                   return_window, min_stay // MINUTE, max_stay // MINUTE)
+                assert {trip['outbound']['path'][-1].n2.id: round(trip['price'] * 100) for trip in trips} == expected
+                for trip in trips:
+                    outbound, back = trip['outbound']['path'], trip['return']['path']
+                    assert outbound[0].n1 == origin and back[-1].n2 == origin
+                    assert outbound[-1].n2 == back[0].n1
+                    assert trip['stay'] == back[0].departure - outbound[-1].arrival
+                    assert min_stay <= trip['stay'] <= max_stay
+                    check_route(sample_graph, trip['outbound'], origin.id, outbound[-1].n2.id, window)
+                    check_route(sample_graph, trip['return'], back[0].n1.id, origin.id, return_window)
+                found += len(trips)
+    assert found > 0
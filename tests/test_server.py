@@ -0,0 +1,109 @@
+import asyncio
+import json
+import os
+import threading
+
+from travel.graph import Graph
+from travel.server import RouteServer
+
+from conftest import SAMPLE_DATA
+
+
+def respond(server, method, target, body=b''):
+    return asyncio.run(server.respond(method, target, body))
+
+
+def empty_feed(tmp_path, name):
+    with open(os.path.join(SAMPLE_DATA, '{}.csv'.format(name))) as f:
+        header = f.readline()
+    (tmp_path / '{}.csv'.format(name)).write_text(header)
+    return '{}.csv'.format(name)
+
+
+def test_malformed_update_is_a_bad_request():
+    server = RouteServer(Graph(), workers=1)
+    for body in (b'{"carrier": ', b'\xff\xfe', b'[]', b'{"carrier": "wizzair"}'):
+        status, payload = respond(server, 'POST', '/update', body)
+        assert status == 400, payload
+    server.executor.shutdown()
+
+
+def test_update_reads_only_the_feed_directory(sample_graph, tmp_path):
+    feeds = tmp_path / 'feeds'
+    feeds.mkdir()
+    empty_feed(tmp_path, 'ryanair')
+    (feeds / 'broken.csv').write_text('origin,destination\nRiga,Katowice\n')
+    for path, expected in (('../ryanair.csv', 403), (str(tmp_path / 'ryanair.csv'), 403),
+                           ('missing.csv', 400), ('broken.csv', 400)):
+        server = RouteServer(sample_graph, workers=1, feed_dir=str(feeds))
+        status, payload = respond(server, 'POST', '/update', json.dumps({'carrier': 'ryanair', 'path': path}).encode())
+        assert status == expected, payload
+        assert server.graph is sample_graph
+        server.executor.shutdown()
+    server = RouteServer(sample_graph, workers=1)
+    body = json.dumps({'carrier': 'ryanair', 'path': 'ryanair.csv'}).encode()
+    assert respond(server, 'POST', '/update', body)[0] == 403
+    server.executor.shutdown()
+
+
+def test_failed_queries_are_measured(sample_graph, monkeypatch):
+    server = RouteServer(sample_graph, workers=1)
+    assert respond(server, 'GET', '/route?from=Riga')[0] == 400
+    assert respond(server, 'GET', '/route?from=Atlantis&to=Riga')[0] == 404
+    monkeypatch.setattr(Graph, 'path', lambda *args, **kwargs: 1 / 0)
+    assert respond(server, 'GET', '/route?from=Riga&to=Katowice')[0] == 500
+    metrics = server.metrics.as_dict()
+    assert metrics['queries'] == 3 and metrics['errors'] == 3 and 'p99_ms' in metrics
+    server.executor.shutdown()
+
+
+def test_route_by_city_name(sample_graph):
+    server = RouteServer(sample_graph, workers=1)
+    status, route = respond(server, 'GET', '/route?from=Riga&to=Katowice&max_hops=3')
+    assert status == 200
+    cities = sample_graph.store.cities
+    expected = sample_graph.path(sample_graph.nodes[cities.index('Riga')],
+                                 sample_graph.nodes[cities.index('Katowice')], max_hops=3)
+    assert route['price'] == round(expected['price'], 2)
+    assert route['path'][0]['from'] == 'Riga' and route['path'][-1]['to'] == 'Katowice'
+    assert respond(server, 'GET', '/route?from=Atlantis&to=Riga')[0] == 404
+    server.executor.shutdown()
+
+
+def test_update_swaps_in_a_changed_copy(sample_graph, tmp_path):
+    server = RouteServer(sample_graph, workers=1, feed_dir=str(tmp_path))
+    before = len(sample_graph.store.live())
+    body = json.dumps({'carrier': 'ryanair', 'path': empty_feed(tmp_path, 'ryanair')}).encode('utf-8')
+    status, delta = respond(server, 'POST', '/update', body)
+    assert status == 200 and delta['removed'] > 0
+    assert server.graph is not sample_graph
+    assert len(sample_graph.store.live()) == before
+    assert len(server.graph.store.live()) == before - delta['removed']
+    server.executor.shutdown()
+
+
+def test_queries_do_not_wait_for_an_update(sample_graph, tmp_path, monkeypatch):
+    server = RouteServer(sample_graph, workers=1, feed_dir=str(tmp_path))
+    started = threading.Event()
+    release = threading.Event()
+    update = Graph.update
+
+    def slow_update(graph, f, name, feed_filter=None):
+        started.set()
+        release.wait(30)
+        return update(graph, f, name, feed_filter)
+
+    monkeypatch.setattr(Graph, 'update', slow_update)
+    request = {'carrier': 'ryanair', 'path': empty_feed(tmp_path, 'ryanair')}
+    thread = threading.Thread(target=server.update, args=(request,))
+    thread.start()
+    try:
+        assert started.wait(30)
+        route = server.route({'from': 'Riga', 'to': 'Katowice', 'max_hops': '3'})
+        assert server.graph is sample_graph
+    finally:
+        release.set()
+        thread.join(30)
+    assert route is not None
+    assert server.graph is not sample_graph
+    server.executor.shutdown()
@@ -0,0 +1,113 @@
+import os
+import shutil
+from datetime import timedelta
+
+import numpy as np
+import pytest
+
+from travel import snapshot
+from travel.graph import Graph
+from travel.search import DEPARTURE_FROM
+from travel.snapshot import SnapshotError
+from travel.store import CONNECTION_COLUMNS, NODE_COLUMNS
+
+from conftest import FEEDS, SAMPLE_DATA
+
+
+def sources(directory):
+    paths = []
+    for name in FEEDS:
+        path = os.path.join(str(directory), '{}.csv'.format(name))
+        shutil.copy(os.path.join(SAMPLE_DATA, '{}.csv'.format(name)), path)
+        paths.append(path)
+    return paths
+
+
+def test_snapshot_round_trip(sample_graph, tmp_path):
+    path = str(tmp_path / 'graph.snapshot')
+    sample_graph.save(path)
+    loaded = Graph.load(path)
+    store, expected = loaded.store, sample_graph.store
+    assert store.cities == expected.cities and store.carriers == expected.carriers
+    for column, _ in CONNECTION_COLUMNS:
+        assert np.array_equal(store.column(column), expected.column(column))
+    for column, _ in NODE_COLUMNS:
+        assert np.array_equal(getattr(store, column)[:store.node_count],
+                              getattr(expected, column)[:expected.node_count])
+    for array, built in zip(store.adjacency(), expected.adjacency()):
+        assert np.array_equal(array, built)
+    assert {point: node.id for point, node in loaded.coords_cache.items()} == {
+        point: node.id for point, node in sample_graph.coords_cache.items()
+    }
+    for n1, n2 in zip(sample_graph.nodes[:20], sample_graph.nodes[-20:]):
+        route = sample_graph.path(n1, n2, max_hops=3)
+        found = loaded.path(loaded.nodes[n1.id], loaded.nodes[n2.id], max_hops=3)
+        assert (found and found['price']) == (route and route['price'])
+
+
+def test_loaded_snapshot_can_grow(sample_graph, tmp_path):
+    path = str(tmp_path / 'graph.snapshot')
+    sample_graph.save(path)
+    loaded = Graph.load(path)
+    n1, n2 = loaded.nodes[0], loaded.nodes[1]
+    departure = DEPARTURE_FROM + timedelta(days=5)
+    loaded.edge(n1, n2, 0.5, 'wizzair', departure, departure + timedelta(hours=1))
+    assert loaded.path(n1, n2)['price'] == 0.5
+    assert len(Graph.load(path).store) == len(sample_graph.store)
+
+
+def test_stale_snapshot_is_detected(tmp_path):
+    paths = sources(tmp_path)
+    path = str(tmp_path / 'graph.snapshot')
+    Graph().save(path, paths)
+    Graph.load(path, paths)
+    with open(paths[0], 'a') as f:
+        f.write('\n')
+    with pytest.raises(SnapshotError):
+        Graph.load(path, paths)
+    with pytest.raises(SnapshotError):
+        Graph.load(path, paths[1:])
+
+
+def test_other_files_are_not_snapshots(tmp_path):
+    path = tmp_path / 'graph.snapshot'
+    path.write_bytes(b'not a snapshot at all, just some bytes')
+    with pytest.raises(SnapshotError):
+        Graph.load(str(path))
+    path.write_bytes(snapshot.PREAMBLE.pack(snapshot.MAGIC, snapshot.VERSION - 1, 0))
+    with pytest.raises(SnapshotError):
+        Graph.load(str(path))
+
+
+def test_truncated_snapshot_is_detected(sample_graph, tmp_path):
+    path = tmp_path / 'graph.snapshot'
+    sample_graph.save(str(path))
+    data = path.read_bytes()
+    _, version, length = snapshot.PREAMBLE.unpack(data[:snapshot.PREAMBLE.size])
+    data_offset = snapshot.PREAMBLE.size + length
+    for size in (4, data_offset - length // 2, data_offset + 100, (data_offset + len(data)) // 2):
+        path.write_bytes(data[:size])
+        with pytest.raises(SnapshotError):
+            Graph.load(str(path))
+    path.write_bytes(snapshot.PREAMBLE.pack(snapshot.MAGIC, version, 8) + b'{"colum')
+    with pytest.raises(SnapshotError):
+        Graph.load(str(path))
+
+
+def test_failed_save_keeps_the_old_snapshot(sample_graph, tmp_path, monkeypatch):
+    path = str(tmp_path / 'graph.snapshot')
+    sample_graph.save(path)
+    saved = open(path, 'rb').read()
+    sample_graph.edge(sample_graph.nodes[0], sample_graph.nodes[1], 0.5, 'wizzair',
+                      DEPARTURE_FROM, DEPARTURE_FROM + timedelta(hours=1))
+
+    def interrupted(source, target):
+        raise KeyboardInterrupt
+
+    monkeypatch.setattr(snapshot.os, 'replace', interrupted)
+    with pytest.raises(KeyboardInterrupt):
+        sample_graph.save(path)
+    monkeypatch.undo()
+    with open(path, 'rb') as f:
+        assert f.read() == saved
+    assert os.listdir(str(tmp_path)) == ['graph.snapshot']
@@ -0,0 +1,115 @@
+import json
+from datetime import datetime
+
+from scrapy.http import HtmlResponse, Request, TextResponse
+from scrapy.utils.test import get_crawler
+
+from travel import ecolines, ryanair, wizzair
+from travel.ecolines import EcolinesSpider
+
+ROUTE = {
+    'origin_id': 1, 'origin_title': 'Riga', 'origin_state': 'LV', 'origin_lat': 56.95, 'origin_lon': 24.1,
+    'destination_id': 2, 'destination_title': 'Kyiv', 'destination_state': 'UA',
+    'destination_lat': 50.45, 'destination_lon': 30.52,
+}
+JOURNEY = (
+    '<div class="journey">'
+    '<div class="origin"><span class="time">{departure}</span><span class="date">2018-01-10</span></div>'
+    '<div class="destination"><span class="time">09:00</span><span class="date">2018-01-11</span></div>'
+    '<a class="btn-primary"><span class="btn-label">Buy</span>{price}</a>'
+    '</div>'
+)
+
+
+def json_response(url, body, meta=None, priority=0):
+    request = Request(url, meta=meta or {}, priority=priority)
+    return TextResponse(url, body=json.dumps(body).encode('utf-8'), encoding='utf-8', request=request)
+
+
+def booking_page(journeys):
+    html = '<html><body>{}</body></html>'.format(''.join(
+        JOURNEY.format(departure=departure, price='<span>{}</span>'.format(price) if price else '')
+        for departure, price in journeys
+    ))
+    url = ecolines.BOOKING.format(orig=1, dest=2, currency=ecolines.UAH, date='2018-01-10')
+    request = Request(url, meta=dict(ROUTE, currency=ecolines.UAH, date=0))
+    return HtmlResponse(url, body=html.encode('utf-8'), encoding='utf-8', request=request)
+
+
+def ecolines_spider(months):
+    crawler = get_crawler(EcolinesSpider)
+    return EcolinesSpider.from_crawler(crawler, months=months)
+
+
+def timestamp(day):
+    return int(datetime(2018, 1, day, 12).timestamp()) * 1000
+
+
+def test_ecolines_requests_every_month_earliest_first():
+    spider = ecolines_spider(months=3)
+    destinations = [
+        {'id': 2, 'title': 'Kyiv', 'state': 'UA', 'location': {'latitude': 50.45, 'longitude': 30.52}},
+        {'id': 3, 'title': 'Paris', 'state': 'FR', 'location': {'latitude': 48.85, 'longitude': 2.35}},
+    ]
+    response = json_response(ecolines.DEST_URL.format(orig=1), destinations, meta={'origin_id': 1})
+    requests = list(spider.destination(response))
+    assert [request.url for request in requests] == [
+        ecolines.DATES_URL.format(orig=1, dest=2, year=2018, month=month) for month in (1, 2, 3)
+    ]
+    assert [request.priority for request in requests] == [0, -1, -2]
+
+
+def test_ecolines_books_every_date_once():
+    spider = ecolines_spider(months=2)
+    january = json_response('https://booking.ecolines.net/dates/1', [timestamp(10), timestamp(11)], ROUTE)
+    february = json_response('https://booking.ecolines.net/dates/2', [timestamp(11), timestamp(12)], ROUTE,
+                             priority=-1)
+    first = list(spider.dates(january))
+    second = list(spider.dates(february))
+    assert len(first) == 2
+    assert len(second) == 1
+    assert [request.priority for request in first + second] == [2, 2, 1]
+    assert spider.crawler.stats.get_value('ecolines/duplicate_dates') == 1
+
+
+def test_ecolines_yields_every_priced_journey_once():
+    spider = ecolines_spider(months=1)
+    items = list(spider.booking(booking_page([('06:00', '25'), ('07:00', None), ('08:00', '30'), ('06:00', '25')])))
+    assert [item['departureDate'] for item in items] == [datetime(2018, 1, 10, 6), datetime(2018, 1, 10, 8)]
+    assert [item['price'] for item in items] == ['25', '30']
+    assert items[0]['arrivalDate'] == datetime(2018, 1, 11, 9)
+    assert items[0]['origin_title'] == 'Riga' and items[0]['currencyCode'] == ecolines.UAH
+
+    again = list(spider.booking(booking_page([('08:00', '30'), ('10:00', '45')])))
+    assert [item['departureDate'] for item in again] == [datetime(2018, 1, 10, 10)]
+
+
+def test_ryanair_yields_every_outbound_fare():
+    spider = ryanair.RyanairSpider()
+    spider.airports = {'SXF': {'countryCode': 'de', 'coordinates': {'latitude': 52.38, 'longitude': 13.52}}}
+    fares = [{'outbound': {
+        'arrivalAirport': {'iataCode': 'SXF', 'name': 'Berlin Schoenefeld'},
+        'departureDate': '2018-01-{:02d}T06:30:00'.format(day),
+        'arrivalDate': '2018-01-{:02d}T08:00:00'.format(day),
+        'price': {'value': 19.99, 'currencyCode': 'EUR'},
+    }} for day in (3, 4, 5)]
+    origin = ryanair.Origin('RIX', 'Riga', 'LV', 56.92, 23.97)
+    response = json_response('https://api.ryanair.com/farefinder', {'fares': fares + [{}]}, {'origin': origin})
+    items = list(spider.fares(response))
+    assert len(items) == 3
+    assert list(items[0]) == ryanair.FIELDS
+    assert items[0]['destination_state'] == 'DE' and items[0]['origin_airport'] == 'RIX'
+
+
+def test_wizzair_skips_flights_without_price():
+    spider = wizzair.WizzairSpider()
+    route = wizzair.Route('TLL', 'Tallinn', 'EE', 59.41, 24.83, 'KTW', 'Katowice', 'PL', 50.47, 19.08)
+    flights = [
+        {'departureDate': '2018-01-10T07:10:00', 'price': {'amount': 9.99, 'currencyCode': 'EUR'}},
+        {'departureDate': '2018-01-11T07:10:00', 'price': None},
+        {'departureDate': '2018-01-12T07:10:00', 'price': {'amount': 19.99, 'currencyCode': 'EUR'}},
+    ]
+    response = json_response(wizzair.TIMETABLE, {'outboundFlights': flights}, {'route': route})
+    items = list(spider.timetable(response))
+    assert [item['departureDate'] for item in items] == ['2018-01-10T07:10:00', '2018-01-12T07:10:00']
+    assert list(items[0]) == wizzair.FIELDS
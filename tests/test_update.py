@@ -0,0 +1,93 @@
+import csv
+import os
+import random
+
+from travel.graph import Graph, process_routes
+
+from conftest import SAMPLE_DATA
+
+
+def rows(name):
+    with open(os.path.join(SAMPLE_DATA, '{}.csv'.format(name)), newline='') as f:
+        reader = csv.DictReader(f)
+        return reader.fieldnames, list(reader)
+
+
+def write(path, header, rows):
+    with open(path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, header)
+        writer.writeheader()
+        writer.writerows(rows)
+    return path
+
+
+def newer_feed(tmp_path):
+    """
+    The sample wizzair feed with a tenth of its rows dropped, a tenth
+    repriced and a few moved to other days
+    """
+    rnd = random.Random(0)
+    header, feed = rows('wizzair')
+    newer = []
+    for row in feed:
+        draw = rnd.random()
+        if draw < 0.1:
+            continue
+        row = dict(row)
+        if draw < 0.2:
+            row['price'] = '{:.2f}'.format(float(row['price']) / 2)
+        elif draw < 0.25:
+            row['departureDate'] = row['departureDate'].replace('2018-01-1', '2018-02-1')
+        newer.append(row)
+    return write(str(tmp_path / 'wizzair.csv'), header, newer)
+
+
+def connections(graph):
+    """
+    Price of every live connection by carrier, end coordinates and times
+    """
+    store = graph.store
+    result = {}
+    for i in store.live().tolist():
+        key = (
+            store.carriers[store.carrier[i]],
+            float(store.lat[store.origin[i]]), float(store.lon[store.origin[i]]),
+            float(store.lat[store.destination[i]]), float(store.lon[store.destination[i]]),
+            int(store.departure[i]), int(store.arrival[i]),
+        )
+        result[key] = min(result.get(key, int(store.price[i])), int(store.price[i]))
+    return result
+
+
+def load(paths):
+    graph = Graph(cache_size=0)
+    for path, name in paths:
+        with open(path) as f:
+            process_routes(f, name, graph)
+    return graph
+
+
+def test_update_matches_a_fresh_load(sample_graph, tmp_path):
+    path = newer_feed(tmp_path)
+    with open(path) as f:
+        delta = sample_graph.update(f, 'wizzair')
+    assert delta.added and delta.removed and delta.updated and delta.unchanged
+    fresh = load([(path, 'wizzair'), (os.path.join(SAMPLE_DATA, 'ryanair.csv'), 'ryanair')])
+    assert connections(sample_graph) == connections(fresh)
+    assert len(sample_graph.store.live()) == len(connections(fresh))
+
+    with open(path) as f:
+        again = sample_graph.update(f, 'wizzair')
+    assert (again.added, again.removed, again.updated) == (0, 0, 0)
+
+
+def test_update_then_compact_keeps_routes(sample_graph, tmp_path):
+    with open(newer_feed(tmp_path)) as f:
+        sample_graph.update(f, 'wizzair')
+    rnd = random.Random(1)
+    pairs = [rnd.sample(sample_graph.nodes, 2) for _ in range(100)]
+    before = [sample_graph.path(n1, n2, max_hops=3) for n1, n2 in pairs]
+    sample_graph.compact()
+    assert len(sample_graph.store) == len(sample_graph.store.live())
+    after = [sample_graph.path(n1, n2, max_hops=3) for n1, n2 in pairs]
+    assert [route and route['price'] for route in after] == [route and route['price'] for route in before]
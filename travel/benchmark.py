@@ -0,0 +1,992 @@
+import argparse
+import csv
+import json
+import os
+import random
+import tempfile
+import time
+from datetime import timedelta
+
+import numpy as np
+
+from travel import fares, synthetic
+from travel.cache import RouteCache
+from travel.currency import RateTable, default_rates, to_minor
+from travel.graph import Graph, process_routes
+from travel.loader import date_parser, load_parallel, parse_any, read_feed
+from travel.profiling import INSTRUMENTS, PROFILERS, profiled
+from travel.search import SearchStats, Window
+from travel.spatial import GridIndex
+from travel.store import CONNECTION_COLUMNS
+from travel.utils import coord_distance, distance_matrix
+
+SAMPLE_DATA = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'sample_data')
+FEEDS = ['wizzair', 'ryanair']
+
+ROUTES = [
+    ('Kiev - Zhulyany', 'Paris Beauvais'),
+    ('Kiev - Zhulyany', 'Riga'),
+    ('Riga', 'Paris Beauvais'),
+    ('Riga', 'Kiev - Zhulyany'),
+    ('Tallinn', 'London Luton'),
+]
+
+
+def load_sample(data_dir=SAMPLE_DATA):
+    g = Graph()
+    for name in FEEDS:
+        with open(os.path.join(data_dir, '{}.csv'.format(name))) as f:
+            process_routes(f, name, g)
+    return g
+
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+
+def find_city(g, city):
+    for node in g.nodes:
+        if node.city == city:
+            return node
+    raise KeyError(city)
+
+
+def bench_search(args):
+    g = load_sample(args.data)
+    print('{:<40} {:>4} {:>10} {:>10}'.format('route', 'hops', 'ms', 'EUR'))
+    for hops in range(2, args.max_hops + 1):
+        for origin, destination in ROUTES:
+            n1 = find_city(g, origin)
+            n2 = find_city(g, destination)
+            elapsed, route = timed(g.path, n1, n2, max_hops=hops)
+            price = '{:.2f}'.format(route['price']) if route else '-'
+            print('{:<40} {:>4} {:>10.2f} {:>10}'.format(
+                '{} -> {}'.format(origin, destination), hops, elapsed * 1000, price,
+            ))
+
+
+def bench_astar(args):
+    g = load_sample(args.data)
+    g.cache = RouteCache(0)
+    g.bounds()
+    searches = [
+        ('cheapest, dijkstra', lambda n1, n2, stats: g.path(n1, n2, max_hops=args.max_hops, stats=stats)),
+        ('cheapest, astar', lambda n1, n2, stats: g.path(n1, n2, max_hops=args.max_hops, method='astar', stats=stats)),
+        ('cheapest, bidirectional', lambda n1, n2, stats: g.path(n1, n2, max_hops=args.max_hops,
+                                                                 method='bidirectional', stats=stats)),
+        ('fastest, dijkstra', lambda n1, n2, stats: g.fastest(n1, n2, max_hops=args.max_hops, astar=False,
+                                                              stats=stats)),
+        ('fastest, astar', lambda n1, n2, stats: g.fastest(n1, n2, max_hops=args.max_hops, stats=stats)),
+    ]
+    print('{:<40} {:<24} {:>8} {:>9} {:>9} {:>18}'.format('route', 'search', 'ms', 'expanded', 'EUR', 'arrival'))
+    for origin, destination in ROUTES:
+        n1 = find_city(g, origin)
+        n2 = find_city(g, destination)
+        for name, search in searches:
+            stats = SearchStats()
+            elapsed, route = timed(search, n1, n2, stats)
+            print('{:<40} {:<24} {:>8.2f} {:>9} {:>9} {:>18}'.format(
+                '{} -> {}'.format(origin, destination), name, elapsed * 1000, stats.expanded,
+                '{:.2f}'.format(route['price']) if route else '-',
+                route['path'][-1].arrival.strftime('%Y-%m-%d %H:%M') if route else '-',
+            ))
+
+
+def bench_patterns(args):
+    g = load_sample(args.data)
+    g.cache = RouteCache(0)
+    path = os.path.join(tempfile.mkdtemp(), 'graph.patterns')
+    elapsed_build, patterns = timed(g.load_patterns, path, args.max_hops)
+    elapsed_load, _ = timed(g.load_patterns, path, args.max_hops)
+    print('{} sequences up to {} hops: build {:.0f} ms, load {:.1f} ms, {} bytes'.format(
+        len(patterns.sequences), args.max_hops, elapsed_build * 1000, elapsed_load * 1000, os.path.getsize(path),
+    ))
+    rnd = random.Random(args.seed)
+    pairs = [rnd.sample(g.nodes, 2) for _ in range(args.queries)]
+    g.path(*pairs[0], max_hops=args.max_hops, method='patterns')
+    for hops in range(1, args.max_hops + 1):
+        elapsed_search, expected = timed(lambda: [g.path(n1, n2, max_hops=hops) for n1, n2 in pairs])
+        elapsed_patterns, found = timed(lambda: [g.path(n1, n2, max_hops=hops, method='patterns') for n1, n2 in pairs])
+        same = sum(
+            1 for a, b in zip(expected, found)
+            if (a is None and b is None) or (a and b and abs(a['price'] - b['price']) < 1e-6)
+        )
+        print('{} hops: search {:.3f} ms/query, patterns {:.3f} ms/query, same price {}/{}'.format(
+            hops, elapsed_search / len(pairs) * 1000, elapsed_patterns / len(pairs) * 1000, same, len(pairs),
+        ))
+    store = g.store
+    live = store.live()
+    for share in args.repriced:
+        repriced = np.sort(np.array(rnd.sample(live.tolist(), int(len(live) * share)), dtype=np.int64))
+        store.update(repriced, store.price[repriced] + 1, store.arrival[repriced])
+        elapsed_refresh, searched = timed(g.refresh_patterns)
+        print('{:.1%} of fares repriced: refresh {:.0f} ms, {} of {} origins searched again'.format(
+            share, elapsed_refresh * 1000, searched, store.node_count,
+        ))
+    os.remove(path)
+
+
+def bench_pareto(args):
+    g = load_sample(args.data)
+    for origin, destination in ROUTES:
+        n1 = find_city(g, origin)
+        n2 = find_city(g, destination)
+        stats = SearchStats()
+        elapsed, routes = timed(g.pareto, n1, n2, max_hops=args.max_hops, max_labels=args.max_labels, stats=stats)
+        busiest = max(stats.label_counts.values()) if stats.label_counts else 0
+        print('{} -> {}: {:.2f} ms, {} routes, {} labels, {} at busiest node'.format(
+            origin, destination, elapsed * 1000, len(routes), stats.labels, busiest,
+        ))
+        for route in routes:
+            print('    {:>8.2f} EUR {:>18} {} hops'.format(route['price'], str(route['duration']), route['hops']))
+
+
+def bench_window(args):
+    g = load_sample(args.data)
+    store = g.store
+    window = Window()
+    offsets, order, departures = store.adjacency()
+    rnd = random.Random(args.seed)
+    hubs = sorted(range(store.node_count), key=lambda node: offsets[node + 1] - offsets[node])[-args.hubs:]
+    departure_lists = {node: departures[offsets[node]:offsets[node + 1]].tolist() for node in hubs}
+    queries = [
+        (node, rnd.randint(window.departure_from, window.departure_to))
+        for node in hubs
+        for _ in range(args.queries)
+    ]
+
+    def linear():
+        found = 0
+        for node, arrival in queries:
+            earliest, latest = window.bounds(arrival)
+            for departure in departure_lists[node]:
+                if earliest <= departure <= latest:
+                    found += 1
+        return found
+
+    def binary():
+        found = 0
+        for node, arrival in queries:
+            begin, end = store.departures_between(node, *window.bounds(arrival))
+            found += end - begin
+        return found
+
+    elapsed_linear, found_linear = timed(linear)
+    elapsed_binary, found_binary = timed(binary)
+    print('{} busiest nodes, {} to {} departures each'.format(
+        len(hubs), min(map(len, departure_lists.values())), max(map(len, departure_lists.values())),
+    ))
+    print('linear scan   {:.2f} us/expansion'.format(elapsed_linear / len(queries) * 1e6))
+    print('binary search {:.2f} us/expansion'.format(elapsed_binary / len(queries) * 1e6))
+    print('same connections: {}'.format(found_linear == found_binary))
+
+
+def bench_roundtrip(args):
+    g = load_sample(args.data)
+    g.cache.maxsize = 0
+    min_stay = timedelta(days=args.min_stay)
+    max_stay = timedelta(days=args.max_stay)
+    for origin in sorted(set(origin for origin, _ in ROUTES)):
+        home = find_city(g, origin)
+        elapsed, trips = timed(g.round_trips, home, max_hops=args.max_hops, min_stay=min_stay, max_stay=max_stay)
+
+        def by_hand():
+            # The cheapest way there, then the cheapest way back on every
+            # day of the stay: one path call per destination and day
+            found = {}
+            for trip in trips:
+                destination = trip['outbound']['path'][-1].n2
+                outbound = g.path(home, destination, max_hops=args.max_hops)
+                if outbound is None:
+                    continue
+                arrival = outbound['path'][-1].arrival
+                for day in range(args.min_stay, args.max_stay + 1):
+                    back = g.path(destination, home, max_hops=args.max_hops,
+                                  departure_from=arrival + timedelta(days=day),
+                                  departure_to=arrival + min(timedelta(days=day + 1), max_stay))
+                    if back is not None and outbound['price'] + back['price'] < found.get(destination, float('inf')):
+                        found[destination] = outbound['price'] + back['price']
+            return found
+        elapsed_by_hand, found = timed(by_hand)
+        dearer = sum(
+            1 for trip in trips
+            if trip['outbound']['path'][-1].n2 in found
+            and found[trip['outbound']['path'][-1].n2] > trip['price'] + 0.005
+        )
+        print('{:<16} {:3} destinations: one pass {:7.1f} ms, path calls per day {:8.1f} ms, {:4.0f}x; '
+              'by hand {} found, {} dearer'.format(
+                  origin, len(trips), elapsed * 1000, elapsed_by_hand * 1000,
+                  elapsed_by_hand / elapsed if elapsed else 0, len(found), dearer,
+              ))
+
+
+def bench_matrix(args):
+    g = load_sample(args.data)
+    origins = g.nodes[:args.origins]
+
+    def pairwise():
+        return [[g.path(n1, n2, max_hops=args.max_hops) for n2 in g.nodes] for n1 in origins]
+
+    elapsed_pairwise, _ = timed(pairwise)
+    elapsed_tree, _ = timed(lambda: [g.cheapest_from(n1, max_hops=args.max_hops) for n1 in origins])
+    print('{} origins x {} nodes: Graph.path per pair {:.0f} ms, cheapest_from {:.0f} ms'.format(
+        len(origins), len(g.nodes), elapsed_pairwise * 1000, elapsed_tree * 1000,
+    ))
+    for workers in args.workers:
+        stats = SearchStats()
+        elapsed, matrix = timed(g.matrix, max_hops=args.max_hops, workers=workers, stats=stats)
+        print('full matrix, {} workers: {:.0f} ms, {}, {} labels expanded'.format(
+            workers, elapsed * 1000, matrix, stats.expanded,
+        ))
+    if args.export:
+        matrix.save(args.export)
+        print('saved to {}'.format(args.export))
+
+
+def bench_cache(args):
+    g = load_sample(args.data)
+    rnd = random.Random(args.seed)
+    pairs = [(find_city(g, origin), find_city(g, destination)) for origin, destination in ROUTES]
+    pairs += [tuple(rnd.sample(g.nodes, 2)) for _ in range(args.pairs - len(pairs))]
+    weights = [1 / (rank + 1) for rank in range(len(pairs))]
+    queries = rnd.choices(pairs, weights, k=args.queries)
+    cache, g.cache = g.cache, RouteCache(0)
+    elapsed_uncached, _ = timed(lambda: [g.path(n1, n2) for n1, n2 in queries])
+    g.cache = cache
+    elapsed_cached, _ = timed(lambda: [g.path(n1, n2) for n1, n2 in queries])
+    print('{} queries over {} pairs: uncached {:.1f} us/query, cached {:.1f} us/query, hit rate {:.1%}'.format(
+        len(queries), len(pairs), elapsed_uncached / len(queries) * 1e6,
+        elapsed_cached / len(queries) * 1e6, g.cache.hit_rate,
+    ))
+    print(g.cache)
+
+
+def bench_update(args):
+    g = load_sample(args.data)
+    rnd = random.Random(args.seed)
+    name = FEEDS[0]
+    with open(os.path.join(args.data, '{}.csv'.format(name))) as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        rows = [row for row in reader if row]
+    price = header.index('price')
+    crawl = []
+    for row in rows:
+        if rnd.random() < args.removed:
+            continue
+        if rnd.random() < args.repriced:
+            row = row[:price] + ['{:.2f}'.format(float(row[price]) * rnd.uniform(0.8, 1.2))] + row[price + 1:]
+        crawl.append(row)
+    path = os.path.join(tempfile.mkdtemp(), '{}.csv'.format(name))
+    with open(path, 'w') as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        writer.writerows(crawl)
+
+    def rebuild():
+        rebuilt = Graph()
+        for feed in FEEDS:
+            with open(path if feed == name else os.path.join(args.data, '{}.csv'.format(feed))) as f:
+                process_routes(f, feed, rebuilt)
+
+    elapsed_rebuild, _ = timed(rebuild)
+    with open(path) as f:
+        elapsed_update, delta = timed(g.update, f, name)
+    print(delta)
+    print('rebuild from all feeds {:.0f} ms, update in place {:.0f} ms'.format(
+        elapsed_rebuild * 1000, elapsed_update * 1000,
+    ))
+    os.remove(path)
+
+
+def bench_server(args):
+    import asyncio
+    import json
+
+    from travel.server import RouteServer
+
+    g = load_sample(args.data)
+    if args.no_cache:
+        g.cache = RouteCache(0)
+    rnd = random.Random(args.seed)
+    queries = [rnd.sample(g.nodes, 2) for _ in range(args.queries)]
+
+    async def request(reader, writer, method, target, body=b''):
+        writer.write('{} {} HTTP/1.1\r\nHost: localhost\r\nContent-Length: {}\r\n\r\n'.format(
+            method, target, len(body)).encode('latin-1') + body)
+        await writer.drain()
+        await reader.readline()
+        length = 0
+        while True:
+            line = await reader.readline()
+            if not line.strip():
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            if name.lower() == 'content-length':
+                length = int(value)
+        return json.loads((await reader.readexactly(length)).decode('utf-8'))
+
+    async def client(host, port, requests):
+        reader, writer = await asyncio.open_connection(host, port)
+        responses = [await request(reader, writer, *args) for args in requests]
+        writer.close()
+        await writer.wait_closed()
+        return responses
+
+    async def run():
+        server = RouteServer(g, args.workers, feed_dir=args.data)
+        host, port = await server.start('127.0.0.1', 0)
+        started = time.perf_counter()
+        clients = [
+            client(host, port, [
+                ('GET', '/route?from={},{}&to={},{}'.format(n1.lat, n1.lon, n2.lat, n2.lon))
+                for n1, n2 in queries[i::args.clients]
+            ])
+            for i in range(args.clients)
+        ]
+        if args.update:
+            body = json.dumps({'carrier': FEEDS[0], 'path': '{}.csv'.format(FEEDS[0])})
+            clients.append(client(host, port, [('POST', '/update', body.encode('utf-8'))]))
+        results = await asyncio.gather(*clients)
+        elapsed = time.perf_counter() - started
+        stats, = await client(host, port, [('GET', '/stats')])
+        await server.close()
+        return elapsed, stats, results[-1][0] if args.update else None
+
+    elapsed, stats, update = asyncio.run(run())
+    print('{} queries from {} clients, {} workers: {:.0f} ms, {:.0f} queries/s'.format(
+        args.queries, args.clients, args.workers, elapsed * 1000, args.queries / elapsed,
+    ))
+    if update:
+        print('update during the run: {}'.format(update))
+    print(json.dumps(stats, sort_keys=True))
+
+
+class SchedulerProbe:
+    """
+    Pickled size of the meta of the requests waiting in a crawler's
+    scheduler, the part of a request spiders control and disk queues
+    serialise, and the number of items scraped
+    """
+
+    def __init__(self, crawler):
+        from scrapy import signals
+
+        self.waiting = {}
+        self.bytes = 0
+        self.peak = 0
+        self.requests = 0
+        self.total = 0
+        self.items = 0
+        crawler.signals.connect(self.scheduled, signal=signals.request_scheduled)
+        crawler.signals.connect(self.left, signal=signals.request_dropped)
+        crawler.signals.connect(self.left, signal=signals.request_reached_downloader)
+        crawler.signals.connect(self.scraped, signal=signals.item_scraped)
+
+    def scheduled(self, request, spider):
+        import pickle
+
+        size = len(pickle.dumps(request.meta))
+        self.waiting[id(request)] = size
+        self.bytes += size
+        self.peak = max(self.peak, self.bytes)
+        self.requests += 1
+        self.total += size
+
+    def left(self, request, spider):
+        self.bytes -= self.waiting.pop(id(request), 0)
+
+    def scraped(self, item, response, spider):
+        self.items += 1
+
+
+def bench_crawl(args):
+    import resource
+    import socket
+    import subprocess
+    import sys
+
+    from scrapy.crawler import Crawler, CrawlerProcess
+    from scrapy.settings import Settings
+
+    from travel.crawl import SETTINGS, SPIDERS, spider_settings
+
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'travel.replay', args.recordings, '--port', str(args.port)], stdout=subprocess.DEVNULL,
+    )
+    try:
+        for _ in range(100):
+            try:
+                socket.create_connection(('127.0.0.1', args.port)).close()
+                break
+            except ConnectionError:
+                time.sleep(0.05)
+        output = tempfile.mkdtemp()
+        process = CrawlerProcess(Settings(dict(SETTINGS, LOG_LEVEL='WARNING')))
+        probes = []
+        for name in args.spiders:
+            crawler = Crawler(SPIDERS[name], spider_settings(
+                name, output, REPLAY_URL='http://127.0.0.1:{}'.format(args.port), REFERENCE_CACHE_DIR='',
+                LOG_LEVEL='WARNING',
+            ))
+            probes.append((name, SchedulerProbe(crawler)))
+            process.crawl(crawler)
+        started, cpu = time.perf_counter(), time.process_time()
+        process.start()
+        elapsed, cpu = time.perf_counter() - started, time.process_time() - cpu
+    finally:
+        server.terminate()
+        server.wait()
+
+    items = 0
+    for name, probe in probes:
+        print('{:10} {:6} requests {:8.0f} meta bytes/request {:10} peak scheduler meta bytes {:7} items'.format(
+            name, probe.requests, probe.total / max(probe.requests, 1), probe.peak, probe.items,
+        ))
+        items += probe.items
+    print('{:.1f}s, {:.2f}s CPU, {:.0f} us CPU/item, peak RSS {:.0f} MB'.format(
+        elapsed, cpu, cpu / max(items, 1) * 1e6, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    ))
+
+
+def bench_ingest(args):
+    total_rows = 0
+    total_elapsed = 0
+    for name in FEEDS:
+        path = os.path.join(args.data, '{}.csv'.format(name))
+        with open(path) as f:
+            rows = list(csv.DictReader(f))
+        dates = [row['departureDate'] for row in rows]
+        elapsed_dateutil, _ = timed(parse_any, dates)
+        elapsed_detected, _ = timed(lambda: date_parser(dates[0])(dates))
+        with open(path) as f:
+            elapsed, _ = timed(process_routes, f, name, Graph())
+        total_rows += len(rows)
+        total_elapsed += elapsed
+        print('{}: {} rows, {:,.0f} rows/s; dates: dateutil {:,.0f} rows/s, detected format {:,.0f} rows/s'.format(
+            name, len(rows), len(rows) / elapsed, len(rows) / elapsed_dateutil, len(rows) / elapsed_detected,
+        ))
+    print('total: {:,.0f} rows/s'.format(total_rows / total_elapsed))
+
+
+def repeated_feeds(data_dir, directory, repeat):
+    """
+    Writes every sample feed `repeat` times over into one CSV in `directory`
+    :return: list of (path, carrier name)
+    """
+    feeds = []
+    for name in FEEDS:
+        with open(os.path.join(data_dir, '{}.csv'.format(name))) as f:
+            header = f.readline()
+            body = f.read()
+        path = os.path.join(directory, '{}.csv'.format(name))
+        with open(path, 'w') as f:
+            f.write(header)
+            for _ in range(repeat):
+                f.write(body)
+        feeds.append((path, name))
+    return feeds
+
+
+def bench_parallel(args):
+    directory = tempfile.mkdtemp()
+    feeds = repeated_feeds(args.data, directory, args.repeat)
+
+    for workers in args.workers:
+        g = Graph()
+        elapsed, _ = timed(lambda: list(load_parallel(g, feeds, workers, args.chunk_size)))
+        print('{} workers: {:.0f} ms, {} connections, {} nodes'.format(
+            workers, elapsed * 1000, len(g.store), g.store.node_count,
+        ))
+    for path, _ in feeds:
+        os.remove(path)
+    os.rmdir(directory)
+
+
+def bench_snapshot(args):
+    sources = [os.path.join(args.data, '{}.csv'.format(name)) for name in FEEDS]
+    elapsed_csv, g = timed(load_sample, args.data)
+    path = os.path.join(tempfile.mkdtemp(), 'graph.snapshot')
+    elapsed_save, _ = timed(g.save, path, sources)
+    elapsed_load, _ = timed(Graph.load, path)
+    elapsed_validated, _ = timed(Graph.load, path, sources)
+    print('{:<26} {:8.1f} ms'.format('CSV parse', elapsed_csv * 1000))
+    print('{:<26} {:8.1f} ms, {} bytes'.format('snapshot save', elapsed_save * 1000, os.path.getsize(path)))
+    print('{:<26} {:8.1f} ms'.format('snapshot load', elapsed_load * 1000))
+    print('{:<26} {:8.1f} ms'.format('snapshot load, validated', elapsed_validated * 1000))
+    os.remove(path)
+
+
+def bench_fares(args):
+    directory = tempfile.mkdtemp()
+    feeds = repeated_feeds(args.data, directory, args.repeat)
+    print('{:<10} {:>8} {:>11} {:>11} {:>10} {:>10} {:>10}'.format(
+        'feed', 'fares', 'CSV bytes', 'fares bytes', 'write ms', 'CSV ms', 'fares ms',
+    ))
+    paths = []
+    for path, name in feeds:
+        target = os.path.splitext(path)[0] + fares.EXTENSION
+        elapsed_write, rows = timed(fares.convert, path, target, args.row_group)
+        with open(path) as f:
+            # Graph.add_feed needs the distinct points, which .fares files store
+            elapsed_csv, feed = timed(lambda: read_feed(f).compact())
+        elapsed_fares, columnar = timed(fares.read_fares, target)
+        identical = all(
+            np.array_equal(getattr(feed, column), getattr(columnar, column))
+            for column in ['departure', 'arrival', 'price']
+        ) and feed.points()[:3] == columnar.points()[:3] and all(
+            np.array_equal(a, b) for a, b in zip(feed.points()[3:], columnar.points()[3:])
+        )
+        print('{:<10} {:>8} {:>11} {:>11} {:>10.1f} {:>10.1f} {:>10.1f} identical: {}'.format(
+            name, rows, os.path.getsize(path), os.path.getsize(target),
+            elapsed_write * 1000, elapsed_csv * 1000, elapsed_fares * 1000, identical,
+        ))
+        paths += [path, target]
+    for path in paths:
+        os.remove(path)
+    os.rmdir(directory)
+
+
+def bench_memory(args):
+    g = load_sample(args.data)
+    store = g.store
+    store.adjacency()
+    allocated = sum(getattr(store, column).nbytes for column, _ in CONNECTION_COLUMNS)
+    allocated += sum(array.nbytes for array in store.adjacency())
+    print('{} connections: {:.1f} bytes/connection used, {:.1f} bytes/connection allocated'.format(
+        len(store), store.nbytes / len(store), allocated / len(store),
+    ))
+
+
+def random_points(rnd, count):
+    return [(rnd.uniform(35, 70), rnd.uniform(-25, 40)) for _ in range(count)]
+
+
+def linear_nearest(points, lat, lon, maximum):
+    distance, i = min((coord_distance(point, (lat, lon)), i) for i, point in enumerate(points))
+    if distance <= maximum:
+        return distance, i
+
+
+def bench_haversine(args):
+    rnd = random.Random(args.seed)
+    origins = random_points(rnd, args.rows)
+    destinations = random_points(rnd, args.columns)
+    elapsed_scalar, scalar = timed(lambda: [
+        [coord_distance(origin, destination) for destination in destinations]
+        for origin in origins
+    ])
+    elapsed_matrix, matrix = timed(distance_matrix, origins, destinations)
+    error = max(
+        abs(value - matrix[i, j])
+        for i, row in enumerate(scalar)
+        for j, value in enumerate(row)
+    )
+    pairs = args.rows * args.columns
+    print('{} pairs: scalar {:.3f} us/pair, vectorised {:.3f} us/pair, {:.0f}x, max difference {:.2e} km'.format(
+        pairs, elapsed_scalar / pairs * 1e6, elapsed_matrix / pairs * 1e6,
+        elapsed_scalar / elapsed_matrix, error,
+    ))
+
+
+def bench_currency(args):
+    prices = []
+    currencies = []
+    departures = []
+    for name in FEEDS:
+        with open(os.path.join(args.data, '{}.csv'.format(name))) as f:
+            rows = list(csv.DictReader(f))
+        prices += [row['price'] for row in rows]
+        currencies += [row['currencyCode'] for row in rows]
+        dates = [row['departureDate'] for row in rows]
+        departures.append(date_parser(dates[0])(dates))
+    prices = np.tile(np.array(prices, dtype=np.float64), args.repeat)
+    currencies = np.tile(np.array(currencies), args.repeat)
+    departures = np.tile(np.concatenate(departures), args.repeat)
+    fares = len(prices)
+
+    tables = [('rates.csv', default_rates())]
+    if args.days:
+        # One rate per day and currency, the latest equal to rates.csv
+        dated = {}
+        for code, (dates, rates) in default_rates().rates.items():
+            days = dates[-1] - np.arange(args.days, dtype=np.int64)[::-1] * 24 * 60
+            dated[code] = (days, np.full(args.days, rates[-1]))
+        tables.append(('{} days'.format(args.days), RateTable(dated)))
+    for label, table in tables:
+        elapsed_scalar, scalar = timed(lambda: [
+            to_minor(price * float(table.rate(currency, when)))
+            for price, currency, when in zip(prices.tolist(), currencies.tolist(), departures.tolist())
+        ])
+        elapsed_column, column = timed(table.to_minor, prices, currencies, departures)
+        print('{:<10} {} fares: per fare {:,.0f} fares/s, per column {:,.0f} fares/s, {:.0f}x, identical: {}'.format(
+            label, fares, fares / elapsed_scalar, fares / elapsed_column, elapsed_scalar / elapsed_column,
+            scalar == column.tolist(),
+        ))
+
+
+def bench_snap(args):
+    rnd = random.Random(args.seed)
+    for size in args.nodes:
+        points = random_points(rnd, size)
+        queries = random_points(rnd, args.queries)
+        index = GridIndex()
+        elapsed_build, _ = timed(lambda: [index.insert(lat, lon, i) for i, (lat, lon) in enumerate(points)])
+        elapsed_index, found = timed(lambda: [index.nearest(lat, lon, args.maximum) for lat, lon in queries])
+        linear_queries = queries[:args.linear_queries]
+        elapsed_linear, expected = timed(lambda: [linear_nearest(points, lat, lon, args.maximum)
+                                                  for lat, lon in linear_queries])
+        mismatches = sum(
+            1 for a, b in zip(found, expected)
+            if (a and a[1]) != (b and b[1])
+        )
+        print('{:>7} nodes: build {:.1f} ms, grid {:.1f} us/query, linear {:.1f} us/query, {} mismatches'.format(
+            size, elapsed_build * 1000,
+            elapsed_index / len(queries) * 1e6,
+            elapsed_linear / len(linear_queries) * 1e6,
+            mismatches,
+        ))
+
+
+# Suite results that must match the baseline exactly, work that must not
+# grow, and measurements allowed to grow by the tolerance
+SUITE_RESULTS = ['rows', 'nodes', 'connections', 'snapped', 'routes', 'price_cents']
+SUITE_WORK = ['labels_expanded']
+SUITE_MEASURED = ['load_ms', 'snap_us', 'query_ms', 'load_rss_mb', 'peak_rss_mb']
+# Seconds every timed scenario runs for at least
+SUITE_BUDGET = 1.0
+
+
+def synthetic_feeds(directory, scale, seed):
+    """
+    Synthetic feeds of `scale` and `seed` kept in `directory`, generated on
+    first use
+    """
+    target = os.path.join(directory, 'v{}-seed{}-x{:g}'.format(synthetic.VERSION, seed, scale))
+    if not os.path.isdir(target):
+        partial = tempfile.mkdtemp(dir=directory)
+        synthetic.generate(partial, scale, seed)
+        os.rename(partial, target)
+    return [(os.path.join(target, '{}.csv'.format(name)), name) for name, _, _ in synthetic.CARRIERS]
+
+
+def fastest(fn, repeat, budget=SUITE_BUDGET):
+    """
+    Runs `fn` at least `repeat` times and until `budget` seconds went by,
+    so short scenarios get enough runs for their fastest to be stable
+    :return: (fastest time, result of the last run)
+    """
+    times = []
+    spent = 0
+    while len(times) < repeat or spent < budget:
+        elapsed, result = timed(fn)
+        times.append(elapsed)
+        spent += elapsed
+    return min(times), result
+
+
+def suite_scenarios(feeds, seed, snaps, queries, max_hops, repeat):
+    """
+    Loads `feeds`, snaps random points and searches random pairs, keeping
+    the fastest run of each, see `fastest`. Runs in a fresh process so
+    peak RSS is that of this network alone.
+    :return: dict of results, work and measurements
+    """
+    import resource
+
+    def peak_rss():
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+    def load():
+        g = Graph(cache_size=0)
+        for path, name in feeds:
+            with open(path) as f:
+                process_routes(f, name, g)
+        return g
+
+    g = load()
+    load_rss = peak_rss()
+    load_time, g = fastest(load, repeat - 1)
+    rows = 0
+    for path, _ in feeds:
+        with open(path) as f:
+            rows += sum(1 for _ in csv.reader(f)) - 1
+
+    rnd = random.Random(seed)
+    # Half the points near an airport, half anywhere
+    points = [
+        (node.lat + rnd.gauss(0, 0.2), node.lon + rnd.gauss(0, 0.2))
+        for node in (rnd.choice(g.nodes) for _ in range(snaps // 2))
+    ] + [(rnd.uniform(*synthetic.LATITUDES), rnd.uniform(*synthetic.LONGITUDES)) for _ in range(snaps - snaps // 2)]
+
+    def snap():
+        g.coords_cache = {}
+        return [g.closest(lat, lon) for lat, lon in points]
+
+    snap_time, nodes = fastest(snap, repeat)
+
+    origins = sorted(set(g.store.origin[g.store.live()].tolist()))
+    pairs = [tuple(rnd.sample(origins, 2)) for _ in range(queries)]
+
+    def query():
+        stats = SearchStats()
+        routes = [g.path(g.nodes[origin], g.nodes[destination], max_hops=max_hops, stats=stats)
+                  for origin, destination in pairs]
+        return routes, stats.expanded
+
+    query_time, (routes, expanded) = fastest(query, repeat)
+    found = [route for route in routes if route is not None]
+
+    return {
+        'rows': rows,
+        'nodes': g.store.node_count,
+        'connections': len(g.store),
+        'snapped': sum(1 for node in nodes if node is not None),
+        'routes': len(found),
+        'price_cents': sum(to_minor(route['price']) for route in found),
+        'labels_expanded': expanded,
+        'load_ms': round(load_time * 1000, 2),
+        'snap_us': round(snap_time / max(len(points), 1) * 1e6, 3),
+        'query_ms': round(query_time / max(len(pairs), 1) * 1000, 3),
+        'load_rss_mb': round(load_rss, 1),
+        'peak_rss_mb': round(peak_rss(), 1),
+    }
+
+
+def suite_regressions(scale, current, before, tolerance):
+    """
+    Differences of one scale from its baseline run that count as regressions
+    :return: list of messages
+    """
+    regressions = []
+    for metric in SUITE_RESULTS:
+        if current[metric] != before[metric]:
+            regressions.append('{}x {}: {} instead of {}'.format(scale, metric, current[metric], before[metric]))
+    for metric in SUITE_WORK:
+        if current[metric] > before[metric]:
+            regressions.append('{}x {}: {} up from {}'.format(scale, metric, current[metric], before[metric]))
+    for metric in SUITE_MEASURED:
+        if current[metric] > before[metric] * (1 + tolerance):
+            regressions.append('{}x {}: {} up {:.0%} from {}'.format(
+                scale, metric, current[metric], current[metric] / before[metric] - 1, before[metric],
+            ))
+    return regressions
+
+
+def bench_suite(args):
+    import multiprocessing
+    import platform
+    import sys
+    from concurrent.futures import ProcessPoolExecutor
+
+    def run(feeds):
+        with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context('spawn')) as pool:
+            return pool.submit(
+                suite_scenarios, feeds, args.seed, args.snaps, args.queries, args.max_hops, args.repeat,
+            ).result()
+
+    os.makedirs(args.feeds, exist_ok=True)
+    results = {
+        'settings': {
+            'generator': synthetic.VERSION, 'seed': args.seed, 'snaps': args.snaps, 'queries': args.queries,
+            'max_hops': args.max_hops,
+        },
+        'machine': {'platform': platform.platform(), 'python': platform.python_version(), 'cpus': os.cpu_count()},
+        'scales': {},
+    }
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline['settings'] != results['settings']:
+            sys.exit('The baseline was run with {}, not comparable with {}'.format(
+                baseline['settings'], results['settings'],
+            ))
+        if baseline['machine'] != results['machine']:
+            print('warning: the baseline was recorded on {}'.format(baseline['machine']))
+
+    print('{:>6} {:>10} {:>10} {:>10} {:>10} {:>10} {:>10} {:>10} {:>11}'.format(
+        'scale', 'rows', 'nodes', 'load ms', 'snap us', 'query ms', 'labels', 'load MB', 'peak MB',
+    ))
+    regressions = []
+    for scale in args.scales:
+        feeds = synthetic_feeds(args.feeds, scale, args.seed)
+        key = '{:g}'.format(scale)
+        before = baseline['scales'].get(key) if baseline is not None else None
+        current = run(feeds)
+        if before is not None and any(current[metric] > before[metric] * (1 + args.tolerance)
+                                      for metric in SUITE_MEASURED):
+            # Time and memory are noisy, a slowdown has to show up twice
+            again = run(feeds)
+            current = dict(current, **{metric: min(current[metric], again[metric]) for metric in SUITE_MEASURED})
+        results['scales'][key] = {metric: current[metric] for metric in SUITE_RESULTS + SUITE_WORK + SUITE_MEASURED}
+        print('{:>6} {:>10} {:>10} {:>10.1f} {:>10.2f} {:>10.2f} {:>10} {:>10.1f} {:>11.1f}'.format(
+            key + 'x', current['rows'], current['nodes'], current['load_ms'], current['snap_us'],
+            current['query_ms'], current['labels_expanded'], current['load_rss_mb'], current['peak_rss_mb'],
+        ))
+        if before is not None:
+            print('{:>6} {:>10} {:>10} {:>+10.0%} {:>+10.0%} {:>+10.0%} {:>+10.0%} {:>+10.0%} {:>+11.0%}'.format(
+                'change', '', '', *(current[metric] / before[metric] - 1 if before[metric] else 0 for metric in (
+                    'load_ms', 'snap_us', 'query_ms', 'labels_expanded', 'load_rss_mb', 'peak_rss_mb',
+                ))
+            ))
+            regressions += suite_regressions(key, current, before, args.tolerance)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if baseline is not None:
+        if regressions:
+            for regression in regressions:
+                print('REGRESSION {}'.format(regression), file=sys.stderr)
+            sys.exit(1)
+        print('no regression against {} at {:.0%} tolerance'.format(args.baseline, args.tolerance))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Travel benchmarks')
+    parser.add_argument('--data', default=SAMPLE_DATA, help='directory with feed CSVs')
+    parser.add_argument('--stats', metavar='FILE',
+                        help='count and time loading, snapping and searches, written as JSON to FILE, - for stdout')
+    parser.add_argument('--profile', choices=PROFILERS, help='run the benchmark under a profiler')
+    parser.add_argument('--profile-output', metavar='FILE',
+                        help='save the profile, pstats for cprofile and folded stacks for sample')
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    search = commands.add_parser('search', help='cheapest route search, 2 to N hops')
+    search.add_argument('--max-hops', type=int, default=6)
+    search.set_defaults(func=bench_search)
+
+    astar = commands.add_parser('astar', help='Dijkstra against A* and bidirectional search')
+    astar.add_argument('--max-hops', type=int, default=4)
+    astar.set_defaults(func=bench_astar)
+
+    patterns = commands.add_parser('patterns', help='search against precomputed transfer patterns')
+    patterns.add_argument('--max-hops', type=int, default=3)
+    patterns.add_argument('--queries', type=int, default=500)
+    patterns.add_argument('--seed', type=int, default=0)
+    patterns.add_argument('--repriced', type=float, nargs='+', default=[0.001, 0.01, 0.1],
+                          help='shares of fares repriced before refreshing the patterns')
+    patterns.set_defaults(func=bench_patterns)
+
+    pareto = commands.add_parser('pareto', help='Pareto front of price, travel time and hops')
+    pareto.add_argument('--max-hops', type=int, default=3)
+    pareto.add_argument('--max-labels', type=int, default=16)
+    pareto.set_defaults(func=bench_pareto)
+
+    window = commands.add_parser('window', help='linear scan against binary search for feasible departures')
+    window.add_argument('--hubs', type=int, default=10)
+    window.add_argument('--queries', type=int, default=1000)
+    window.add_argument('--seed', type=int, default=0)
+    window.set_defaults(func=bench_window)
+
+    roundtrip = commands.add_parser('roundtrip', help='round trips to every destination in one pass against path calls')
+    roundtrip.add_argument('--max-hops', type=int, default=2)
+    roundtrip.add_argument('--min-stay', type=int, default=2, help='days')
+    roundtrip.add_argument('--max-stay', type=int, default=14, help='days')
+    roundtrip.set_defaults(func=bench_roundtrip)
+
+    matrix = commands.add_parser('matrix', help='one-to-all and many-to-many cheapest prices')
+    matrix.add_argument('--origins', type=int, default=10, help='origins to compare against Graph.path')
+    matrix.add_argument('--max-hops', type=int, default=2)
+    matrix.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    matrix.add_argument('--export', help='.npz file to save the last matrix to')
+    matrix.set_defaults(func=bench_matrix)
+
+    cache = commands.add_parser('cache', help='Graph.path with and without the route cache')
+    cache.add_argument('--pairs', type=int, default=200)
+    cache.add_argument('--queries', type=int, default=5000)
+    cache.add_argument('--seed', type=int, default=0)
+    cache.set_defaults(func=bench_cache)
+
+    update = commands.add_parser('update', help='applying a new crawl in place against rebuilding the graph')
+    update.add_argument('--removed', type=float, default=0.05, help='share of fares gone from the new crawl')
+    update.add_argument('--repriced', type=float, default=0.2, help='share of fares with a new price')
+    update.add_argument('--seed', type=int, default=0)
+    update.set_defaults(func=bench_update)
+
+    server = commands.add_parser('server', help='concurrent HTTP route queries against travel.server')
+    server.add_argument('--queries', type=int, default=1000)
+    server.add_argument('--clients', type=int, default=8)
+    server.add_argument('--workers', type=int, default=4)
+    server.add_argument('--update', action='store_true', help='apply a feed update while querying')
+    server.add_argument('--no-cache', action='store_true')
+    server.add_argument('--seed', type=int, default=0)
+    server.set_defaults(func=bench_server)
+
+    crawl = commands.add_parser('crawl', help='scheduler memory and CPU per item of a replayed crawl')
+    crawl.add_argument('recordings', help='directory recorded with python -m travel.crawl --record')
+    crawl.add_argument('--spiders', nargs='+', default=['ryanair', 'wizzair'])
+    crawl.add_argument('--port', type=int, default=8765)
+    crawl.set_defaults(func=bench_crawl)
+
+    ingest = commands.add_parser('ingest', help='CSV ingestion throughput')
+    ingest.set_defaults(func=bench_ingest)
+
+    parallel = commands.add_parser('parallel', help='feed loading with 1 to N worker processes')
+    parallel.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+    parallel.add_argument('--repeat', type=int, default=20, help='copies of each sample feed')
+    parallel.add_argument('--chunk-size', type=int, default=10000)
+    parallel.set_defaults(func=bench_parallel)
+
+    snapshot = commands.add_parser('snapshot', help='CSV parsing against snapshot loading')
+    snapshot.set_defaults(func=bench_snapshot)
+
+    columnar = commands.add_parser('fares', help='feed CSVs against .fares files: size and load time')
+    columnar.add_argument('--repeat', type=int, default=20, help='copies of each sample feed')
+    columnar.add_argument('--row-group', type=int, default=fares.ROW_GROUP)
+    columnar.set_defaults(func=bench_fares)
+
+    memory = commands.add_parser('memory', help='connection store size')
+    memory.set_defaults(func=bench_memory)
+
+    distances = commands.add_parser('haversine', help='scalar coord_distance against distance_matrix')
+    distances.add_argument('--rows', type=int, default=200)
+    distances.add_argument('--columns', type=int, default=1000)
+    distances.add_argument('--seed', type=int, default=0)
+    distances.set_defaults(func=bench_haversine)
+
+    currency = commands.add_parser('currency', help='per-fare against per-column currency conversion')
+    currency.add_argument('--repeat', type=int, default=20, help='copies of the sample fares')
+    currency.add_argument('--days', type=int, default=365, help='dated rates per currency, 0 for rates.csv only')
+    currency.set_defaults(func=bench_currency)
+
+    snap = commands.add_parser('snap', help='grid index against linear scan for Graph.closest')
+    snap.add_argument('--nodes', type=int, nargs='+', default=[10000, 100000])
+    snap.add_argument('--queries', type=int, default=10000)
+    snap.add_argument('--linear-queries', type=int, default=50)
+    snap.add_argument('--maximum', type=float, default=50)
+    snap.add_argument('--seed', type=int, default=0)
+    snap.set_defaults(func=bench_snap)
+
+    suite = commands.add_parser('suite', help='load, snap and query synthetic networks, against a baseline run')
+    suite.add_argument('--scales', type=float, nargs='+', default=[1, 10, 100], help='sizes relative to the sample')
+    suite.add_argument('--seed', type=int, default=0)
+    suite.add_argument('--snaps', type=int, default=10000, help='Graph.closest lookups')
+    suite.add_argument('--queries', type=int, default=50, help='Graph.path queries')
+    suite.add_argument('--max-hops', type=int, default=2)
+    suite.add_argument('--repeat', type=int, default=3, help='runs of every scenario, the fastest is kept')
+    suite.add_argument('--feeds', default=os.path.join(tempfile.gettempdir(), 'travel-synthetic'),
+                       help='directory the synthetic feeds are generated in and reused from')
+    suite.add_argument('--output', help='JSON file to save the results to, for use as a baseline')
+    suite.add_argument('--baseline', help='results of an earlier run on the same machine, exits with 1 on regression')
+    suite.add_argument('--tolerance', type=float, default=0.3, help='allowed growth of times and memory')
+    suite.set_defaults(func=bench_suite)
+
+    args = parser.parse_args()
+    if args.stats:
+        INSTRUMENTS.enable()
+    with profiled(args.profile, args.profile_output):
+        args.func(args)
+    if args.stats == '-':
+        print(INSTRUMENTS.to_json())
+    elif args.stats:
+        with open(args.stats, 'w') as f:
+            f.write(INSTRUMENTS.to_json())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,161 @@
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+
+class CacheEntry:
+    __slots__ = ('route', 'region', 'departure_from', 'departure_to', 'expires')
+
+    def __init__(self, route, region, departure_from, departure_to, expires):
+        self.route = route
+        self.region = region
+        self.departure_from = departure_from
+        self.departure_to = departure_to
+        self.expires = expires
+
+
+class RouteCache:
+    """
+    LRU cache of route query results with an optional time to live.
+
+    Every entry remembers its region: the nodes the search settled a label
+    at. A new connection can only change a result if it leaves one of those
+    nodes within the query's departure window, so `invalidate` drops just
+    the entries whose region and window it touches. Entries without a
+    region are dropped by any new connection in their window. All methods
+    are thread safe.
+    """
+
+    def __init__(self, maxsize=1024, ttl=None, clock=time.monotonic):
+        """
+        :param maxsize: max number of entries, 0 disables the cache
+        :param ttl: seconds an entry stays valid, forever if None
+        :param clock: function returning the current time in seconds
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.regions = {}
+        self.unbounded = set()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, key):
+        """
+        :return: (True, result) on a hit, (False, None) on a miss
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry.expires is not None and entry.expires <= self.clock():
+                self._remove(key)
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return False, None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return True, entry.route
+
+    def put(self, key, route, region, departure_from, departure_to):
+        """
+        :param key: hashable query key
+        :param route: result to cache
+        :param region: node positions the search settled, None if unknown
+        :param departure_from: start of the query window in store minutes
+        :param departure_to: end of the query window in store minutes
+        """
+        if not self.maxsize:
+            return
+        expires = self.clock() + self.ttl if self.ttl is not None else None
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            if region is None:
+                self.unbounded.add(key)
+            else:
+                region = frozenset(region)
+                for node in region:
+                    self.regions.setdefault(node, set()).add(key)
+            self.entries[key] = CacheEntry(route, region, departure_from, departure_to, expires)
+            while len(self.entries) > self.maxsize:
+                self._remove(next(iter(self.entries)))
+                self.evictions += 1
+
+    def _remove(self, key):
+        entry = self.entries.pop(key)
+        if entry.region is None:
+            self.unbounded.discard(key)
+            return
+        for node in entry.region:
+            keys = self.regions[node]
+            keys.discard(key)
+            if not keys:
+                del self.regions[node]
+
+    def invalidate(self, origins, departures):
+        """
+        Drops the entries that new connections may change
+        :param origins: origin node positions of the new connections
+        :param departures: their departures in store minutes
+        :return: number of entries dropped
+        """
+        if not self.entries or not len(origins):
+            return 0
+        earliest, latest = int(min(departures)), int(max(departures))
+        stale = set()
+        with self.lock:
+            candidates = set(self.unbounded)
+            for node in np.unique(origins).tolist():
+                candidates.update(self.regions.get(node, ()))
+            for key in candidates:
+                entry = self.entries[key]
+                if entry.departure_from <= latest and earliest <= entry.departure_to:
+                    stale.add(key)
+            for key in stale:
+                self._remove(key)
+            self.invalidations += len(stale)
+        return len(stale)
+
+    def copy(self, rebind=None):
+        """
+        Cache with the same entries, limits and counters
+        :param rebind: optional function applied to every cached route
+        """
+        cache = RouteCache(self.maxsize, self.ttl, self.clock)
+        with self.lock:
+            for key, entry in self.entries.items():
+                route = rebind(entry.route) if rebind is not None else entry.route
+                cache.entries[key] = CacheEntry(route, entry.region, entry.departure_from, entry.departure_to,
+                                                entry.expires)
+            cache.regions = {node: set(keys) for node, keys in self.regions.items()}
+            cache.unbounded = set(self.unbounded)
+            for counter in ('hits', 'misses', 'evictions', 'expirations', 'invalidations'):
+                setattr(cache, counter, getattr(self, counter))
+        return cache
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.regions.clear()
+            self.unbounded.clear()
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __repr__(self):
+        return 'RouteCache(size={}, hits={}, misses={}, evictions={}, expirations={}, invalidations={})'.format(
+            len(self), self.hits, self.misses, self.evictions, self.expirations, self.invalidations,
+        )
@@ -0,0 +1,283 @@
+"""
+Runs the spiders concurrently in one reactor.
+
+Every spider gets its own crawler, feed and per-domain concurrency limit,
+AutoThrottle adapts the delay of each domain to its latency, and a domain
+answering 429 or 503 is slowed down before the request is retried. City
+and airport lists are cached on disk between crawls, see travel.httpcache.
+With --fares every spider also writes a typed .fares file, see travel.fares.
+
+    python -m travel.crawl
+    python -m travel.crawl ryanair wizzair --output feeds
+    python -m travel.crawl ecolines -a months=3
+    python -m travel.crawl --fares feeds
+    python -m travel.crawl --record recordings
+    python -m travel.crawl --replay recordings --latency 0.05
+"""
+import argparse
+import os
+import sys
+import time
+from collections import OrderedDict
+
+from scrapy import signals
+from scrapy.crawler import Crawler, CrawlerProcess
+from scrapy.settings import Settings
+from twisted.internet import defer
+from twisted.internet.error import ReactorNotRunning
+
+from travel import ecolines, replay, ryanair, wizzair
+from travel.httpcache import DAY
+
+SPIDERS = OrderedDict(
+    (spider.name, spider) for spider in (ecolines.EcolinesSpider, ryanair.RyanairSpider, wizzair.WizzairSpider)
+)
+
+# City and airport lists, cached between crawls
+REFERENCE_URLS = [
+    ecolines.ORIGIN_URL,
+    ecolines.DEST_URL.format(orig=''),
+    ryanair.AIRPORTS_URL,
+    wizzair.AIRPORTS_URL,
+]
+
+# Parallel requests per domain, also the AutoThrottle target: the EcoLines
+# ajax endpoints are cheap, the airline APIs rate limit
+DOMAIN_CONCURRENCY = {
+    'ecolines': 16,
+    'ryanair': 8,
+    'wizzair': 4,
+}
+
+SETTINGS = {
+    'CONCURRENT_REQUESTS': 64,
+    'DOWNLOAD_DELAY': 0,
+    'AUTOTHROTTLE_ENABLED': True,
+    'AUTOTHROTTLE_START_DELAY': 0.25,
+    'AUTOTHROTTLE_MAX_DELAY': 30,
+    'RETRY_TIMES': 3,
+    'RETRY_HTTP_CODES': [429, 500, 502, 503, 504, 522, 524, 408],
+    'DOWNLOADER_MIDDLEWARES': {
+        'travel.crawl.BackoffMiddleware': 560,
+        'travel.httpcache.ReferenceCacheMiddleware': 900,
+        'travel.replay.RecordMiddleware': 950,
+        'travel.replay.ReplayMiddleware': 960,
+    },
+    'EXTENSIONS': {
+        'travel.crawl.CrawlStats': 500,
+    },
+    'ITEM_PIPELINES': {
+        'travel.fares.FarePipeline': 800,
+    },
+    'FEED_EXPORTERS': {
+        'fares': 'travel.fares.FareExporter',
+    },
+    'REFERENCE_URLS': REFERENCE_URLS,
+    'REFERENCE_CACHE_DIR': 'httpcache',
+    'REFERENCE_CACHE_TTL': 7 * DAY,
+    'LOG_LEVEL': 'INFO',
+    'TWISTED_REACTOR': 'twisted.internet.asyncioreactor.AsyncioSelectorReactor',
+}
+
+THROTTLED = (429, 503)
+
+
+class BackoffMiddleware:
+    """
+    Slows a domain down when it answers 429 or 503: the delay of its
+    download slot becomes the Retry-After header or doubles, up to
+    AUTOTHROTTLE_MAX_DELAY. RetryMiddleware then retries the request and
+    AutoThrottle brings the delay back down as the domain answers again.
+    """
+
+    def __init__(self, crawler, max_delay):
+        self.crawler = crawler
+        self.max_delay = max_delay
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler, crawler.settings.getfloat('AUTOTHROTTLE_MAX_DELAY'))
+
+    def process_response(self, request, response, spider):
+        if response.status not in THROTTLED:
+            return response
+        slot = self.crawler.engine.downloader.slots.get(request.meta.get('download_slot'))
+        if slot is not None:
+            try:
+                delay = float(response.headers.get('Retry-After'))
+            except (TypeError, ValueError):
+                delay = max(2 * slot.delay, 1.0)
+            slot.delay = min(max(slot.delay, delay), self.max_delay)
+            self.crawler.stats.inc_value('crawl/backoff')
+        return response
+
+
+class CrawlStats:
+    """
+    Extension adding the crawl time, requests and items per second, and
+    requests and CPU time per item of a spider to its stats. CPU time is
+    the process's while the spider ran, exact when it runs alone.
+    """
+
+    def __init__(self, stats):
+        self.stats = stats
+        self.started = None
+        self.cpu = None
+        self.responses = 0
+        self.items = 0
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        extension = cls(crawler.stats)
+        crawler.signals.connect(extension.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(extension.response_received, signal=signals.response_received)
+        crawler.signals.connect(extension.item_scraped, signal=signals.item_scraped)
+        crawler.signals.connect(extension.spider_closed, signal=signals.spider_closed)
+        return extension
+
+    def spider_opened(self, spider):
+        self.started = time.perf_counter()
+        self.cpu = time.process_time()
+
+    def response_received(self, response, request, spider):
+        self.responses += 1
+
+    def item_scraped(self, item, response, spider):
+        self.items += 1
+
+    def spider_closed(self, spider, reason):
+        elapsed = max(time.perf_counter() - self.started, 1e-9)
+        cpu = time.process_time() - self.cpu
+        items = max(self.items, 1)
+        self.stats.set_value('crawl/seconds', round(elapsed, 3))
+        self.stats.set_value('crawl/responses', self.responses)
+        self.stats.set_value('crawl/items', self.items)
+        self.stats.set_value('crawl/requests_per_second', round(self.responses / elapsed, 2))
+        self.stats.set_value('crawl/items_per_second', round(self.items / elapsed, 2))
+        self.stats.set_value('crawl/requests_per_item', round(self.responses / items, 3))
+        self.stats.set_value('crawl/cpu_ms_per_item', round(cpu * 1000 / items, 3))
+
+
+def spider_settings(name, output, concurrency=None, **overrides):
+    """
+    Settings of one spider's crawler: SETTINGS with the spider's domain
+    concurrency as limit and AutoThrottle target, and a CSV feed
+    `output`/<name>.csv. These are set with cmdline priority, as newer
+    Scrapy versions merge the process settings into the crawler's.
+    :param concurrency: requests per domain, DOMAIN_CONCURRENCY if None
+    """
+    concurrency = concurrency or DOMAIN_CONCURRENCY[name]
+    settings = Settings(SETTINGS)
+    settings.setdict(dict(
+        overrides,
+        CONCURRENT_REQUESTS_PER_DOMAIN=concurrency,
+        AUTOTHROTTLE_TARGET_CONCURRENCY=float(concurrency),
+        FEEDS={os.path.join(output, '{}.csv'.format(name)): {'format': 'csv'}},
+    ), priority='cmdline')
+    return settings
+
+
+def install_reactor():
+    """
+    Installs the TWISTED_REACTOR of SETTINGS unless one is installed. Scrapy
+    only installs it when it creates the first crawler itself, main()
+    creates its crawlers and needs the reactor for the replay server first.
+    """
+    if 'twisted.internet.reactor' not in sys.modules:
+        from scrapy.utils.reactor import install_reactor
+
+        install_reactor(SETTINGS['TWISTED_REACTOR'])
+    from twisted.internet import reactor
+    return reactor
+
+
+def sequentially(process, crawlers, arguments):
+    @defer.inlineCallbacks
+    def crawl():
+        for crawler in crawlers:
+            yield process.crawl(crawler, **arguments)
+    return crawl()
+
+
+def report(crawlers, elapsed):
+    for crawler in crawlers:
+        stats = crawler.stats
+        print('{:10} {:6} requests {:8.1f}/s {:6} items {:8.1f}/s {:6.2f} requests/item {:6.2f} ms CPU/item '
+              '{:7.1f}s {:4} backoffs {:4.0%} cached {:8} bytes saved'.format(
+                  crawler.spidercls.name,
+                  stats.get_value('crawl/responses', 0), stats.get_value('crawl/requests_per_second', 0.0),
+                  stats.get_value('crawl/items', 0), stats.get_value('crawl/items_per_second', 0.0),
+                  stats.get_value('crawl/requests_per_item', 0.0), stats.get_value('crawl/cpu_ms_per_item', 0.0),
+                  stats.get_value('crawl/seconds', 0.0), stats.get_value('crawl/backoff', 0),
+                  stats.get_value('referencecache/hit_rate', 0.0), stats.get_value('referencecache/bytes_saved', 0),
+              ))
+    print('total {:.1f}s'.format(elapsed))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Crawl all carriers concurrently')
+    parser.add_argument('spiders', nargs='*', help='any of {}, all if none given'.format(', '.join(SPIDERS)))
+    parser.add_argument('--output', default='.', help='directory of the feed CSVs')
+    parser.add_argument('--concurrency', type=int, help='requests per domain instead of DOMAIN_CONCURRENCY')
+    parser.add_argument('--fares', help='also write every feed as a .fares file to this directory')
+    parser.add_argument('--record', help='save every response to this directory')
+    parser.add_argument('--replay', help='answer requests from the responses recorded in this directory')
+    parser.add_argument('--latency', type=float, default=0, help='seconds before every replayed response')
+    parser.add_argument('--cache', default=SETTINGS['REFERENCE_CACHE_DIR'],
+                        help='directory of cached city and airport lists, empty to disable')
+    parser.add_argument('--cache-ttl', type=float, default=SETTINGS['REFERENCE_CACHE_TTL'],
+                        help='seconds before cached lists are revalidated')
+    parser.add_argument('-a', dest='arguments', action='append', default=[], metavar='NAME=VALUE',
+                        help='spider argument, e.g. -a months=3 for EcoLines')
+    parser.add_argument('--sequential', action='store_true',
+                        help='run the spiders one at a time with Scrapy defaults, like runspider')
+    args = parser.parse_args()
+
+    names = args.spiders or list(SPIDERS)
+    arguments = dict(argument.split('=', 1) for argument in args.arguments)
+    for name in names:
+        if name not in SPIDERS:
+            parser.error('unknown spider {}'.format(name))
+    overrides = {'REFERENCE_CACHE_DIR': args.cache, 'REFERENCE_CACHE_TTL': args.cache_ttl}
+    if args.fares:
+        overrides['FARES_DIR'] = args.fares
+    if args.record:
+        overrides['RECORD_DIR'] = args.record
+    if args.sequential:
+        overrides.update(CONCURRENT_REQUESTS=16, AUTOTHROTTLE_ENABLED=False)
+    process = CrawlerProcess(Settings(SETTINGS))
+    reactor = install_reactor()
+
+    resource = None
+    if args.replay:
+        listening, resource = replay.listen(args.replay, latency=args.latency)
+        overrides['REPLAY_URL'] = 'http://127.0.0.1:{}'.format(listening.getHost().port)
+
+    crawlers = [
+        Crawler(SPIDERS[name], spider_settings(
+            name, args.output, 8 if args.sequential else args.concurrency, **overrides
+        ))
+        for name in names
+    ]
+    started = time.perf_counter()
+    if args.sequential:
+        done = sequentially(process, crawlers, arguments)
+    else:
+        done = defer.DeferredList([process.crawl(crawler, **arguments) for crawler in crawlers])
+
+    def stop():
+        try:
+            reactor.stop()
+        except ReactorNotRunning:
+            pass
+
+    # The crawls can fail before the reactor runs
+    done.addBoth(lambda _: reactor.callWhenRunning(stop))
+    process.start(stop_after_crawl=False)
+    report(crawlers, time.perf_counter() - started)
+    if resource is not None:
+        print('replayed {} responses, {} missing'.format(resource.served, resource.missing))
+
+
+if __name__ == '__main__':
+    main()
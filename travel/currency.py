@@ -0,0 +1,109 @@
+"""
+Exchange rates and conversion of fare prices to EUR cents.
+
+Rates are read from a CSV of `date,currency,rate` rows, `rate` being EUR
+per unit of the currency from `date` until the next row of the currency.
+A fare is converted at the rate of its departure day, fares departing
+before the first row of their currency at that first rate. Prices are
+converted a column at a time, with one lookup per currency.
+
+Fares are stored, searched and summed in integer EUR cents, so a route
+costs exactly the sum of its tickets.
+"""
+import csv
+import os
+from datetime import datetime
+from functools import lru_cache
+
+import numpy as np
+
+from travel.store import to_minutes
+
+RATES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'rates.csv')
+MINOR_UNITS = 100
+
+# Currency ids carriers send instead of ISO codes: EcoLines' 31 is UAH
+ALIASES = {
+    '31': 'UAH',
+}
+
+
+def to_minor(eur):
+    """
+    EUR amount, or array of them, to whole cents
+    """
+    if isinstance(eur, np.ndarray):
+        return np.rint(eur * MINOR_UNITS).astype(np.int64)
+    return int(round(eur * MINOR_UNITS))
+
+
+def from_minor(cents):
+    return cents / MINOR_UNITS
+
+
+class RateTable:
+    """
+    Dated EUR rates of every currency
+    """
+
+    def __init__(self, rates):
+        """
+        :param rates: dict of currency code to (sorted int64 array of epoch
+        minutes each rate is valid from, float64 array of EUR per unit)
+        """
+        self.rates = rates
+
+    @classmethod
+    def load(cls, path=RATES):
+        rows = {}
+        with open(path) as f:
+            for row in csv.DictReader(f):
+                valid_from = to_minutes(datetime.strptime(row['date'], '%Y-%m-%d'))
+                rows.setdefault(row['currency'].upper(), []).append((valid_from, float(row['rate'])))
+        return cls({
+            code: (np.array([date for date, _ in sorted(dated)], dtype=np.int64),
+                   np.array([rate for _, rate in sorted(dated)], dtype=np.float64))
+            for code, dated in rows.items()
+        })
+
+    def rate(self, currency, when):
+        """
+        EUR per unit of `currency` at epoch minutes `when`, a number or an array
+        """
+        code = ALIASES.get(currency, currency).upper()
+        if code not in self.rates:
+            raise ValueError('Unknown currency {}'.format(currency))
+        dates, rates = self.rates[code]
+        return rates[np.maximum(np.searchsorted(dates, when, side='right') - 1, 0)]
+
+    def to_eur(self, prices, currencies, when):
+        """
+        Converts a whole price column
+        :param prices: float array in the currency of each fare
+        :param currencies: array of currency codes
+        :param when: int64 array of departures in epoch minutes
+        :return: float64 array of EUR prices
+        """
+        codes, positions = np.unique(currencies, return_inverse=True)
+        positions = positions.reshape(-1)
+        if len(codes) == 1:
+            return prices * self.rate(str(codes[0]), when)
+        eur = np.empty(len(prices), dtype=np.float64)
+        for i, code in enumerate(codes.tolist()):
+            rows = positions == i
+            eur[rows] = prices[rows] * self.rate(str(code), when[rows])
+        return eur
+
+    def to_minor(self, prices, currencies, when):
+        """
+        Like to_eur, in int64 EUR cents
+        """
+        return to_minor(self.to_eur(prices, currencies, when))
+
+
+@lru_cache(maxsize=None)
+def default_rates():
+    """
+    RateTable of RATES, read once per process
+    """
+    return RateTable.load(RATES)
@@ -1,10 +1,13 @@
 # encoding: utf-8
 import json
 from collections import OrderedDict
+from functools import lru_cache
 
 import dateutil.parser
 import scrapy
 from datetime import datetime
+from lxml import etree
+from parsel.csstranslator import HTMLTranslator
 
 from travel.utils import STATES
 
@@ -24,20 +27,68 @@ BOOKING = (
 
 ORIGIN = '#ecolines-booking-form-origin option'
 VALUE = 'option ::attr(value)'
-PRICE = '.journey .btn-primary span:not(.btn-label) ::text'
-DEPARTURE_TIME = '.journey .origin .time ::text'
-DEPARTURE_DATE = '.journey .origin .date ::text'
-DESTINATION_TIME = '.journey .destination .time ::text'
-DESTINATION_DATE = '.journey .destination .date ::text'
+JOURNEY = '.journey'
+PRICE = '.btn-primary span:not(.btn-label) ::text'
+DEPARTURE_TIME = '.origin .time ::text'
+DEPARTURE_DATE = '.origin .date ::text'
+DESTINATION_TIME = '.destination .time ::text'
+DESTINATION_DATE = '.destination .date ::text'
+
+FIELDS = [
+    'origin_id', 'origin_title', 'origin_state', 'origin_lat', 'origin_lon',
+    'destination_id', 'destination_title', 'destination_state',
+    'destination_lat', 'destination_lon',
+    'departureDate', 'arrivalDate',
+    'price', 'currencyCode',
+]
+
+
+def compile_css(css):
+    """
+    CSS selector compiled once to an lxml XPath, which returns plain
+    strings for ::text
+    """
+    return etree.XPath(HTMLTranslator().css_to_xpath(css), smart_strings=False)
+
+
+JOURNEY_XPATH = compile_css(JOURNEY)
+PRICE_XPATH = compile_css(PRICE)
+DEPARTURE_TIME_XPATH = compile_css(DEPARTURE_TIME)
+DEPARTURE_DATE_XPATH = compile_css(DEPARTURE_DATE)
+DESTINATION_TIME_XPATH = compile_css(DESTINATION_TIME)
+DESTINATION_DATE_XPATH = compile_css(DESTINATION_DATE)
+
+
+@lru_cache(maxsize=4096)
+def parse_datetime(date, time):
+    """
+    Journeys repeat the same few dates and times, each pair is parsed once
+    """
+    return dateutil.parser.parse('{} {}'.format(date, time))
 
 
 class EcolinesSpider(scrapy.Spider):
+    """
+    Crawls `months` months from `year`/`month` on, e.g.
+    scrapy runspider travel/ecolines.py -a months=3
+
+    Booking pages go before listings and earlier months before later
+    ones, so the queue stays short and the first months complete first.
+    Every journey on a booking page becomes an item, once per departure.
+    """
     name = 'ecolines'
     allowed_domains = ['ecolines.net']
     start_urls = [ORIGIN_URL]
 
+    def __init__(self, year=YEAR, month=MONTH, months=1, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        first = int(year) * 12 + int(month) - 1
+        self.months = [(m // 12, m % 12 + 1) for m in range(first, first + int(months))]
+        self.requested = set()
+        self.journeys = set()
+
     def parse(self, response):
-        jsonresponse = json.loads(response.body_as_unicode())
+        jsonresponse = json.loads(response.text)
         for item in jsonresponse:
             if item['state'] not in STATES:
                 continue
@@ -57,8 +108,10 @@ class EcolinesSpider(scrapy.Spider):
 
     def destination(self, response):
         origin_id = response.meta['origin_id']
-        jsonresponse = json.loads(response.body_as_unicode())
+        jsonresponse = json.loads(response.text)
         for item in jsonresponse:
+            if item['state'] not in STATES:
+                continue
             meta = response.meta.copy()
             meta.update({
                 'destination_id': item['id'],
@@ -67,31 +120,36 @@ class EcolinesSpider(scrapy.Spider):
                 'destination_lat': item['location']['latitude'],
                 'destination_lon': item['location']['longitude'],
             })
-            if item['state'] not in STATES:
-                continue
-            yield scrapy.Request(
-                DATES_URL.format(
-                    orig=origin_id,
-                    dest=item['id'],
-                    year=str(YEAR),
-                    month=str(MONTH),
-                ),
-                callback=self.dates,
-                meta=meta,
-            )
+            for index, (year, month) in enumerate(self.months):
+                yield scrapy.Request(
+                    DATES_URL.format(
+                        orig=origin_id,
+                        dest=item['id'],
+                        year=str(year),
+                        month=str(month),
+                    ),
+                    callback=self.dates,
+                    meta=meta,
+                    priority=-index,
+                )
 
     def dates(self, response):
         origin_id = response.meta['origin_id']
         destination_id = response.meta['destination_id']
-        jsonresponse = json.loads(response.body_as_unicode())
+        jsonresponse = json.loads(response.text)
         currency = UAH
         for date in jsonresponse:
+            dt = datetime.fromtimestamp(date // 1000)
+            key = (origin_id, destination_id, dt.date())
+            if key in self.requested:
+                self.crawler.stats.inc_value('ecolines/duplicate_dates')
+                continue
+            self.requested.add(key)
             meta = response.meta.copy()
             meta.update({
                 'currency': currency,
                 'date': date,
             })
-            dt = datetime.fromtimestamp(date // 1000)
             yield scrapy.Request(
                 BOOKING.format(
                     orig=origin_id,
@@ -101,35 +159,20 @@ class EcolinesSpider(scrapy.Spider):
                 ),
                 callback=self.booking,
                 meta=meta,
+                priority=len(self.months) + response.request.priority,
             )
 
     def booking(self, response):
-        data = response.css(PRICE).extract()
-        if data:
-            price = data[0]
-            departure_time = response.css(DEPARTURE_TIME).extract()[0]
-            departure_date = response.css(DEPARTURE_DATE).extract()[0]
-            arrival_time = response.css(DESTINATION_TIME).extract()[0]
-            arrival_date = response.css(DESTINATION_DATE).extract()[0]
-
-            departure_dt = dateutil.parser.parse('{} {}'.format(departure_date, departure_time))
-            arrival_dt = dateutil.parser.parse('{} {}'.format(arrival_date, arrival_time))
-
-            meta = response.meta.copy()
-            meta.update({
-                'price': price,
-                'departureDate': departure_dt,
-                'arrivalDate': arrival_dt,
-                'currencyCode': meta['currency'],
-            })
-
-            yield OrderedDict([
-                (key, meta[key])
-                for key in [
-                    'origin_id', 'origin_title', 'origin_state', 'origin_lat', 'origin_lon',
-                    'destination_id', 'destination_title', 'destination_state',
-                    'destination_lat', 'destination_lon',
-                    'departureDate', 'arrivalDate',
-                    'price', 'currencyCode',
-                ]
-            ])
+        meta = response.meta
+        origin = [meta[key] for key in FIELDS[:10]]
+        for journey in JOURNEY_XPATH(response.selector.root):
+            price = PRICE_XPATH(journey)
+            if not price:
+                continue
+            departure_dt = parse_datetime(DEPARTURE_DATE_XPATH(journey)[0], DEPARTURE_TIME_XPATH(journey)[0])
+            key = (meta['origin_id'], meta['destination_id'], departure_dt)
+            if key in self.journeys:
+                continue
+            self.journeys.add(key)
+            arrival_dt = parse_datetime(DESTINATION_DATE_XPATH(journey)[0], DESTINATION_TIME_XPATH(journey)[0])
+            yield OrderedDict(zip(FIELDS, origin + [departure_dt, arrival_dt, price[0], meta['currency']]))
@@ -0,0 +1,307 @@
+"""
+Typed columnar fare files, written while a crawl runs and loaded without
+parsing any text.
+
+A .fares file is a zip of .npy arrays, the layout np.savez writes:
+
+    groups/<n>/origin, destination  int32 positions in the place table
+    groups/<n>/departure, arrival   int64 epoch minutes, NO_ARRIVAL if unknown
+    groups/<n>/price                float64 in the fare's currency
+    groups/<n>/currency             int16 position in `currencies`
+    place_code, place_title, place_state, place_lat, place_lon
+    currencies, header
+
+Fares are written in row groups of ROW_GROUP rows as items arrive, the
+place and currency tables and the header once the crawl is done. Dates
+are converted when a row group is written, prices to EUR cents when it
+is read, so the file keeps what the carrier answered.
+
+    python -m travel.crawl --fares feeds
+    python -m travel.fares sample_data/wizzair.csv sample_data/ryanair.csv
+    scrapy runspider travel/wizzair.py -s FEED_EXPORTERS='{"fares": "travel.fares.FareExporter"}' \\
+        -o wizzair.fares -t fares
+"""
+import argparse
+import csv
+import json
+import os
+import zipfile
+from datetime import datetime
+
+import numpy as np
+
+from travel.currency import default_rates
+from travel.loader import DEFAULT_FLIGHT_MINUTES, Feed, date_parser
+from travel.store import to_minutes
+
+EXTENSION = '.fares'
+VERSION = 1
+ROW_GROUP = 10000
+NO_ARRIVAL = np.iinfo(np.int64).min
+
+GROUP_COLUMNS = [
+    ('origin', np.int32),
+    ('destination', np.int32),
+    ('departure', np.int64),
+    ('arrival', np.int64),
+    ('price', np.float64),
+    ('currency', np.int16),
+]
+PLACE_COLUMNS = ['place_code', 'place_title', 'place_state', 'place_lat', 'place_lon']
+
+
+class FareWriter:
+    """
+    Writes fare items, dicts with the fields of the feed CSVs, to a .fares
+    file. Dates may be datetimes or strings, everything else strings or
+    numbers.
+    """
+
+    def __init__(self, f, row_group=ROW_GROUP):
+        """
+        :param f: file object open for binary writing, left open by close
+        :param row_group: fares per row group
+        """
+        self.archive = zipfile.ZipFile(f, 'w', zipfile.ZIP_STORED, allowZip64=True)
+        self.row_group = row_group
+        self.places = {}
+        self.currencies = {}
+        self.groups = []
+        self.parsers = {}
+        self.rows = {column: [] for column, _ in GROUP_COLUMNS}
+
+    def _place(self, item, prefix):
+        code = item.get(prefix + 'airport', item.get(prefix + 'id', ''))
+        key = (
+            str(code), item[prefix + 'title'], item.get(prefix + 'state') or '',
+            float(item[prefix + 'lat']), float(item[prefix + 'lon']),
+        )
+        return self.places.setdefault(key, len(self.places))
+
+    def add(self, item):
+        rows = self.rows
+        rows['origin'].append(self._place(item, 'origin_'))
+        rows['destination'].append(self._place(item, 'destination_'))
+        rows['departure'].append(item['departureDate'])
+        rows['arrival'].append(item.get('arrivalDate') or None)
+        rows['price'].append(float(item['price']))
+        rows['currency'].append(self.currencies.setdefault(str(item['currencyCode']), len(self.currencies)))
+        if len(rows['origin']) >= self.row_group:
+            self.flush()
+
+    def _minutes(self, values, column):
+        if isinstance(values[0], datetime):
+            return np.array([to_minutes(value.replace(tzinfo=None)) for value in values], dtype=np.int64)
+        parser = self.parsers.get(column)
+        if parser is None:
+            parser = self.parsers[column] = date_parser(values[0])
+        return parser(values)
+
+    def flush(self):
+        """
+        Writes the buffered fares as a row group
+        """
+        rows = self.rows
+        count = len(rows['origin'])
+        if not count:
+            return
+        arrivals = rows['arrival']
+        rows['departure'] = self._minutes(rows['departure'], 'departure')
+        rows['arrival'] = np.full(count, NO_ARRIVAL, dtype=np.int64)
+        present = [i for i, value in enumerate(arrivals) if value is not None]
+        if present:
+            rows['arrival'][present] = self._minutes([arrivals[i] for i in present], 'arrival')
+        for column, dtype in GROUP_COLUMNS:
+            self._write('groups/{:06d}/{}'.format(len(self.groups), column), np.asarray(rows[column], dtype=dtype))
+        self.groups.append(count)
+        self.rows = {column: [] for column, _ in GROUP_COLUMNS}
+
+    def _write(self, name, array):
+        with self.archive.open(name + '.npy', 'w', force_zip64=True) as member:
+            np.lib.format.write_array(member, array, allow_pickle=False)
+
+    def close(self):
+        """
+        Writes the last row group, the place and currency tables and the
+        header
+        """
+        self.flush()
+        places = list(self.places)
+        for i, column in enumerate(PLACE_COLUMNS):
+            dtype = np.float64 if column in ('place_lat', 'place_lon') else str
+            self._write(column, np.array([place[i] for place in places], dtype=dtype))
+        self._write('currencies', np.array(list(self.currencies), dtype=str))
+        self._write('header', np.array(json.dumps({'version': VERSION, 'row_groups': self.groups})))
+        self.archive.close()
+
+
+class FarePipeline:
+    """
+    Item pipeline writing every spider's items to FARES_DIR/<spider>.fares
+    next to whatever feed the crawl exports, in row groups of
+    FARES_ROW_GROUP fares
+    """
+
+    def __init__(self, directory, row_group):
+        self.directory = directory
+        self.row_group = row_group
+        self.file = None
+        self.writer = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        from scrapy.exceptions import NotConfigured
+
+        directory = crawler.settings.get('FARES_DIR')
+        if not directory:
+            raise NotConfigured
+        return cls(directory, crawler.settings.getint('FARES_ROW_GROUP', ROW_GROUP))
+
+    def open_spider(self, spider):
+        os.makedirs(self.directory, exist_ok=True)
+        self.file = open(os.path.join(self.directory, spider.name + EXTENSION), 'wb')
+        self.writer = FareWriter(self.file, self.row_group)
+
+    def process_item(self, item, spider):
+        self.writer.add(item)
+        return item
+
+    def close_spider(self, spider):
+        self.writer.close()
+        self.file.close()
+
+
+class FareExporter:
+    """
+    Feed exporter for FEED_EXPORTERS, `-t fares` writes the feed as a
+    .fares file. Export options meant for text formats are ignored.
+    """
+
+    def __init__(self, file, **kwargs):
+        self.writer = FareWriter(file)
+
+    def start_exporting(self):
+        pass
+
+    def export_item(self, item):
+        self.writer.add(item)
+
+    def finish_exporting(self):
+        self.writer.close()
+
+
+def _header(data):
+    header = json.loads(str(data['header']))
+    if header['version'] != VERSION:
+        raise ValueError('Unsupported fare file version {}'.format(header['version']))
+    return header
+
+
+def row_groups(path):
+    """
+    :return: fares in every row group of the file
+    """
+    with np.load(path) as data:
+        return _header(data)['row_groups']
+
+
+def _points(lats, lons, titles, origin, destination):
+    """
+    Feed.points from the place table: the places rows refer to in the
+    order rows meet them, merged by coordinates, so only distinct places
+    are looked at
+    """
+    places, first = np.unique(np.column_stack((origin, destination)).reshape(-1), return_index=True)
+    positions = {}
+    point_lats = []
+    point_lons = []
+    point_titles = []
+    points = np.zeros(len(lats), dtype=np.int32)
+    for place in places[np.argsort(first)].tolist():
+        key = (lats[place], lons[place])
+        position = positions.get(key)
+        if position is None:
+            position = positions[key] = len(point_lats)
+            point_lats.append(lats[place])
+            point_lons.append(lons[place])
+            point_titles.append(titles[place])
+        points[place] = position
+    return point_lats, point_lons, point_titles, points[origin], points[destination]
+
+
+def _feed(data, groups):
+    columns = {
+        column: np.concatenate([data['groups/{:06d}/{}'.format(group, column)] for group in groups])
+        if groups else np.empty(0, dtype=dtype)
+        for column, dtype in GROUP_COLUMNS
+    }
+    lat = data['place_lat']
+    lon = data['place_lon']
+    title = data['place_title']
+    state = data['place_state']
+    origin = columns['origin']
+    destination = columns['destination']
+    departure = columns['departure']
+    arrival = columns['arrival']
+    arrival = np.where(arrival == NO_ARRIVAL, departure + DEFAULT_FLIGHT_MINUTES, arrival)
+    return Feed(
+        origin_lat=lat[origin], origin_lon=lon[origin],
+        origin_title=title[origin].tolist(), origin_state=state[origin].tolist(),
+        destination_lat=lat[destination], destination_lon=lon[destination],
+        destination_title=title[destination].tolist(), destination_state=state[destination].tolist(),
+        departure=departure, arrival=arrival,
+        price=default_rates().to_minor(columns['price'], data['currencies'][columns['currency']], departure),
+        points=_points(lat.tolist(), lon.tolist(), title.tolist(), origin, destination),
+    )
+
+
+def read_fares(path):
+    """
+    Reads a whole .fares file into a Feed, the same one read_feed parses
+    from the CSV of the same crawl
+    """
+    with np.load(path) as data:
+        return _feed(data, list(range(len(_header(data)['row_groups']))))
+
+
+def parse_row_group(path, group, feed_filter=None):
+    """
+    Reads one row group into a compact Feed, the .fares counterpart of
+    loader.parse_chunk. Runs in worker processes.
+    """
+    with np.load(path) as data:
+        feed = _feed(data, [group])
+    if feed_filter is not None:
+        feed = feed.select(feed_filter.mask(feed))
+    return feed.compact()
+
+
+def convert(source, target, row_group=ROW_GROUP):
+    """
+    Writes the fares of a feed CSV to a .fares file
+    :return: number of fares
+    """
+    rows = 0
+    with open(source) as f, open(target, 'wb') as out:
+        writer = FareWriter(out, row_group)
+        for row in csv.DictReader(f):
+            writer.add(row)
+            rows += 1
+        writer.close()
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Convert feed CSVs to .fares files')
+    parser.add_argument('feeds', nargs='+', help='feed CSVs, each written next to it as <name>.fares')
+    parser.add_argument('--row-group', type=int, default=ROW_GROUP, help='fares per row group')
+    args = parser.parse_args()
+
+    for source in args.feeds:
+        target = os.path.splitext(source)[0] + EXTENSION
+        rows = convert(source, target, args.row_group)
+        print('{}: {} fares, {} -> {} bytes'.format(target, rows, os.path.getsize(source), os.path.getsize(target)))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,10 +1,19 @@
-import csv
-from datetime import timedelta, datetime
-
-import dateutil.parser
-import matplotlib.pyplot as plt
-
-from travel.plot import europe_map
+import numpy as np
+
+from travel import snapshot
+from travel.cache import RouteCache
+from travel.currency import from_minor, to_minor
+from travel.loader import CHUNK_SIZE, load_parallel, load_routes, update_routes
+from travel.matrix import price_matrix
+from travel.patterns import TransferPatterns
+from travel.profiling import INSTRUMENTS
+from travel.search import (
+    DEPARTURE_FROM, DEPARTURE_TO, MIN_LAYOVER, MIN_STAY, MAX_STAY, LowerBounds, SearchStats, Window, bidirectional_path,
+    cheapest_path, cheapest_tree, fastest_path, pareto_paths, round_trips,
+)
+from travel.snapshot import SnapshotError
+from travel.spatial import GridIndex
+from travel.store import ConnectionStore, from_minutes, to_minutes
 from travel.utils import coord_distance
 
 KYIV = (50.5, 30.5)
@@ -13,12 +22,133 @@ BERLIN = (52.5, 13.5)
 PARIS = (49.4544, 2.11278)
 RIGA = (56.9236, 23.9711)
 
+SNAPSHOT = 'graph.snapshot'
+PATTERNS = 'graph.patterns'
+
 
 class Graph:
-    def __init__(self):
+    def __init__(self, cache_size=1024, cache_ttl=None):
+        """
+        :param cache_size: max number of cached `path` results, 0 disables the cache
+        :param cache_ttl: seconds a cached result stays valid, forever if None
+        """
+        self.store = ConnectionStore()
         self.nodes = []
-        self.connections = []
         self.coords_cache = {}
+        self.index = GridIndex()
+        self.cache = RouteCache(cache_size, cache_ttl)
+        self._bounds = None
+        self.patterns = None
+        self.patterns_path = None
+        self._patterns_version = None
+
+    @property
+    def connections(self):
+        return [Connection(self, i) for i in self.store.live().tolist()]
+
+    def connection(self, index):
+        return Connection(self, index)
+
+    def rebuild_nodes(self):
+        """
+        Recreates node views and the spatial index from the store
+        """
+        store = self.store
+        self.nodes = [Node(self, i) for i in range(store.node_count)]
+        self.index = GridIndex()
+        for node, lat, lon in zip(self.nodes, store.lat.tolist(), store.lon.tolist()):
+            self.index.insert(lat, lon, node)
+        self.coords_cache = {}
+        self.cache.clear()
+
+    def copy(self):
+        """
+        Graph over a copy of the store, to change while this one keeps
+        answering queries. Cached routes, snapped coordinates and loaded
+        transfer patterns are carried over.
+        """
+        graph = Graph()
+        graph.store = self.store.copy()
+        graph.rebuild_nodes()
+        graph.coords_cache = {point: graph.nodes[node.id] for point, node in self.coords_cache.items()}
+        graph.cache = self.cache.copy(lambda route: route and dict(
+            route, path=[Connection(graph, connection.index) for connection in route['path']],
+        ))
+        patterns = self.patterns
+        if patterns is not None:
+            graph.patterns = TransferPatterns(patterns.sequences, patterns.max_hops, patterns.digests,
+                                              patterns.window_key)
+            graph.patterns_path = self.patterns_path
+            graph._patterns_version = self._patterns_version
+        return graph
+
+    def save(self, path, sources=()):
+        """
+        Writes a binary snapshot of the graph
+        :param path: snapshot file
+        :param sources: source files the graph was built from, checked by load
+        """
+        snapshot.save(self, path, sources)
+
+    @classmethod
+    def load(cls, path, sources=None):
+        """
+        Memory-maps a snapshot written by save
+        :param path: snapshot file
+        :param sources: source files to validate against, raises SnapshotError if they changed
+        :return: Graph
+        """
+        return snapshot.load(cls(), path, sources)
+
+    def bounds(self):
+        """
+        LowerBounds for A* searches, recomputed after the store changed
+        """
+        if self._bounds is None or self._bounds[0] != self.store.version:
+            self._bounds = (self.store.version, LowerBounds(self.store))
+        return self._bounds[1]
+
+    def load_patterns(self, path=PATTERNS, max_hops=2, window=None):
+        """
+        Loads transfer patterns for `path(method='patterns')`, building them
+        and saving them to `path` if the file is missing, or refreshing them
+        if connections changed since it was saved.
+        :param window: Window they are built for, Window() if None
+        """
+        self.patterns = TransferPatterns.load_or_build(self.store, path, max_hops, window)
+        self.patterns_path = path
+        self._patterns_version = (self.store.version, True)
+        return self.patterns
+
+    def refresh_patterns(self):
+        """
+        Brings loaded transfer patterns up to date with the connections,
+        searching again only from the origins the changes can affect, and
+        saves them. `apply_feed` calls it, after adding connections
+        otherwise pattern queries search the graph until it is called.
+        :return: number of origins searched again
+        """
+        patterns, searched = self.patterns.refresh(self.store)
+        if searched:
+            patterns.save(self.patterns_path)
+        self.patterns = patterns
+        self._patterns_version = (self.store.version, True)
+        if INSTRUMENTS.enabled:
+            INSTRUMENTS.count('patterns/refreshed', searched)
+        return searched
+
+    def current_patterns(self):
+        """
+        Transfer patterns, or None if connections in their window changed
+        since they were built or refreshed
+        """
+        if self.patterns is None:
+            raise ValueError('Transfer patterns are not loaded, see load_patterns')
+        version, current = self._patterns_version
+        if version != self.store.version:
+            current = self.patterns.current(self.store)
+            self._patterns_version = (self.store.version, current)
+        return self.patterns if current else None
 
     def closest(self, lat, lon, maximum=50):
         """
@@ -30,75 +160,353 @@ class Graph:
         """
         cached_node = self.coords_cache.get((lat, lon))
         if cached_node:
+            if INSTRUMENTS.enabled:
+                INSTRUMENTS.count('snap/cache_hits')
             return cached_node
 
-        distances = [
-            (node.distance(lat, lon), node)
-            for node in self.nodes
-        ]
-        if distances:
-            distance, node = min(distances)
-            if distance <= maximum:
-                self.coords_cache[(lat, lon)] = node
-                return node
+        if INSTRUMENTS.enabled:
+            INSTRUMENTS.count('snap/cache_misses')
+        with INSTRUMENTS.timer('snap/nearest'):
+            nearest = self.index.nearest(lat, lon, maximum)
+        if nearest:
+            distance, node = nearest
+            self.coords_cache[(lat, lon)] = node
+            return node
+
 
     def add(self, lat, lon, city):
         node = self.closest(lat, lon)
         if not node:
-            node = Node(lat, lon, city)
+            node = Node(self, self.store.add_node(lat, lon, city))
             self.nodes.append(node)
+            self.index.insert(lat, lon, node)
+            if INSTRUMENTS.enabled:
+                INSTRUMENTS.count('snap/nodes')
         return node
 
-    def edge(self, n1, n2, **meta):
-        c = Connection(n1, n2, **meta)
-        n1.edge(c)
-        self.connections.append(c)
-
-    def path(self, n1, n2, max_price=1000, max_hops=2, path=None):
-        if path is None:
-            path = {
-                'path': [],
-                'price': 0,
-                'hops': 0,
-            }
-        if path['price'] > max_price:
-            return
-        if path['path'] and path['path'][-1].contains(n2):
-            return path
-        if path['hops'] + 1 > max_hops:
-            return
-        print(path)
-        pathes = []
-        for c in n1.connections:
-            if c.departure < datetime(2018, 1, 1) or c.departure > datetime(2018, 2, 20):
+    def edge(self, n1, n2, price, name, departure, arrival):
+        """
+        Adds one connection, `price` in EUR
+        """
+        departure = to_minutes(departure)
+        index = self.store.add(n1.id, n2.id, departure, to_minutes(arrival), to_minor(price), name)
+        self.cache.invalidate([n1.id], [departure])
+        if INSTRUMENTS.enabled:
+            INSTRUMENTS.count('edges/added')
+        return Connection(self, index)
+
+    def edges(self, origins, destinations, departures, arrivals, prices, name):
+        """
+        Adds connections of carrier `name` given as columns of node ids,
+        epoch minutes and prices in EUR cents
+        """
+        with INSTRUMENTS.timer('edges/add'):
+            self.store.extend(origins, destinations, departures, arrivals, prices, name)
+            self.cache.invalidate(origins, departures)
+        if INSTRUMENTS.enabled:
+            INSTRUMENTS.count('edges/added', len(origins))
+
+    def _snap(self, feed):
+        """
+        Snaps the distinct points of a Feed to nodes
+        :return: origin and destination node id of every row
+        """
+        with INSTRUMENTS.timer('snap/feed'):
+            lats, lons, titles, origin_points, destination_points = feed.points()
+            nodes = np.array([self.add(lat, lon, title).id for lat, lon, title in zip(lats, lons, titles)],
+                             dtype=np.int32)
+        return nodes[origin_points], nodes[destination_points]
+
+    def add_feed(self, feed, name, seen=None):
+        """
+        Snaps the origins and destinations of a Feed to nodes and adds its
+        connections in one go
+        :param feed: Feed
+        :param name: carrier name
+        :param seen: optional loader.FareSet of fares already added,
+        duplicates of them are skipped and new fares are added to it
+        :return: number of connections added
+        """
+        origins, destinations = self._snap(feed)
+        departures, arrivals, prices = feed.departure, feed.arrival, feed.price
+        if seen is not None:
+            keep = seen.new(origins, destinations, departures, arrivals, prices)
+            if not keep.all():
+                origins, destinations = origins[keep], destinations[keep]
+                departures, arrivals, prices = departures[keep], arrivals[keep], prices[keep]
+        self.edges(origins, destinations, departures, arrivals, prices, name)
+        return len(origins)
+
+    def apply_feed(self, feed, name):
+        """
+        Makes the connections of carrier `name` match a newer Feed of it.
+        Connections are matched by (origin, destination, departure): new
+        keys are added, keys missing from the feed are removed and matched
+        connections get the price and arrival of the feed. When the feed
+        has a key more than once its cheapest row is used.
+        :param feed: Feed with every current connection of the carrier
+        :param name: carrier name
+        :return: (added, removed, updated, unchanged) connection counts
+        """
+        store = self.store
+        origins, destinations = self._snap(feed)
+        departures, arrivals, prices = feed.departure, feed.arrival, feed.price
+        rows = {}
+        for i, key in enumerate(zip(origins.tolist(), destinations.tolist(), departures.tolist())):
+            j = rows.get(key)
+            if j is None or prices[i] < prices[j]:
+                rows[key] = i
+
+        existing = store.keys(name)
+        added = []
+        removed = []
+        updated = []
+        updated_rows = []
+        for key, i in rows.items():
+            positions = existing.pop(key, None)
+            if positions is None:
+                added.append(i)
                 continue
-            if path['path']:
-                prev_conn = path['path'][-1]
-                if c.departure - prev_conn.arrival <= timedelta(days=2):
-                    continue
-
-            c_to = c.pair(n1)
-            next_path = self.path(
-                c_to, n2, max_price, max_hops,
-                {
-                    'path': path['path'] + [c],
-                    'price': path['price'] + c.price,
-                    'hops': path['hops'] + 1,
-                }
-            )
-            if next_path:
-                pathes.append(next_path)
-        pathes = sorted(pathes, key=lambda p: p['price'])
-        if pathes:
-            return pathes[0]
+            position = positions[0]
+            removed.extend(positions[1:])
+            if store.price[position] != prices[i] or store.arrival[position] != arrivals[i]:
+                updated.append(position)
+                updated_rows.append(i)
+        for positions in existing.values():
+            removed.extend(positions)
+
+        store.update(updated, prices[updated_rows], arrivals[updated_rows])
+        if removed:
+            store.remove(removed)
+        changed = np.array(updated + removed, dtype=np.int64)
+        self.cache.invalidate(store.origin[changed], store.departure[changed])
+        if added:
+            added.sort()
+            self.edges(origins[added], destinations[added], departures[added], arrivals[added], prices[added], name)
+        if self.patterns is not None:
+            self.refresh_patterns()
+        return len(added), len(removed), len(updated), len(rows) - len(added) - len(updated)
+
+    def update(self, f, name, feed_filter=None):
+        """
+        Applies a newer feed CSV of carrier `name` in place
+        :param f: file object
+        :param name: carrier name
+        :param feed_filter: optional FeedFilter
+        :return: FeedDelta
+        """
+        return update_routes(self, f, name, feed_filter)
+
+    def compact(self):
+        """
+        Drops removed connections from the store. Positions of connections
+        change, so Connection views taken before are invalid.
+        """
+        self.store.compact()
+        self.cache.clear()
+
+    def path(self, n1, n2, max_price=1000, max_hops=2, departure_from=DEPARTURE_FROM, departure_to=DEPARTURE_TO,
+             min_layover=MIN_LAYOVER, max_layover=None, method='dijkstra', stats=None):
+        """
+        Returns the cheapest route from n1 to n2
+        :param n1: origin Node
+        :param n2: destination Node
+        :param max_price: max total price in EUR
+        :param max_hops: max number of connections
+        :param departure_from: earliest departure of any connection
+        :param departure_to: latest departure of any connection
+        :param min_layover: a connection must depart later than this after the previous arrival
+        :param max_layover: a connection must depart at most this after the previous arrival
+        :param method: 'dijkstra', 'astar' guided by a great-circle price bound,
+        'bidirectional' or 'patterns' over precomputed transfer patterns, which
+        searches like 'dijkstra' while they are stale or built for another
+        window or fewer hops and counts search/patterns_stale or
+        search/patterns_uncovered then, all find a route of the same price
+        :param stats: optional SearchStats, filled in unless the route was cached
+        :return: dict with `path`, `price` and `hops` or None
+        """
+        window = Window(departure_from, departure_to, min_layover, max_layover)
+        key = (n1.id, n2.id, window.key, max_hops, max_price, method)
+        hit, route = self.cache.get(key)
+        if hit and INSTRUMENTS.enabled:
+            INSTRUMENTS.count('search/cache_hits')
+        if not hit:
+            stats = stats if stats is not None else SearchStats()
+            with INSTRUMENTS.search(method, stats):
+                if method == 'dijkstra':
+                    route = cheapest_path(self, n1, n2, max_price, max_hops, window, stats)
+                elif method == 'astar':
+                    route = cheapest_path(self, n1, n2, max_price, max_hops, window, stats, self.bounds())
+                elif method == 'bidirectional':
+                    route = bidirectional_path(self, n1, n2, max_price, max_hops, window, stats)
+                elif method == 'patterns':
+                    patterns = self.current_patterns()
+                    if patterns is not None and patterns.covers(window, max_hops):
+                        route = patterns.path(self, n1, n2, max_price, max_hops, window)
+                    else:
+                        if INSTRUMENTS.enabled:
+                            INSTRUMENTS.count('search/patterns_stale' if patterns is None else
+                                              'search/patterns_uncovered')
+                        route = cheapest_path(self, n1, n2, max_price, max_hops, window, stats)
+                else:
+                    raise ValueError('Unknown search method {}'.format(method))
+            # A* prunes by bounds that new connections can loosen and the
+            # backward search reaches nodes through incoming connections,
+            # so only a Dijkstra search has a region that covers every change
+            region = [node.id for node in stats.label_counts] if method == 'dijkstra' else None
+            self.cache.put(key, route, region, window.departure_from, window.departure_to)
+        if route is not None:
+            route = dict(route, path=list(route['path']))
+        return route
+
+    def fastest(self, n1, n2, max_price=1000, max_hops=2, departure_from=DEPARTURE_FROM, departure_to=DEPARTURE_TO,
+                min_layover=MIN_LAYOVER, max_layover=None, astar=True, stats=None):
+        """
+        Returns the route from n1 to n2 that arrives first
+        :param astar: guide the search by a great-circle travel time bound
+        :param stats: optional SearchStats to fill in
+        :return: dict with `path`, `price` and `hops` or None
+        """
+        window = Window(departure_from, departure_to, min_layover, max_layover)
+        bounds = self.bounds() if astar else None
+        stats = stats if stats is not None else SearchStats()
+        with INSTRUMENTS.search('fastest', stats):
+            return fastest_path(self, n1, n2, max_price, max_hops, window, stats, bounds)
+
+    def cheapest_from(self, n1, max_price=1000, max_hops=2, departure_from=DEPARTURE_FROM,
+                      departure_to=DEPARTURE_TO, min_layover=MIN_LAYOVER, max_layover=None):
+        """
+        Returns the cheapest route from n1 to every reachable node, found in
+        a single search
+        :param n1: origin Node
+        :return: dict of destination Node to route dict
+        """
+        window = Window(departure_from, departure_to, min_layover, max_layover)
+        stats = SearchStats()
+        with INSTRUMENTS.search('tree', stats):
+            tree = cheapest_tree(self, n1, max_price, max_hops, window, stats)
+        return {self.nodes[node]: label.as_route(self) for node, label in tree.items()}
+
+    def matrix(self, origins=None, destinations=None, max_price=1000, max_hops=2, departure_from=DEPARTURE_FROM,
+               departure_to=DEPARTURE_TO, min_layover=MIN_LAYOVER, max_layover=None, workers=None,
+               snapshot=None, stats=None):
+        """
+        Returns the cheapest price, arrival and hops between every origin
+        and destination, searching origins in parallel
+        :param origins: origin Nodes, all nodes if None
+        :param destinations: destination Nodes, all nodes if None
+        :param workers: number of processes, os.cpu_count() if None
+        :param snapshot: snapshot of this graph for the workers to map, a
+        temporary one is written if None
+        :param stats: optional SearchStats, receives the total of labels expanded
+        :return: PriceMatrix
+        """
+        window = Window(departure_from, departure_to, min_layover, max_layover)
+        origins = [n.id for n in (origins if origins is not None else self.nodes)]
+        destinations = [n.id for n in (destinations if destinations is not None else self.nodes)]
+        stats = stats if stats is not None else SearchStats()
+        with INSTRUMENTS.search('matrix', stats):
+            return price_matrix(self, origins, destinations, max_price, max_hops, window, workers, snapshot, stats)
+
+    def round_trip(self, n1, n2, max_price=1000, max_hops=2, departure_from=DEPARTURE_FROM, departure_to=DEPARTURE_TO,
+                   min_stay=MIN_STAY, max_stay=MAX_STAY, return_by=None, min_layover=MIN_LAYOVER, max_layover=None,
+                   return_from=None, return_to=None, stats=None):
+        """
+        Returns the cheapest trip from n1 to n2 and back, found by one
+        search each way, see `round_trips`
+        :param n1: origin Node
+        :param n2: destination Node
+        :param max_price: max total price of both directions in EUR
+        :param max_hops: max number of connections each way
+        :param departure_from: earliest departure of any connection
+        :param departure_to: latest departure of an outbound connection
+        :param min_stay: min time between the arrival at n2 and the return departure
+        :param max_stay: max time between the arrival at n2 and the return departure
+        :param return_by: latest departure of a return connection, departure_to + max_stay if None
+        :param return_from: Node the return leaves from for an open-jaw trip, n2 if None
+        :param return_to: Node the return ends at, n1 if None
+        :return: dict with `outbound` and `return` routes, `price` and `stay` or None
+        """
+        trips = self.round_trips(
+            n1, max_price, max_hops, departure_from, departure_to, min_stay, max_stay, return_by, min_layover,
+            max_layover, pairs=[(n2, return_from if return_from is not None else n2)], return_to=return_to,
+            stats=stats,
+        )
+        return trips[0] if trips else None
+
+    def round_trips(self, n1, max_price=1000, max_hops=2, departure_from=DEPARTURE_FROM, departure_to=DEPARTURE_TO,
+                    min_stay=MIN_STAY, max_stay=MAX_STAY, return_by=None, min_layover=MIN_LAYOVER, max_layover=None,
+                    pairs=None, return_to=None, stats=None):
+        """
+        Returns the cheapest round trip from n1 to every destination, or to
+        every (destination, return origin) pair of `pairs`, sorted by price.
+        Takes one outbound and one return search whatever the number of
+        destinations, instead of two `path` calls per destination and stay.
+        Parameters are those of `round_trip`.
+        :return: list of trip dicts
+        """
+        window = Window(departure_from, departure_to, min_layover, max_layover)
+        return_window = Window(
+            departure_from + min_stay, return_by if return_by is not None else departure_to + max_stay,
+            min_layover, max_layover,
+        )
+        stats = stats if stats is not None else SearchStats()
+        with INSTRUMENTS.search('round_trips', stats):
+            return round_trips(self, n1, pairs, return_to, max_price, max_hops, window, return_window, min_stay,
+                               max_stay, stats)
+
+    def pareto(self, n1, n2, max_price=1000, max_hops=2, max_labels=16, departure_from=DEPARTURE_FROM,
+               departure_to=DEPARTURE_TO, min_layover=MIN_LAYOVER, max_layover=None, stats=None):
+        """
+        Returns non-dominated routes from n1 to n2 by price, total travel
+        time and number of hops, e.g. the cheapest, the fastest and the one
+        with fewest changes
+        :param n1: origin Node
+        :param n2: destination Node
+        :param max_price: max total price in EUR
+        :param max_hops: max number of connections
+        :param max_labels: max number of labels kept per node
+        :param departure_from: earliest departure of any connection
+        :param departure_to: latest departure of any connection
+        :param min_layover: a connection must depart later than this after the previous arrival
+        :param max_layover: a connection must depart at most this after the previous arrival
+        :param stats: optional SearchStats, receives per-node label counts
+        :return: list of route dicts sorted by price
+        """
+        window = Window(departure_from, departure_to, min_layover, max_layover)
+        stats = stats if stats is not None else SearchStats()
+        with INSTRUMENTS.search('pareto', stats):
+            return pareto_paths(self, n1, n2, max_price, max_hops, max_labels, window, stats)
 
 
 class Node:
-    def __init__(self, lat, lon, city):
-        self.city = city
-        self.lon = lon
-        self.lat = lat
-        self.connections = []
+    """
+    View of a node stored in `graph.store`
+    """
+    __slots__ = ('graph', 'id')
+
+    def __init__(self, graph, id):
+        self.graph = graph
+        self.id = id
+
+    @property
+    def city(self):
+        return self.graph.store.cities[self.id]
+
+    @property
+    def lat(self):
+        return float(self.graph.store.lat[self.id])
+
+    @property
+    def lon(self):
+        return float(self.graph.store.lon[self.id])
+
+    @property
+    def connections(self):
+        """
+        Outgoing connections sorted by departure
+        """
+        return [Connection(self.graph, i) for i in self.graph.store.outgoing(self.id).tolist()]
 
     @property
     def point(self):
@@ -108,21 +516,44 @@ class Node:
         point = (lat, lon)
         return coord_distance(self.point, point)
 
-    def edge(self, c):
-        self.connections.append(c)
-
     def __repr__(self):
         return 'Node({})'.format(self.city)
 
 
 class Connection:
-    def __init__(self, n1, n2, price, name, departure, arrival):
-        self.arrival = arrival
-        self.departure = departure
-        self.name = name
-        self.n1 = n1
-        self.n2 = n2
-        self.price = price
+    """
+    View of a connection stored in `graph.store`
+    """
+    __slots__ = ('graph', 'index')
+
+    def __init__(self, graph, index):
+        self.graph = graph
+        self.index = index
+
+    @property
+    def n1(self):
+        return self.graph.nodes[self.graph.store.origin[self.index]]
+
+    @property
+    def n2(self):
+        return self.graph.nodes[self.graph.store.destination[self.index]]
+
+    @property
+    def price(self):
+        return from_minor(int(self.graph.store.price[self.index]))
+
+    @property
+    def name(self):
+        store = self.graph.store
+        return store.carriers[store.carrier[self.index]]
+
+    @property
+    def departure(self):
+        return from_minutes(self.graph.store.departure[self.index])
+
+    @property
+    def arrival(self):
+        return from_minutes(self.graph.store.arrival[self.index])
 
     def pair(self, n):
         if n == self.n1:
@@ -133,42 +564,32 @@ class Connection:
     def contains(self, n):
         return self.n1 == n or self.n2 == n
 
+    def __eq__(self, other):
+        return isinstance(other, Connection) and self.graph is other.graph and self.index == other.index
+
+    def __hash__(self):
+        return hash((id(self.graph), self.index))
+
     def __repr__(self):
         return 'Connection({}, {})'.format(self.n1, self.n2)
 
 
-def price_in_eur(price, currency):
-    if currency in ['31', 'UAH']:
-        return price * 0.029678566
-    elif currency == 'EUR':
-        return price
-    elif currency == 'PLN':
-        return price * 0.239407099
-    else:
-        raise ValueError(currency)
-
-
-def process_routes(f, name):
-    reader = csv.DictReader(f)
-    for row in reader:
-        lat_1 = float(row['origin_lat'])
-        lon_1 = float(row['origin_lon'])
-        lat_2 = float(row['destination_lat'])
-        lon_2 = float(row['destination_lon'])
-        price = float(row['price'])
-        currency = row['currencyCode']
-        eur = price_in_eur(price, currency)
-        node_1 = g.add(lat_1, lon_1, row['origin_title'])
-        node_2 = g.add(lat_2, lon_2, row['destination_title'])
-        departure = dateutil.parser.parse(row['departureDate'])
-        if row.get('arrivalDate'):
-            arrival = dateutil.parser.parse(row['arrivalDate'])
-        else:
-            arrival = departure + timedelta(hours=3)
-        g.edge(node_1, node_2, price=eur, name=name, departure=departure.replace(tzinfo=None), arrival=arrival.replace(tzinfo=None))
+def process_routes(f, name, graph=None, chunk_size=CHUNK_SIZE, feed_filter=None, progress=None):
+    """
+    Loads a feed CSV into the graph chunk by chunk
+    :param progress: optional callable receiving a ChunkProgress per chunk
+    """
+    if graph is None:
+        graph = g
+    for chunk in load_routes(graph, f, name, chunk_size, feed_filter):
+        if progress is not None:
+            progress(chunk)
 
 
 def plot_graph(g):
+    import matplotlib.pyplot as plt
+    from travel.plot import europe_map
+
     m = europe_map()
     lons = [n.lon for n in g.nodes]
     lats = [n.lat for n in g.nodes]
@@ -188,6 +609,9 @@ def plot_graph(g):
 
 
 def plot_route(route):
+    import matplotlib.pyplot as plt
+    from travel.plot import europe_map
+
     m = europe_map()
     for c in route['path']:
         lons = (c.n1.lon, c.n2.lon)
@@ -223,19 +647,23 @@ def plot_route(route):
 
 
 if __name__ == '__main__':
-    g = Graph()
+    feeds = [('wizzair.csv', 'wizzair'), ('ryanair.csv', 'ryanair'), ('ecolines.csv', 'ecolines')]
+    sources = [path for path, _ in feeds]
+
+    try:
+        g = Graph.load(SNAPSHOT, sources)
+        print('Loaded {} connections from {}'.format(len(g.store), SNAPSHOT))
+    except (IOError, SnapshotError) as e:
+        print('Snapshot not used: {}'.format(e))
+        g = Graph()
+
+        print('Loading connections...')
+        for progress in load_parallel(g, feeds):
+            print('  => {}'.format(progress))
 
-    print('Loading connections...')
+        g.save(SNAPSHOT, sources)
 
-    print('  => WizzAir')
-    with open('wizzair.csv') as f:
-        process_routes(f, name='wizzair')
-    print('  => RyanAir')
-    with open('ryanair.csv') as f:
-        process_routes(f, name='ryanair')
-    print('  => EcoLines')
-    with open('ecolines.csv') as f:
-        process_routes(f, 'ecolines')
+    g.load_patterns(PATTERNS)
 
     print('Looking for origin and destination points...')
     city1 = g.closest(*TARTU)
@@ -244,6 +672,6 @@ if __name__ == '__main__':
     print(city2.city)
 
     print('Looking up the best route...')
-    path = g.path(city1, city2)
+    path = g.path(city1, city2, method='patterns')
 
     plot_route(path)
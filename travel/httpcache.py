@@ -0,0 +1,102 @@
+"""
+On-disk cache of the reference endpoints: city, destination and airport
+lists that change about once a month, while fares change every day.
+
+A cached response is used as is for REFERENCE_CACHE_TTL seconds. After
+that the request is sent with If-None-Match / If-Modified-Since when the
+cached response had an ETag or Last-Modified, and a 304 answer is served
+from the cache. Other URLs are not touched.
+"""
+import os
+import time
+
+from scrapy.exceptions import NotConfigured
+from scrapy.http import Headers
+from scrapy.responsetypes import responsetypes
+
+from travel.replay import load_recording, recording_path, request_key, save_recording
+
+DAY = 24 * 3600
+
+
+class ReferenceCacheMiddleware:
+    """
+    Downloader middleware caching GET responses of URLs starting with one
+    of REFERENCE_URLS in REFERENCE_CACHE_DIR. Hits, revalidations, misses,
+    the hit rate and the bytes not downloaded go to the referencecache/
+    stats.
+    """
+
+    def __init__(self, directory, ttl, prefixes, stats):
+        self.directory = directory
+        self.ttl = ttl
+        self.prefixes = tuple(prefixes)
+        self.stats = stats
+        self.lookups = 0
+        self.hits = 0
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        directory = settings.get('REFERENCE_CACHE_DIR')
+        prefixes = settings.getlist('REFERENCE_URLS')
+        if not directory or not prefixes:
+            raise NotConfigured
+        return cls(directory, settings.getfloat('REFERENCE_CACHE_TTL', 7 * DAY), prefixes, crawler.stats)
+
+    def _cached(self, request, url):
+        return request.method == 'GET' and url.startswith(self.prefixes)
+
+    def _count(self, name, hit=False):
+        self.lookups += 1
+        self.hits += hit
+        self.stats.inc_value('referencecache/' + name)
+        self.stats.set_value('referencecache/hit_rate', round(self.hits / self.lookups, 4))
+
+    def process_request(self, request, spider):
+        if not self._cached(request, request.url):
+            return None
+        key = request_key(request.method, request.url)
+        path = recording_path(self.directory, key)
+        try:
+            stored = os.path.getmtime(path)
+            recording = load_recording(self.directory, key)
+        except (IOError, ValueError):
+            return None
+        if time.time() - stored < self.ttl:
+            self._count('hit', hit=True)
+            self.stats.inc_value('referencecache/bytes_saved', len(recording['body']))
+            return self._response(request.url, recording)
+        headers = dict((name.lower(), value) for name, value in recording['headers'])
+        if 'etag' in headers:
+            request.headers['If-None-Match'] = headers['etag']
+        if 'last-modified' in headers:
+            request.headers['If-Modified-Since'] = headers['last-modified']
+        return None
+
+    def process_response(self, request, response, spider):
+        if 'cached' in response.flags or not self._cached(request, response.url):
+            return response
+        key = request_key(request.method, response.url)
+        if response.status == 304:
+            try:
+                recording = load_recording(self.directory, key)
+            except (IOError, ValueError):
+                return response
+            os.utime(recording_path(self.directory, key), None)
+            self._count('revalidated', hit=True)
+            self.stats.inc_value('referencecache/bytes_saved', len(recording['body']))
+            return self._response(response.url, recording)
+        if response.status == 200:
+            self._count('miss')
+            headers = [(name, value) for name, values in response.headers.items() for value in values]
+            save_recording(self.directory, key, response.url, request.method, response.status, headers, response.body)
+            self.stats.inc_value('referencecache/stored')
+        return response
+
+    def _response(self, url, recording):
+        headers = Headers()
+        for name, value in recording['headers']:
+            headers.appendlist(name, value)
+        cls = responsetypes.from_args(headers=headers, url=url, body=recording['body'])
+        return cls(url=url, status=recording['status'], headers=headers, body=recording['body'], flags=['cached'])
@@ -0,0 +1,512 @@
+import csv
+import itertools
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import dateutil.parser
+import numpy as np
+
+from travel.currency import default_rates, to_minor
+from travel.profiling import INSTRUMENTS
+from travel.store import to_minutes
+
+DEFAULT_FLIGHT_MINUTES = 3 * 60
+CHUNK_SIZE = 10000
+
+ISO_DATETIME = re.compile(r'^\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}(:\d{2})?(?P<zone>Z|[+-]\d{2}:?\d{2})?$')
+
+
+def date_parser(sample):
+    """
+    Picks how to parse a date column by looking at one value of it. ISO
+    dates are converted in bulk by NumPy, the time zone suffix is dropped
+    the same way `replace(tzinfo=None)` does. Anything else, or a column
+    that turns out not to be uniform, goes through dateutil one value at
+    a time.
+    :return: function from a list of strings to an int64 array of epoch minutes
+    """
+    match = ISO_DATETIME.match(sample)
+    if match:
+        zone = match.group('zone')
+        cut = len(sample) - len(zone) if zone else None
+
+        def parse_iso(values):
+            if cut is not None:
+                values = [value[:cut] for value in values]
+            try:
+                return np.array(values, dtype='datetime64[s]').astype(np.int64) // 60
+            except ValueError:
+                return parse_any(values)
+        return parse_iso
+    return parse_any
+
+
+def parse_any(values):
+    return np.array([
+        to_minutes(dateutil.parser.parse(value).replace(tzinfo=None))
+        for value in values
+    ], dtype=np.int64)
+
+
+class Feed:
+    """
+    Columns of one feed file: origin and destination coordinates and
+    titles, departure and arrival in epoch minutes and prices in EUR cents.
+    A reader that already knows the distinct points passes them as
+    `points`, see Feed.points.
+    """
+    COLUMNS = [
+        'origin_lat', 'origin_lon', 'origin_title', 'origin_state',
+        'destination_lat', 'destination_lon', 'destination_title', 'destination_state',
+        'departure', 'arrival', 'price',
+    ]
+
+    def __init__(self, points=None, **columns):
+        for column in self.COLUMNS:
+            setattr(self, column, columns[column])
+        self._points = points
+
+    def __len__(self):
+        return len(self.departure)
+
+    def points(self):
+        """
+        Distinct coordinates of the feed in the order row by row snapping
+        meets them, the origin of a row before its destination. Snapping
+        them in this order gives the same nodes as snapping every row.
+        :return: (lats, lons, titles, origin_points, destination_points) where
+        the last two map every row to a position in the first three
+        """
+        if self._points is None:
+            positions = {}
+            lats = []
+            lons = []
+            titles = []
+            origin_points = np.empty(len(self), dtype=np.int32)
+            destination_points = np.empty(len(self), dtype=np.int32)
+            rows = zip(
+                self.origin_lat.tolist(), self.origin_lon.tolist(), self.origin_title,
+                self.destination_lat.tolist(), self.destination_lon.tolist(), self.destination_title,
+            )
+            for i, (lat_1, lon_1, title_1, lat_2, lon_2, title_2) in enumerate(rows):
+                for lat, lon, title, points in ((lat_1, lon_1, title_1, origin_points),
+                                                (lat_2, lon_2, title_2, destination_points)):
+                    position = positions.get((lat, lon))
+                    if position is None:
+                        position = positions[(lat, lon)] = len(lats)
+                        lats.append(lat)
+                        lons.append(lon)
+                        titles.append(title)
+                    points[i] = position
+            self._points = (lats, lons, titles, origin_points, destination_points)
+        return self._points
+
+    def compact(self):
+        """
+        Keeps only the distinct points and the numeric columns, which is
+        all Graph.add_feed needs, so the feed is cheap to send between
+        processes
+        """
+        self.points()
+        for column in ['origin_lat', 'origin_lon', 'origin_title', 'origin_state',
+                       'destination_lat', 'destination_lon', 'destination_title', 'destination_state']:
+            setattr(self, column, None)
+        return self
+
+    def select(self, mask):
+        """
+        Returns a Feed with the rows where `mask` is True
+        """
+        positions = np.flatnonzero(mask).tolist()
+        columns = {}
+        for column in self.COLUMNS:
+            values = getattr(self, column)
+            if isinstance(values, np.ndarray):
+                columns[column] = values[mask]
+            else:
+                columns[column] = [values[i] for i in positions]
+        return Feed(**columns)
+
+
+class FeedFilter:
+    """
+    Row filter applied to parsed chunks before any connection is created
+    :param departure_from: earliest departure, datetime
+    :param departure_to: latest departure, datetime
+    :param countries: country codes, rows must start or end in one of them
+    :param max_price: max price in EUR
+    """
+
+    def __init__(self, departure_from=None, departure_to=None, countries=None, max_price=None):
+        self.departure_from = to_minutes(departure_from) if departure_from is not None else None
+        self.departure_to = to_minutes(departure_to) if departure_to is not None else None
+        self.countries = set(country.upper() for country in countries) if countries else None
+        self.max_price = max_price
+
+    def mask(self, feed):
+        mask = np.ones(len(feed), dtype=bool)
+        if self.departure_from is not None:
+            mask &= feed.departure >= self.departure_from
+        if self.departure_to is not None:
+            mask &= feed.departure <= self.departure_to
+        if self.max_price is not None:
+            mask &= feed.price <= to_minor(self.max_price)
+        if self.countries is not None:
+            mask &= np.array([
+                origin.upper() in self.countries or destination.upper() in self.countries
+                for origin, destination in zip(feed.origin_state, feed.destination_state)
+            ], dtype=bool)
+        return mask
+
+
+class ChunkProgress:
+    """
+    What happened to one chunk of a feed
+    """
+
+    def __init__(self, name, chunk, rows, filtered, duplicates, added, elapsed, total_rows, total_elapsed):
+        self.name = name
+        self.chunk = chunk
+        self.rows = rows
+        self.filtered = filtered
+        self.duplicates = duplicates
+        self.added = added
+        self.elapsed = elapsed
+        self.total_rows = total_rows
+        self.total_elapsed = total_elapsed
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.elapsed if self.elapsed else 0
+
+    def __str__(self):
+        return '{} chunk {}: {} rows, {} filtered, {} duplicates, {} added, {:,.0f} rows/s ({} rows so far)'.format(
+            self.name, self.chunk, self.rows, self.filtered, self.duplicates, self.added,
+            self.rows_per_second, self.total_rows,
+        )
+
+
+class FeedDelta:
+    """
+    What applying a new version of a feed changed
+    """
+
+    def __init__(self, name, rows, filtered, added, removed, updated, unchanged, elapsed):
+        self.name = name
+        self.rows = rows
+        self.filtered = filtered
+        self.added = added
+        self.removed = removed
+        self.updated = updated
+        self.unchanged = unchanged
+        self.elapsed = elapsed
+
+    def __str__(self):
+        return '{}: {} rows, {} filtered, {} added, {} removed, {} updated, {} unchanged in {:.0f} ms'.format(
+            self.name, self.rows, self.filtered, self.added, self.removed, self.updated, self.unchanged,
+            self.elapsed * 1000,
+        )
+
+
+class FareSet:
+    """
+    Fares already loaded from a feed, to skip duplicates across its chunks.
+    A fare is (origin, destination, departure, arrival, price) packed into
+    32 bytes, kept in sorted runs that are merged when a run is no more
+    than twice the size of the one after it, so memory stays a small
+    multiple of the fares and lookups a few binary searches.
+    """
+    RECORD = np.dtype((np.void, 32))
+
+    def __init__(self):
+        self.runs = []
+
+    def __len__(self):
+        return sum(len(run) for run in self.runs)
+
+    def _records(self, origins, destinations, departures, arrivals, prices):
+        columns = np.empty((len(origins), 4), dtype=np.int64)
+        columns[:, 0] = (np.asarray(origins, dtype=np.int64) << 32) | np.asarray(destinations, dtype=np.int64)
+        columns[:, 1] = departures
+        columns[:, 2] = arrivals
+        columns[:, 3] = prices
+        return columns.view(self.RECORD).ravel()
+
+    def new(self, origins, destinations, departures, arrivals, prices):
+        """
+        Adds fares to the set
+        :return: bool mask of the fares that were not in it, the first of
+        duplicates within the call counts as new
+        """
+        records = self._records(origins, destinations, departures, arrivals, prices)
+        keep = np.zeros(len(records), dtype=bool)
+        if not len(records):
+            return keep
+        unique, first = np.unique(records, return_index=True)
+        fresh = np.ones(len(unique), dtype=bool)
+        for run in self.runs:
+            positions = np.searchsorted(run, unique)
+            found = positions < len(run)
+            found[found] = run[positions[found]] == unique[found]
+            fresh &= ~found
+        keep[first[fresh]] = True
+        if fresh.any():
+            self.runs.append(unique[fresh])
+            while len(self.runs) > 1 and len(self.runs[-2]) <= 2 * len(self.runs[-1]):
+                last = self.runs.pop()
+                self.runs[-1] = np.sort(np.concatenate([self.runs[-1], last]))
+        return keep
+
+
+def read_feed(f):
+    """
+    Parses a whole feed CSV as written by the spiders into a Feed. The
+    date format is detected once per file instead of once per row.
+    """
+    feeds = list(iter_feed(f, chunk_size=None))
+    return feeds[0] if feeds else empty_feed()
+
+
+def iter_feed(f, chunk_size=CHUNK_SIZE):
+    """
+    Parses a feed CSV lazily, yielding a Feed for every `chunk_size` rows,
+    so only one chunk of text rows is held at a time. Date formats are
+    detected on the first chunk and reused for the rest of the file.
+    :param f: file object
+    :param chunk_size: rows per chunk, the whole file if None
+    """
+    reader = csv.reader(f)
+    header = next(reader, None)
+    if header is None:
+        return
+    parsers = {}
+    rows = (row for row in reader if row)
+    while True:
+        with INSTRUMENTS.timer('load/parse'):
+            chunk = list(itertools.islice(rows, chunk_size))
+            if not chunk:
+                return
+            columns = {name: [row[i] for row in chunk] for i, name in enumerate(header)}
+            feed = feed_from_columns(columns, parsers)
+        if INSTRUMENTS.enabled:
+            INSTRUMENTS.count('load/rows', len(chunk))
+        yield feed
+
+
+def _parse_dates(values, column, parsers):
+    parser = parsers.get(column)
+    if parser is None:
+        parser = parsers[column] = date_parser(values[0])
+    return parser(values)
+
+
+def feed_from_columns(columns, parsers=None):
+    """
+    Builds a Feed from text columns
+    :param columns: dict of CSV column name to list of strings
+    :param parsers: dict of date parsers by column, filled on first use
+    """
+    parsers = parsers if parsers is not None else {}
+    departures = columns['departureDate']
+    departure = _parse_dates(departures, 'departureDate', parsers)
+    arrivals = columns.get('arrivalDate')
+    if arrivals is not None and all(arrivals):
+        arrival = _parse_dates(arrivals, 'arrivalDate', parsers)
+    else:
+        arrival = departure + DEFAULT_FLIGHT_MINUTES
+        if arrivals is not None:
+            present = [i for i, value in enumerate(arrivals) if value]
+            if present:
+                arrival[present] = _parse_dates([arrivals[i] for i in present], 'arrivalDate', parsers)
+    price = default_rates().to_minor(
+        np.array(columns['price'], dtype=np.float64),
+        np.array(columns['currencyCode']),
+        departure,
+    )
+    return Feed(
+        origin_lat=np.array(columns['origin_lat'], dtype=np.float64),
+        origin_lon=np.array(columns['origin_lon'], dtype=np.float64),
+        origin_title=columns['origin_title'],
+        origin_state=columns.get('origin_state') or [''] * len(departures),
+        destination_lat=np.array(columns['destination_lat'], dtype=np.float64),
+        destination_lon=np.array(columns['destination_lon'], dtype=np.float64),
+        destination_title=columns['destination_title'],
+        destination_state=columns.get('destination_state') or [''] * len(departures),
+        departure=departure,
+        arrival=arrival,
+        price=price,
+    )
+
+
+def _decode(line):
+    """
+    Decodes a line read in binary mode the way text mode would have,
+    including the newline translation
+    """
+    return line.decode('utf-8').replace('\r\n', '\n')
+
+
+def split_feed(path, chunk_size=CHUNK_SIZE):
+    """
+    Finds where every chunk of `chunk_size` rows starts in a feed CSV, so
+    the chunks can be parsed independently. Rows are found by the csv
+    module, quoted line breaks inside titles are handled.
+    :return: (header, [(byte offset, rows), ...])
+    """
+    chunks = []
+    with open(path, 'rb') as f:
+        position = [0]
+
+        def lines():
+            for line in f:
+                position[0] += len(line)
+                yield _decode(line)
+
+        reader = csv.reader(lines())
+        header = next(reader, None)
+        start = position[0]
+        rows = 0
+        for row in reader:
+            if not row:
+                continue
+            rows += 1
+            if rows == chunk_size:
+                chunks.append((start, rows))
+                start = position[0]
+                rows = 0
+        if rows:
+            chunks.append((start, rows))
+    return header, chunks
+
+
+def parse_chunk(path, header, start, rows, feed_filter=None):
+    """
+    Parses `rows` rows starting at byte offset `start` of a feed CSV into
+    a compact Feed. Runs in worker processes.
+    """
+    with open(path, 'rb') as f:
+        f.seek(start)
+        reader = csv.reader(_decode(line) for line in f)
+        chunk = list(itertools.islice((row for row in reader if row), rows))
+    feed = feed_from_columns({name: [row[i] for row in chunk] for i, name in enumerate(header)})
+    if feed_filter is not None:
+        feed = feed.select(feed_filter.mask(feed))
+    return feed.compact()
+
+
+def _parse_task(task):
+    parse, arguments = task
+    return parse(*arguments)
+
+
+def load_parallel(graph, feeds, workers=None, chunk_size=CHUNK_SIZE, feed_filter=None):
+    """
+    Parses feeds, and chunks of large feeds, in a process pool and merges
+    them into `graph` in file and chunk order. Snapping only happens in
+    this process and in that order, so the graph does not depend on the
+    number of workers.
+    :param graph: Graph to add connections to
+    :param feeds: list of (path, carrier name), feed CSVs or .fares files,
+    whose row groups are the chunks
+    :param workers: worker processes, os.cpu_count() if None
+    :param chunk_size: rows per task
+    :param feed_filter: optional FeedFilter, applied in the workers
+    :return: generator of ChunkProgress, one per chunk
+    """
+    from travel import fares
+
+    tasks = []
+    names = []
+    for path, name in feeds:
+        if path.endswith(fares.EXTENSION):
+            for group, rows in enumerate(fares.row_groups(path)):
+                tasks.append((fares.parse_row_group, (path, group, feed_filter)))
+                names.append((path, name, rows))
+            continue
+        header, chunks = split_feed(path, chunk_size)
+        for start, rows in chunks:
+            tasks.append((parse_chunk, (path, header, start, rows, feed_filter)))
+            names.append((path, name, rows))
+
+    seen = {}
+    total_rows = 0
+    total_elapsed = 0
+    started = time.perf_counter()
+    with ProcessPoolExecutor(workers) as pool:
+        parsed = pool.map(_parse_task, tasks)
+        for chunk, (path, name, rows) in enumerate(names):
+            with INSTRUMENTS.timer('load/parse_wait'):
+                feed = next(parsed)
+            if INSTRUMENTS.enabled:
+                INSTRUMENTS.count('load/rows', rows)
+            added = graph.add_feed(feed, name, seen.setdefault(path, FareSet()))
+            elapsed = time.perf_counter() - started
+            total_rows += rows
+            total_elapsed += elapsed
+            yield ChunkProgress(
+                name, chunk, rows, rows - len(feed), len(feed) - added, added,
+                elapsed, total_rows, total_elapsed,
+            )
+            started = time.perf_counter()
+
+
+def load_routes(graph, f, name, chunk_size=CHUNK_SIZE, feed_filter=None):
+    """
+    Streams a feed CSV into `graph` one chunk at a time. Rows are filtered
+    before any node or connection is created and fares already loaded by
+    this call are skipped. The graph can be queried between chunks.
+    :param graph: Graph to add connections to
+    :param f: file object
+    :param name: carrier name
+    :param chunk_size: rows parsed at a time, bounds the memory used for parsing
+    :param feed_filter: optional FeedFilter
+    :return: generator of ChunkProgress, one per chunk
+    """
+    seen = FareSet()
+    total_rows = 0
+    total_elapsed = 0
+    started = time.perf_counter()
+    for chunk, feed in enumerate(iter_feed(f, chunk_size)):
+        rows = len(feed)
+        if feed_filter is not None:
+            feed = feed.select(feed_filter.mask(feed))
+        added = graph.add_feed(feed, name, seen)
+        elapsed = time.perf_counter() - started
+        total_rows += rows
+        total_elapsed += elapsed
+        yield ChunkProgress(
+            name, chunk, rows, rows - len(feed), len(feed) - added, added,
+            elapsed, total_rows, total_elapsed,
+        )
+        started = time.perf_counter()
+
+
+def update_routes(graph, f, name, feed_filter=None):
+    """
+    Replaces the connections of carrier `name` with those of a newer feed
+    CSV, changing only what differs, see Graph.apply_feed
+    :param graph: Graph to update
+    :param f: file object
+    :param name: carrier name
+    :param feed_filter: optional FeedFilter
+    :return: FeedDelta
+    """
+    started = time.perf_counter()
+    feed = read_feed(f)
+    rows = len(feed)
+    if feed_filter is not None:
+        feed = feed.select(feed_filter.mask(feed))
+    added, removed, updated, unchanged = graph.apply_feed(feed, name)
+    return FeedDelta(
+        name, rows, rows - len(feed), added, removed, updated, unchanged, time.perf_counter() - started,
+    )
+
+
+def empty_feed():
+    return Feed(
+        origin_lat=np.empty(0), origin_lon=np.empty(0), origin_title=[], origin_state=[],
+        destination_lat=np.empty(0), destination_lon=np.empty(0), destination_title=[], destination_state=[],
+        departure=np.empty(0, dtype=np.int64), arrival=np.empty(0, dtype=np.int64),
+        price=np.empty(0, dtype=np.int64),
+    )
@@ -0,0 +1,174 @@
+import csv
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from travel.currency import from_minor
+from travel.search import SearchStats, cheapest_tree
+from travel.store import from_minutes
+
+UNREACHABLE = -1
+
+_graph = None
+_query = None
+
+
+class PriceMatrix:
+    """
+    Cheapest price, arrival and number of hops from every origin to every
+    destination, one row per origin. Origins and destinations are node
+    positions and prices are EUR cents, like the store's. Unreachable pairs
+    have a price and an arrival of UNREACHABLE and 0 hops.
+    """
+
+    def __init__(self, origins, destinations, prices, arrivals, hops):
+        self.origins = origins
+        self.destinations = destinations
+        self.prices = prices
+        self.arrivals = arrivals
+        self.hops = hops
+
+    @classmethod
+    def empty(cls, origins, destinations):
+        shape = (len(origins), len(destinations))
+        return cls(
+            np.asarray(origins, dtype=np.int32), np.asarray(destinations, dtype=np.int32),
+            np.full(shape, UNREACHABLE, dtype=np.int32), np.full(shape, UNREACHABLE, dtype=np.int64),
+            np.zeros(shape, dtype=np.uint8),
+        )
+
+    def get(self, origin, destination):
+        """
+        :param origin: origin node position
+        :param destination: destination node position
+        :return: (price in EUR, arrival datetime, hops) or None if unreachable
+        """
+        i = int(np.flatnonzero(self.origins == origin)[0])
+        j = int(np.flatnonzero(self.destinations == destination)[0])
+        if self.arrivals[i, j] == UNREACHABLE:
+            return None
+        return from_minor(self.prices[i, j]), from_minutes(self.arrivals[i, j]), int(self.hops[i, j])
+
+    @property
+    def reachable(self):
+        return int(np.count_nonzero(self.arrivals != UNREACHABLE))
+
+    def save(self, path):
+        """
+        Writes the matrix to a compressed .npz file
+        """
+        np.savez_compressed(
+            path, origins=self.origins, destinations=self.destinations,
+            prices=self.prices, arrivals=self.arrivals, hops=self.hops,
+        )
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data['origins'], data['destinations'], data['prices'], data['arrivals'], data['hops'])
+
+    def write_csv(self, f, graph):
+        """
+        Writes the reachable pairs as CSV rows of origin and destination
+        city, price in EUR, arrival and hops
+        """
+        writer = csv.writer(f)
+        writer.writerow(['origin', 'destination', 'price', 'arrival', 'hops'])
+        cities = graph.store.cities
+        for i, j in zip(*np.nonzero(self.arrivals != UNREACHABLE)):
+            writer.writerow([
+                cities[self.origins[i]], cities[self.destinations[j]], '{:.2f}'.format(from_minor(self.prices[i, j])),
+                from_minutes(self.arrivals[i, j]).isoformat(), self.hops[i, j],
+            ])
+
+    def __repr__(self):
+        return 'PriceMatrix({}x{}, {} reachable)'.format(len(self.origins), len(self.destinations), self.reachable)
+
+
+def _row(graph, origin, columns, max_price, max_hops, window):
+    """
+    Prices, arrivals and hops from `origin` to the destinations mapped by
+    `columns`, a node position to column lookup with -1 for other nodes
+    """
+    stats = SearchStats()
+    tree = cheapest_tree(graph, graph.nodes[origin], max_price, max_hops, window, stats)
+    size = int(np.count_nonzero(columns >= 0))
+    prices = np.full(size, UNREACHABLE, dtype=np.int32)
+    arrivals = np.full(size, UNREACHABLE, dtype=np.int64)
+    hops = np.zeros(size, dtype=np.uint8)
+    for node, label in tree.items():
+        column = columns[node]
+        if column >= 0:
+            prices[column] = label.price
+            arrivals[column] = label.arrival
+            hops[column] = label.hops
+    return prices, arrivals, hops, stats.expanded
+
+
+def _init_worker(cls, path, query):
+    global _graph, _query
+    _graph = cls.load(path)
+    _query = query
+
+
+def _worker_row(origin):
+    return _row(_graph, origin, *_query)
+
+
+def price_matrix(graph, origins, destinations, max_price=1000, max_hops=2, window=None, workers=None,
+                 snapshot=None, stats=None):
+    """
+    Runs one `cheapest_tree` search per origin and collects the results for
+    `destinations` into a PriceMatrix.
+
+    With more than one worker the origins are searched in a process pool.
+    Workers memory-map the same graph snapshot, so the graph is shared
+    read-only between them instead of being pickled into every process,
+    and receive the query once when they start, so tasks are just origins.
+    :param graph: Graph to search
+    :param origins: origin node positions
+    :param destinations: destination node positions
+    :param window: departure window and layover limits, Window() if None
+    :param workers: number of processes, os.cpu_count() if None
+    :param snapshot: snapshot of `graph` for the workers, a temporary one is written if None
+    :param stats: optional SearchStats, receives the total of labels expanded
+    :return: PriceMatrix
+    """
+    matrix = PriceMatrix.empty(origins, destinations)
+    if len(np.unique(matrix.destinations)) < len(matrix.destinations):
+        raise ValueError('Destinations must be distinct')
+    columns = np.full(graph.store.node_count, -1, dtype=np.int64)
+    columns[matrix.destinations] = np.arange(len(matrix.destinations))
+    query = (columns, max_price, max_hops, window)
+    tasks = matrix.origins.tolist()
+    workers = workers or os.cpu_count() or 1
+
+    if workers == 1 or len(tasks) < 2:
+        rows = (_row(graph, origin, *query) for origin in tasks)
+        _fill(matrix, rows, stats)
+        return matrix
+
+    path = snapshot
+    if path is None:
+        descriptor, path = tempfile.mkstemp(suffix='.snapshot')
+        os.close(descriptor)
+        graph.save(path)
+    try:
+        with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(type(graph), path, query)) as executor:
+            chunksize = max(1, len(tasks) // (4 * workers))
+            _fill(matrix, executor.map(_worker_row, tasks, chunksize=chunksize), stats)
+    finally:
+        if snapshot is None:
+            os.remove(path)
+    return matrix
+
+
+def _fill(matrix, rows, stats):
+    for i, (prices, arrivals, hops, expanded) in enumerate(rows):
+        matrix.prices[i] = prices
+        matrix.arrivals[i] = arrivals
+        matrix.hops[i] = hops
+        if stats is not None:
+            stats.expanded += expanded
@@ -0,0 +1,510 @@
+import json
+
+import numpy as np
+
+from travel.currency import from_minor, to_minor
+from travel.search import Window
+from travel.store import MINUTE, from_minutes
+
+NONE = -1
+UNAFFORDABLE = np.iinfo(np.int64).max
+# Origins TransferPatterns.build searches from at once, bounds its memory
+BATCH = 16
+# Origin multiplier of the (origin, departure) keys, above any departure
+SPAN = np.int64(1) << 32
+
+
+def in_window(store, window):
+    """
+    Live connections departing in `window`, sorted by origin and departure
+    :return: (positions, offsets) where the connections of node position `n`
+    are positions[offsets[n]:offsets[n + 1]]
+    """
+    _, order, departures = store.adjacency()
+    positions = order[(departures >= window.departure_from) & (departures <= window.departure_to)]
+    return positions, np.searchsorted(store.origin[positions], np.arange(store.node_count + 1))
+
+
+def _mix(values):
+    """
+    SplitMix64 finalizer, scatters uint64 values over all 64 bits
+    """
+    values = (values ^ (values >> np.uint64(30))) * np.uint64(0xbf58476d1ce4e5b9)
+    values = (values ^ (values >> np.uint64(27))) * np.uint64(0x94d049bb133111eb)
+    return values ^ (values >> np.uint64(31))
+
+
+def node_digests(store, window):
+    """
+    Hash of the connections leaving every node in `window`, changes with
+    any of their destinations, dates or fares but not with their order
+    :return: uint64 array, one digest per node position
+    """
+    positions, offsets = in_window(store, window)
+    hashes = np.zeros(len(positions), dtype=np.uint64)
+    for name in ('destination', 'departure', 'arrival', 'price'):
+        hashes = _mix(hashes ^ store.column(name)[positions].astype(np.uint64))
+    # Sums wrap around, a node's digest is the difference of two of them
+    sums = np.zeros(len(positions) + 1, dtype=np.uint64)
+    np.cumsum(hashes, out=sums[1:])
+    return sums[offsets[1:]] - sums[offsets[:-1]]
+
+
+def _upstream(store, window, nodes, hops):
+    """
+    Nodes that reach one of `nodes` with at most `hops` connections
+    departing in `window`
+    :param nodes: bool mask of node positions
+    :return: bool mask of node positions, `nodes` included
+    """
+    positions, _ = in_window(store, window)
+    origins, destinations = store.origin[positions], store.destination[positions]
+    reached = nodes.copy()
+    for _ in range(hops):
+        reached[origins[reached[destinations]]] = True
+    return reached
+
+
+def _ranges(begins, ends):
+    """
+    Concatenation of the ranges begins[i]:ends[i]
+    :return: (i of every element, element)
+    """
+    lengths = np.maximum(ends - begins, 0)
+    owners = np.repeat(np.arange(len(lengths)), lengths)
+    return owners, np.arange(lengths.sum()) + np.repeat(begins - (np.cumsum(lengths) - lengths), lengths)
+
+
+def _undominated(groups, arrivals, prices):
+    """
+    Labels no other label of their group arrives at no later and for no
+    more than, of equal labels the first one
+    :return: bool mask
+    """
+    # lexsort is stable, equal labels stay in order
+    order = np.lexsort((prices, groups * SPAN + arrivals))
+    groups = groups[order]
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = groups[1:] != groups[:-1]
+    # Every group is shifted below the previous one, so the running minimum
+    # never carries over into the next group
+    step = int(prices.max()) + 1 if len(prices) else 1
+    shifted = prices[order] - (np.cumsum(first) - 1) * step
+    cheapest = np.minimum.accumulate(shifted)
+    keep = np.empty(len(order), dtype=bool)
+    keep[order] = first
+    keep[order[1:]] |= shifted[1:] < cheapest[:-1]
+    return keep
+
+
+def _cheapest(groups, prices, size):
+    """
+    :param size: number of groups, groups are 0 to size - 1
+    :return: (groups, position of a cheapest label of each group)
+    """
+    cheapest = np.full(size, UNAFFORDABLE)
+    np.minimum.at(cheapest, groups, prices)
+    found = np.flatnonzero(cheapest != UNAFFORDABLE)
+    best = np.empty(size, dtype=np.int64)
+    hits = np.flatnonzero(prices == cheapest[groups])
+    best[groups[hits]] = hits
+    return found, best[found]
+
+
+class TransferPatterns:
+    """
+    City sequences of the cheapest routes of at most `max_hops`
+    connections departing in one window, per origin and destination: the
+    cheapest route with at most h connections for every h that makes it
+    cheaper. Queries look at these few sequences only: for each one the
+    cheapest chain of connections that keeps the window and layovers is
+    found with live prices, leg by leg, without exploring the graph.
+
+    Which routes are cheapest depends on fares and dates, so the patterns
+    keep the `node_digests` of the connections they were built from. After
+    connections change, `refresh` searches again only from the origins
+    that reach a changed node in fewer than `max_hops` connections, the
+    only ones whose cheapest routes can differ. Until then the patterns are
+    not `current` and Graph.path searches the graph, as it does for
+    queries outside their window or with a maximum layover, see `covers`.
+    """
+
+    def __init__(self, sequences, max_hops, digests, window_key):
+        """
+        :param sequences: int32 array of node sequences, one per row, padded
+        with NONE and sorted by origin and destination
+        :param digests: node_digests of the connections they were built from
+        :param window_key: Window.key of the window they were built for
+        """
+        self.sequences = sequences
+        self.max_hops = max_hops
+        self.digests = digests
+        self.window_key = tuple(window_key)
+        self.hops = (sequences != NONE).sum(axis=1) - 1
+        last = sequences[np.arange(len(sequences)), self.hops]
+        self._pairs = (sequences[:, 0].astype(np.int64), last.astype(np.int64))
+        self._legs = None
+
+    @classmethod
+    def build(cls, store, max_hops=2, window=None):
+        """
+        Searches from every origin over the connections departing in
+        `window`, BATCH origins at a time and one round of connections per
+        hop. A label is dropped when an earlier label at its node arrived no
+        later for no more, so the cheapest routes are still found, and the
+        last round only prices the cheapest fare to every neighbour. Routes
+        never return to their origin, like the routes of `cheapest_path`.
+        :param window: Window without a maximum layover, Window() if None
+        """
+        window = window if window is not None else Window()
+        if window.max_layover is not None:
+            raise ValueError('Transfer patterns are built without a maximum layover')
+        sequences = _search(store, max_hops, window, np.arange(store.node_count))
+        return cls(_sorted(sequences), max_hops, node_digests(store, window), window.key)
+
+    def changed(self, digests):
+        """
+        :param digests: node_digests of the current connections
+        :return: bool mask of the nodes whose connections changed
+        """
+        built = np.zeros(len(digests), dtype=np.uint64)
+        built[:len(self.digests)] = self.digests[:len(digests)]
+        return digests != built
+
+    def current(self, store):
+        """
+        True if no connection in the window changed since they were built
+        """
+        return not self.changed(node_digests(store, self.window)).any()
+
+    def refresh(self, store):
+        """
+        Patterns for the current connections. Only the origins that reach a
+        node whose connections changed with fewer than `max_hops`
+        connections are searched again, the others keep their sequences.
+        :return: (TransferPatterns, number of origins searched again)
+        """
+        window = self.window
+        digests = node_digests(store, window)
+        changed = self.changed(digests)
+        if not changed.any():
+            return self, 0
+        origins = np.flatnonzero(_upstream(store, window, changed, self.max_hops - 1))
+        kept = self.sequences[~np.isin(self.sequences[:, 0], origins)]
+        sequences = np.concatenate([kept, _search(store, self.max_hops, window, origins)])
+        return TransferPatterns(_sorted(sequences), self.max_hops, digests, self.window_key), len(origins)
+
+    @property
+    def window(self):
+        departure_from, departure_to, min_layover, max_layover = self.window_key
+        return Window(from_minutes(departure_from), from_minutes(departure_to), min_layover * MINUTE,
+                      max_layover * MINUTE if max_layover is not None else None)
+
+    def covers(self, window, max_hops):
+        """
+        True if the patterns give the cheapest route of a query
+        """
+        return window.key == self.window_key and max_hops <= self.max_hops
+
+    def save(self, path):
+        header = json.dumps({'max_hops': self.max_hops, 'window': self.window_key})
+        with open(path, 'wb') as f:
+            np.savez(f, sequences=self.sequences, digests=self.digests, header=np.array(header))
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            header = json.loads(str(data['header']))
+            return cls(data['sequences'], header['max_hops'], data['digests'], header['window'])
+
+    @classmethod
+    def load_or_build(cls, store, path, max_hops=2, window=None):
+        """
+        Loads the patterns at `path`, refreshing them if connections changed
+        since they were saved. They are built from scratch if the file is
+        missing or was built for fewer hops, another window or a larger
+        graph. Changed patterns are saved back to `path`.
+        """
+        window = window if window is not None else Window()
+        try:
+            patterns = cls.load(path)
+        except (IOError, ValueError, KeyError):
+            patterns = None
+        if patterns is not None and patterns.covers(window, max_hops) and len(patterns.digests) <= store.node_count:
+            patterns, searched = patterns.refresh(store)
+            if searched:
+                patterns.save(path)
+            return patterns
+        patterns = cls.build(store, max_hops, window)
+        patterns.save(path)
+        return patterns
+
+    def candidates(self, origin, destination, max_hops):
+        """
+        Sequences from node position `origin` to `destination` with at most
+        `max_hops` connections
+        """
+        origins, destinations = self._pairs
+        begin = np.searchsorted(origins, origin, side='left')
+        end = np.searchsorted(origins, origin, side='right')
+        first = begin + np.searchsorted(destinations[begin:end], destination, side='left')
+        last = begin + np.searchsorted(destinations[begin:end], destination, side='right')
+        rows = np.arange(first, last)
+        rows = rows[self.hops[rows] <= max_hops]
+        return [sequence[:hops + 1] for sequence, hops in zip(self.sequences[rows].tolist(),
+                                                               self.hops[rows].tolist())]
+
+    def legs(self, store):
+        """
+        Live connections grouped by node pair and sorted by departure, CSR
+        style like the store's adjacency, rebuilt when the store changes
+        :return: (pair keys, offsets, order)
+        """
+        if self._legs is None or self._legs[0] != store.version:
+            live = store.live()
+            keys = store.origin[live].astype(np.int64) * store.node_count + store.destination[live]
+            by_pair = np.lexsort((store.departure[live], keys))
+            order = live[by_pair]
+            keys = keys[by_pair]
+            pairs, offsets = np.unique(keys, return_index=True)
+            offsets = np.append(offsets, len(keys))
+            self._legs = (store.version, (pairs, offsets, order, store.node_count))
+        return self._legs[1]
+
+    def between(self, store, origin, destination, earliest, latest):
+        """
+        Positions of the connections from `origin` to `destination`
+        departing between `earliest` and `latest`, sorted by departure
+        """
+        pairs, offsets, order, count = self.legs(store)
+        key = origin * count + destination
+        i = np.searchsorted(pairs, key)
+        if i == len(pairs) or pairs[i] != key:
+            return order[:0]
+        connections = order[offsets[i]:offsets[i + 1]]
+        first, last = store.departure[connections].searchsorted((earliest, latest + 1))
+        return connections[first:last]
+
+    def chain(self, store, sequence, max_price, window):
+        """
+        Cheapest chain of connections along `sequence` keeping the window
+        and the layovers
+        :param max_price: max total price in EUR cents
+        :return: (price in EUR cents, connection positions) or None
+        """
+        connections = self.between(store, sequence[0], sequence[1], window.departure_from, window.departure_to)
+        prices = store.price[connections].astype(np.int64)
+        keep = prices <= max_price
+        connections, prices = connections[keep], prices[keep]
+        legs = [connections]
+        parents = []
+        for origin, destination in zip(sequence[1:], sequence[2:]):
+            if not len(connections):
+                return None
+            arrivals = store.arrival[connections]
+            following = self.between(store, origin, destination, window.departure_from, window.departure_to)
+            departures = store.departure[following]
+            if window.max_layover is None:
+                by_arrival = np.argsort(arrivals, kind='stable')
+                cheapest = np.minimum.accumulate(prices[by_arrival])
+                best = by_arrival[np.maximum.accumulate(
+                    np.where(prices[by_arrival] == cheapest, np.arange(len(by_arrival)), 0)
+                )]
+                feasible = np.searchsorted(arrivals[by_arrival], departures - window.min_layover, side='left')
+                reachable = feasible > 0
+                parent = best[feasible[reachable] - 1]
+            else:
+                gap = departures[np.newaxis, :] - arrivals[:, np.newaxis]
+                fits = (gap > window.min_layover) & (gap <= window.max_layover)
+                costs = np.where(fits, prices[:, np.newaxis], UNAFFORDABLE)
+                parent = costs.argmin(axis=0)
+                reachable = costs[parent, np.arange(len(following))] != UNAFFORDABLE
+                parent = parent[reachable]
+            following = following[reachable]
+            following_prices = prices[parent] + store.price[following].astype(np.int64)
+            keep = following_prices <= max_price
+            connections, prices = following[keep], following_prices[keep]
+            legs.append(connections)
+            parents.append(parent[keep])
+        if not len(connections):
+            return None
+        i = int(np.argmin(prices))
+        price = int(prices[i])
+        path = []
+        for leg in reversed(range(len(legs))):
+            path.append(int(legs[leg][i]))
+            if leg:
+                i = int(parents[leg - 1][i])
+        path.reverse()
+        return price, path
+
+    def path(self, graph, origin, destination, max_price=1000, max_hops=2, window=None):
+        """
+        Cheapest route over the precomputed sequences of the pair
+        :param graph: Graph the patterns were built for
+        :param origin: start Node
+        :param destination: target Node
+        :param max_price: max total price in EUR
+        :param max_hops: max number of connections
+        :param window: departure window and layover limits, Window() if None
+        :return: route dict with `path`, `price` and `hops` or None
+        """
+        window = window if window is not None else Window()
+        if not self.covers(window, max_hops):
+            raise ValueError('Patterns were built for another window or fewer hops')
+        store = graph.store
+        max_price = to_minor(max_price)
+        best = None
+        for sequence in self.candidates(origin.id, destination.id, max_hops):
+            chain = self.chain(store, sequence, max_price, window)
+            if chain is not None and (best is None or chain[0] < best[0]):
+                best = chain
+        if best is None:
+            return None
+        price, path = best
+        return {
+            'path': [graph.connection(i) for i in path],
+            'price': from_minor(price),
+            'hops': len(path),
+            'duration': int(store.arrival[path[-1]] - store.departure[path[0]]) * MINUTE,
+        }
+
+
+def _search(store, max_hops, window, origins):
+    """
+    Sequences of the cheapest routes from the sorted node positions
+    `origins`, see TransferPatterns.build
+    """
+    positions, offsets = in_window(store, window)
+    origin, destination, departure, arrival, price = (
+        store.column(name)[positions].astype(np.int64)
+        for name in ('origin', 'destination', 'departure', 'arrival', 'price')
+    )
+    connections = (origin * SPAN + departure, destination, arrival, price)
+    fares = _fares_by_pair(origin, destination, departure, price, store.node_count)
+    sequences = [np.empty((0, max_hops + 1), dtype=np.int32)]
+    for first in range(0, len(origins), BATCH):
+        sequences.append(_cheapest_sequences(
+            origins[first:first + BATCH], offsets, connections, fares, store.node_count, max_hops, window,
+        ))
+    return np.concatenate(sequences)
+
+
+def _sorted(sequences):
+    """
+    Sequences sorted by origin, destination and hops
+    """
+    hops = (sequences != NONE).sum(axis=1) - 1
+    last = sequences[np.arange(len(sequences)), hops]
+    return sequences[np.lexsort((hops, last, sequences[:, 0]))]
+
+
+def _fares_by_pair(origins, destinations, departures, prices, count):
+    """
+    Cheapest fare departing at or after each connection of its node pair,
+    for the last round of TransferPatterns.build, which only needs the
+    price to every neighbour and not the arrivals
+    :return: (pair * SPAN + departure sorted, the cheapest fare from there
+    on, pair destinations, pair ends, offsets of the pairs of every node)
+    """
+    order = np.lexsort((departures, destinations, origins))
+    pairs = origins[order] * count + destinations[order]
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = pairs[1:] != pairs[:-1]
+    pair = np.cumsum(first) - 1
+    starts = np.flatnonzero(first)
+    pairs = pairs[starts]
+    # From the last pair backwards every pair is shifted below the previous
+    # one, so the running minimum never carries over into the next pair
+    step = int(prices.max()) + 1 if len(prices) else 1
+    shift = (len(pairs) - 1 - pair[::-1]) * step
+    cheapest = (np.minimum.accumulate(prices[order][::-1] - shift) + shift)[::-1]
+    return (
+        pair * SPAN + departures[order], cheapest, pairs % count, np.append(starts[1:], len(order)),
+        np.searchsorted(pairs // count, np.arange(count + 1)),
+    )
+
+
+def _cheapest_sequences(origins, offsets, connections, fares, count, max_hops, window):
+    """
+    Rounds of TransferPatterns.build from the sorted node positions
+    `origins`
+    :param connections: (origin * SPAN + departure, destination, arrival,
+    price) of the connections in the window, sorted by the first
+    :param fares: _fares_by_pair of the same connections
+    :return: int32 array of padded sequences
+    """
+    _, destinations, arrivals, prices = connections
+    owners, positions = _ranges(offsets[origins], offsets[origins + 1])
+    label = {
+        'origin': origins[owners], 'node': destinations[positions], 'arrival': arrivals[positions],
+        'price': prices[positions], 'parent': np.full(len(positions), NONE),
+    }
+    rounds = []
+    settled = ([], [], [])
+    cheapest = np.full(len(origins) * count, UNAFFORDABLE)
+    chosen = []
+    for hop in range(1, max_hops + 1):
+        if hop > 1 and hop == max_hops:
+            label = _last_round(rounds[-1], fares, window)
+        elif hop > 1:
+            label = _next_round(rounds[-1], offsets, connections, window)
+        group = np.searchsorted(origins, label['origin']) * count + label['node']
+        if hop < max_hops:
+            # Labels of earlier rounds go first and win ties
+            keep = _undominated(*[np.concatenate(values + [new]) for values, new in zip(
+                settled, (group, label['arrival'], label['price']),
+            )])[sum(len(values) for values in settled[0]):]
+            label = {name: values[keep] for name, values in label.items()}
+            group = group[keep]
+            for values, new in zip(settled, (group, label['arrival'], label['price'])):
+                values.append(new)
+        rounds.append(label)
+        groups, best = _cheapest(group, label['price'], len(cheapest))
+        cheaper = label['price'][best] < cheapest[groups]
+        cheapest[groups[cheaper]] = label['price'][best[cheaper]]
+        chosen.append(best[cheaper])
+
+    sequences = [np.empty((0, max_hops + 1), dtype=np.int32)]
+    for hop, labels in enumerate(chosen, 1):
+        sequence = np.full((len(labels), max_hops + 1), NONE, dtype=np.int32)
+        for level in reversed(range(hop)):
+            sequence[:, level + 1] = rounds[level]['node'][labels]
+            if level:
+                labels = rounds[level]['parent'][labels]
+        sequence[:, 0] = rounds[0]['origin'][labels]
+        sequences.append(sequence)
+    return np.concatenate(sequences)
+
+
+def _next_round(previous, offsets, connections, window):
+    """
+    Every connection that can follow a label of `previous`
+    """
+    keys, destinations, arrivals, prices = connections
+    begins = np.searchsorted(keys, previous['node'] * SPAN + previous['arrival'] + window.min_layover + 1)
+    parent, positions = _ranges(begins, offsets[previous['node'] + 1])
+    origin = previous['origin'][parent]
+    leaves = destinations[positions] != origin
+    parent, positions, origin = parent[leaves], positions[leaves], origin[leaves]
+    return {
+        'origin': origin, 'node': destinations[positions], 'arrival': arrivals[positions],
+        'price': previous['price'][parent] + prices[positions], 'parent': parent,
+    }
+
+
+def _last_round(previous, fares, window):
+    """
+    The cheapest fare to every neighbour of every label of `previous`,
+    labels without an arrival
+    """
+    keys, cheapest, neighbours, ends, offsets = fares
+    parent, pair = _ranges(offsets[previous['node']], offsets[previous['node'] + 1])
+    origin = previous['origin'][parent]
+    leaves = neighbours[pair] != origin
+    parent, pair, origin = parent[leaves], pair[leaves], origin[leaves]
+    first = np.searchsorted(keys, pair * SPAN + previous['arrival'][parent] + window.min_layover + 1)
+    reachable = first < ends[pair]
+    parent, pair, origin, first = parent[reachable], pair[reachable], origin[reachable], first[reachable]
+    return {'origin': origin, 'node': neighbours[pair], 'price': previous['price'][parent] + cheapest[first],
+            'parent': parent}
@@ -0,0 +1,253 @@
+"""
+Counters and timers on the hot paths of loading and searching, and
+profilers wrapping a whole run.
+
+INSTRUMENTS is disabled by default and every hook then costs an attribute
+check, or a call returning a shared no-op context manager. Enabled, it
+counts and times:
+
+    load/rows, load/parse       CSV rows parsed in this process
+    load/parse_wait             waiting for chunks parsed by load_parallel workers
+    snap/cache_hits, snap/cache_misses, snap/nearest
+                                Graph.closest calls answered by the coordinate
+                                cache and by a spatial index search
+    snap/nodes, snap/feed       nodes created, snapping whole feeds
+    edges/added, edges/add      connections added to the store
+    search/<method>             searches by method, with the labels they
+                                expanded and pruned, and route cache hits
+    search/patterns_stale, search/patterns_uncovered
+                                pattern queries that searched the graph, as
+                                the patterns were stale or built for another
+                                window or fewer hops
+    patterns/refreshed          origins whose transfer patterns were searched
+                                again after connections changed
+
+Parsing in worker processes is not counted, their instruments stay there.
+
+    python -m travel.benchmark --stats stats.json search
+    python -m travel.benchmark --profile cprofile --profile-output search.prof search
+    python -m travel.benchmark --profile sample --profile-output search.folded search
+"""
+import cProfile
+import json
+import pstats
+import signal
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+
+NO_TIMER = nullcontext()
+PROFILERS = ('cprofile', 'sample')
+SAMPLE_INTERVAL = 0.005
+
+
+class Timer:
+    __slots__ = ('instruments', 'name', 'started')
+
+    def __init__(self, instruments, name):
+        self.instruments = instruments
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.instruments.add_time(self.name, time.perf_counter() - self.started)
+
+
+class SearchTimer(Timer):
+    """
+    Times one search and adds the labels it expanded and pruned, the
+    difference of its SearchStats, so a SearchStats reused across searches
+    is not counted twice
+    """
+    __slots__ = ('stats', 'expanded', 'pruned')
+
+    def __init__(self, instruments, method, stats):
+        super().__init__(instruments, 'search/' + method)
+        self.stats = stats
+
+    def __enter__(self):
+        self.expanded = self.stats.expanded
+        self.pruned = self.stats.pruned
+        return super().__enter__()
+
+    def __exit__(self, *exc_info):
+        super().__exit__(*exc_info)
+        self.instruments.count(self.name + '/expanded', self.stats.expanded - self.expanded)
+        self.instruments.count(self.name + '/pruned', self.stats.pruned - self.pruned)
+
+
+class Instruments:
+    """
+    Named counters and timers, safe to use from the server's threads. Hooks
+    check `enabled` before counting, timers are no-ops while disabled.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.counts = {}
+        self.seconds = {}
+        self.calls = {}
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def reset(self):
+        with self.lock:
+            self.counts = {}
+            self.seconds = {}
+            self.calls = {}
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.counts[name] = self.counts.get(name, 0) + value
+
+    def add_time(self, name, seconds):
+        with self.lock:
+            self.seconds[name] = self.seconds.get(name, 0.0) + seconds
+            self.calls[name] = self.calls.get(name, 0) + 1
+
+    def timer(self, name):
+        """
+        Context manager adding the time spent in it to timer `name`
+        """
+        if not self.enabled:
+            return NO_TIMER
+        return Timer(self, name)
+
+    def search(self, method, stats):
+        """
+        Context manager timing one search of `method` and counting the
+        labels it expanded and pruned into `stats`
+        """
+        if not self.enabled:
+            return NO_TIMER
+        return SearchTimer(self, method, stats)
+
+    def as_dict(self):
+        with self.lock:
+            return {
+                'counters': dict(sorted(self.counts.items())),
+                'timers': {
+                    name: {
+                        'calls': self.calls[name],
+                        'ms': round(seconds * 1000, 3),
+                        'mean_ms': round(seconds * 1000 / self.calls[name], 4),
+                    }
+                    for name, seconds in sorted(self.seconds.items())
+                },
+            }
+
+    def to_json(self, indent=2):
+        return json.dumps(self.as_dict(), indent=indent)
+
+
+INSTRUMENTS = Instruments()
+
+
+class SamplingProfiler:
+    """
+    Statistical profiler of the main thread: every `interval` seconds of
+    CPU time a SIGPROF handler records the Python stack it interrupted.
+    Far cheaper than cProfile on call-heavy code like the label-setting
+    searches, at the price of missing short functions. Unix only.
+    """
+
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self.previous = None
+
+    def _sample(self, signum, frame):
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append('{}:{}'.format(code.co_filename, code.co_name))
+            frame = frame.f_back
+        self.stacks[tuple(reversed(stack))] += 1
+        self.samples += 1
+
+    def start(self):
+        self.previous = signal.signal(signal.SIGPROF, self._sample)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+
+    def stop(self):
+        signal.setitimer(signal.ITIMER_PROF, 0, 0)
+        signal.signal(signal.SIGPROF, self.previous)
+
+    def functions(self):
+        """
+        :return: (samples in the function itself, samples with the function
+        on the stack) by function
+        """
+        own = Counter()
+        total = Counter()
+        for stack, samples in self.stacks.items():
+            own[stack[-1]] += samples
+            for function in set(stack):
+                total[function] += samples
+        return own, total
+
+    def print_stats(self, limit=25, out=None):
+        out = out if out is not None else sys.stdout
+        own, total = self.functions()
+        samples = max(self.samples, 1)
+        out.write('{} samples every {:g} ms of CPU time\n'.format(self.samples, self.interval * 1000))
+        out.write('{:>7} {:>7}  function\n'.format('own', 'total'))
+        for function, count in own.most_common(limit):
+            out.write('{:7.1%} {:7.1%}  {}\n'.format(count / samples, total[function] / samples, function))
+
+    def dump_stats(self, path):
+        """
+        Writes the stacks in the folded format flame graph tools read, one
+        `frame;frame;frame count` line per distinct stack
+        """
+        with open(path, 'w') as f:
+            for stack, samples in self.stacks.most_common():
+                f.write('{} {}\n'.format(';'.join(stack), samples))
+
+
+@contextmanager
+def profiled(profiler, output=None, limit=25):
+    """
+    Runs the body under cProfile or the sampling profiler, then prints the
+    top `limit` functions and saves the profile to `output` if given: pstats
+    for cProfile, folded stacks for the sampling profiler. Only this
+    process is profiled, not its workers.
+    :param profiler: one of PROFILERS, or None to run without one
+    """
+    if profiler is None:
+        yield
+        return
+    if profiler == 'cprofile':
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            pstats.Stats(profile).sort_stats('cumulative').print_stats(limit)
+            if output:
+                profile.dump_stats(output)
+        return
+    if profiler == 'sample':
+        sampler = SamplingProfiler()
+        sampler.start()
+        try:
+            yield
+        finally:
+            sampler.stop()
+            sampler.print_stats(limit)
+            if output:
+                sampler.dump_stats(output)
+        return
+    raise ValueError('Unknown profiler {}'.format(profiler))
@@ -0,0 +1,203 @@
+"""
+Record and replay of crawl responses.
+
+RecordMiddleware saves every response a crawl receives, ReplayMiddleware
+sends every request to a local ReplayResource instead of the real site,
+which answers with the recorded response. Requests keep their original
+domain as download slot, so per-domain concurrency and AutoThrottle behave
+as they would against the real sites.
+
+    python -m travel.crawl --record recordings
+    python -m travel.crawl --replay recordings
+    python -m travel.replay recordings --port 8765 --latency 0.05
+"""
+import argparse
+import base64
+import hashlib
+import json
+import os
+from urllib.parse import urlsplit
+
+REPLAY_PATH = '/replay/'
+URL_HEADER = 'X-Replay-Url'
+SKIPPED_HEADERS = {b'content-length', b'transfer-encoding'}
+
+
+def request_key(method, url, body=b''):
+    """
+    Recording file name of a request: SHA-1 of method, URL and body
+    """
+    digest = hashlib.sha1(method.upper().encode('utf-8'))
+    digest.update(b' ')
+    digest.update(url.encode('utf-8'))
+    digest.update(b' ')
+    digest.update(body or b'')
+    return digest.hexdigest()
+
+
+def recording_path(directory, key):
+    return os.path.join(directory, key[:2], key + '.json')
+
+
+def save_recording(directory, key, url, method, status, headers, body):
+    """
+    :param headers: list of (name, value) byte strings
+    """
+    path = recording_path(directory, key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump({
+            'url': url,
+            'method': method,
+            'status': status,
+            'headers': [[name.decode('latin-1'), value.decode('latin-1')] for name, value in headers
+                        if name.lower() not in SKIPPED_HEADERS],
+            'body': base64.b64encode(body).decode('ascii'),
+        }, f)
+
+
+def load_recording(directory, key):
+    with open(recording_path(directory, key)) as f:
+        recording = json.load(f)
+    recording['body'] = base64.b64decode(recording['body'])
+    return recording
+
+
+class RecordMiddleware:
+    """
+    Downloader middleware saving responses to RECORD_DIR. Ordered next to
+    the download handler, so it keeps bodies still compressed and sees
+    redirects and retried errors, which replay then goes through again.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        from scrapy.exceptions import NotConfigured
+
+        directory = crawler.settings.get('RECORD_DIR')
+        if not directory:
+            raise NotConfigured
+        return cls(directory)
+
+    def process_response(self, request, response, spider):
+        url = request.meta.get('replay_url', request.url)
+        key = request_key(request.method, url, request.body)
+        headers = [(name, value) for name, values in response.headers.items() for value in values]
+        save_recording(self.directory, key, url, request.method, response.status, headers, response.body)
+        return response
+
+
+class ReplayMiddleware:
+    """
+    Downloader middleware sending requests to the replay server at
+    REPLAY_URL. The original URL is kept in the `replay_url` meta key and
+    restored on the response, the original domain stays the download slot.
+    Spiders copy response meta into new requests, so requests are told
+    apart by URL and not by that key.
+    """
+
+    def __init__(self, replay_url):
+        self.replay_url = replay_url.rstrip('/')
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        from scrapy.exceptions import NotConfigured
+
+        replay_url = crawler.settings.get('REPLAY_URL')
+        if not replay_url:
+            raise NotConfigured
+        return cls(replay_url)
+
+    def process_request(self, request, spider):
+        if request.url.startswith(self.replay_url + REPLAY_PATH):
+            return None
+        meta = dict(request.meta, replay_url=request.url, download_slot=urlsplit(request.url).hostname)
+        headers = request.headers.copy()
+        headers[URL_HEADER] = request.url
+        return request.replace(
+            url=self.replay_url + REPLAY_PATH + request_key(request.method, request.url, request.body),
+            headers=headers, meta=meta, dont_filter=True,
+        )
+
+    def process_response(self, request, response, spider):
+        if request.url.startswith(self.replay_url + REPLAY_PATH):
+            return response.replace(url=request.meta['replay_url'])
+        return response
+
+
+def replay_resource(directory, latency=0):
+    """
+    Twisted web resource answering /replay/<key> with the recording of
+    that key, after `latency` seconds, or 404 if there is none
+    """
+    from twisted.internet import reactor
+    from twisted.web.resource import Resource
+    from twisted.web.server import NOT_DONE_YET
+
+    class ReplayResource(Resource):
+        isLeaf = True
+
+        def __init__(self):
+            Resource.__init__(self)
+            self.served = 0
+            self.missing = 0
+
+        def render(self, request):
+            key = request.path.decode('latin-1')[len(REPLAY_PATH):]
+            try:
+                recording = load_recording(directory, key)
+            except (IOError, ValueError):
+                self.missing += 1
+                request.setResponseCode(404)
+                return b''
+            self.served += 1
+            if not latency:
+                return self._write(request, recording)
+            reactor.callLater(latency, self._finish, request, recording)
+            return NOT_DONE_YET
+
+        def _write(self, request, recording):
+            request.setResponseCode(recording['status'])
+            for name, value in recording['headers']:
+                request.responseHeaders.addRawHeader(name, value)
+            return recording['body']
+
+        def _finish(self, request, recording):
+            request.write(self._write(request, recording))
+            request.finish()
+
+    return ReplayResource()
+
+
+def listen(directory, port=0, latency=0):
+    """
+    Serves recordings from `directory` in the running reactor
+    :return: (listening port, resource)
+    """
+    from twisted.internet import reactor
+    from twisted.web.server import Site
+
+    resource = replay_resource(directory, latency)
+    listening = reactor.listenTCP(port, Site(resource), interface='127.0.0.1')
+    return listening, resource
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve recorded crawl responses')
+    parser.add_argument('directory')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0, help='seconds before every response')
+    args = parser.parse_args()
+
+    from twisted.internet import reactor
+
+    listening, _ = listen(args.directory, args.port, args.latency)
+    print('Replaying {} on http://127.0.0.1:{}'.format(args.directory, listening.getHost().port))
+    reactor.run()
+
+
+if __name__ == '__main__':
+    main()
@@ -5,7 +5,7 @@
 
 # encoding: utf-8
 import json
-from collections import OrderedDict
+from collections import OrderedDict, namedtuple
 
 import iso8601
 import scrapy
@@ -21,15 +21,28 @@ DAY_TO = 31
 AIRPORTS_URL = 'https://api.ryanair.com/aggregate/3/common?embedded=airports&market=en-gb'
 ONEWAY_FARE_URL = 'https://api.ryanair.com/farefinder/3/oneWayFares?&departureAirportIataCode={airport}&language=en&limit=16&market=en-gb&offset=0&outboundDepartureDateFrom={year}-{month}-{day_from}&outboundDepartureDateTo={year}-{month}-{day_to}&priceValueTo=300'
 
+FIELDS = [
+    'origin_airport', 'origin_title', 'origin_state', 'origin_lat', 'origin_lon',
+    'destination_airport', 'destination_title', 'destination_state',
+    'destination_lat', 'destination_lon',
+    'departureDate', 'arrivalDate',
+    'price', 'currencyCode',
+]
+
+# Per-request context: the origin fields of the items, the airports are
+# shared on the spider
+Origin = namedtuple('Origin', FIELDS[:5])
+
 
 class RyanairSpider(scrapy.Spider):
     name = 'ryanair'
     allowed_domains = ['api.ryanair.com']
     start_urls = [AIRPORTS_URL]
+    airports = {}
 
     def parse(self, response):
-        jsonresponse = json.loads(response.body_as_unicode())
-        airports = self._airport_mapping(jsonresponse)
+        jsonresponse = json.loads(response.text)
+        self.airports = self._airport_mapping(jsonresponse)
         for item in jsonresponse['airports']:
             if item['countryCode'].upper() not in STATES:
                 continue
@@ -43,12 +56,13 @@ class RyanairSpider(scrapy.Spider):
                 ),
                 callback=self.fares,
                 meta={
-                    'origin_airport': item['iataCode'],
-                    'origin_title': item['name'],
-                    'origin_state': item['countryCode'].upper(),
-                    'origin_lat': item['coordinates']['latitude'],
-                    'origin_lon': item['coordinates']['longitude'],
-                    'airports': airports,
+                    'origin': Origin(
+                        item['iataCode'],
+                        item['name'],
+                        item['countryCode'].upper(),
+                        item['coordinates']['latitude'],
+                        item['coordinates']['longitude'],
+                    ),
                 }
             )
 
@@ -59,32 +73,21 @@ class RyanairSpider(scrapy.Spider):
         }
 
     def fares(self, response):
-        jsonresponse = json.loads(response.body_as_unicode())
+        jsonresponse = json.loads(response.text)
+        origin = response.meta['origin']
         for item in jsonresponse['fares']:
             if 'outbound' not in item:
                 continue
             item = item['outbound']
-            meta = response.meta.copy()
-            airport = response.meta['airports'][item['arrivalAirport']['iataCode']]
-            meta.update({
-                'destination_airport': item['arrivalAirport']['iataCode'],
-                'destination_title': item['arrivalAirport']['name'],
-                'destination_state': airport['countryCode'].upper(),
-                'destination_lat': airport['coordinates']['latitude'],
-                'destination_lon': airport['coordinates']['longitude'],
-                'price': item['price']['value'],
-                'currencyCode': item['price']['currencyCode'],
-                'departureDate': iso8601.parse_date(item['departureDate']),
-                'arrivalDate': iso8601.parse_date(item['arrivalDate']),
-            })
-
-            yield OrderedDict([
-                (key, meta[key])
-                for key in [
-                    'origin_airport', 'origin_title', 'origin_state', 'origin_lat', 'origin_lon',
-                    'destination_airport', 'destination_title', 'destination_state',
-                    'destination_lat', 'destination_lon',
-                    'departureDate', 'arrivalDate',
-                    'price', 'currencyCode',
-                ]
-            ])
+            airport = self.airports[item['arrivalAirport']['iataCode']]
+            yield OrderedDict(zip(FIELDS, origin + (
+                item['arrivalAirport']['iataCode'],
+                item['arrivalAirport']['name'],
+                airport['countryCode'].upper(),
+                airport['coordinates']['latitude'],
+                airport['coordinates']['longitude'],
+                iso8601.parse_date(item['departureDate']),
+                iso8601.parse_date(item['arrivalDate']),
+                item['price']['value'],
+                item['price']['currencyCode'],
+            )))
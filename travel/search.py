@@ -0,0 +1,751 @@
+import heapq
+from collections import deque
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from travel.currency import from_minor, to_minor
+from travel.store import MINUTE, to_minutes
+from travel.utils import haversine
+
+DEPARTURE_FROM = datetime(2018, 1, 1)
+DEPARTURE_TO = datetime(2018, 2, 20)
+MIN_LAYOVER = timedelta(days=2)
+MIN_STAY = timedelta(days=2)
+MAX_STAY = timedelta(days=14)
+
+SLACK = 1 - 1e-9
+
+
+class Window:
+    """
+    Departure window and layover limits of a query, kept in store minutes.
+    A connection can follow an arrival if it departs more than
+    `min_layover` and at most `max_layover` after it.
+    """
+    __slots__ = ('departure_from', 'departure_to', 'min_layover', 'max_layover')
+
+    def __init__(self, departure_from=DEPARTURE_FROM, departure_to=DEPARTURE_TO,
+                 min_layover=MIN_LAYOVER, max_layover=None):
+        self.departure_from = to_minutes(departure_from)
+        self.departure_to = to_minutes(departure_to)
+        self.min_layover = min_layover // MINUTE
+        self.max_layover = max_layover // MINUTE if max_layover is not None else None
+
+    def bounds(self, arrival):
+        """
+        Inclusive range of departures that can follow `arrival`
+        """
+        if arrival is None:
+            return self.departure_from, self.departure_to
+        earliest = max(self.departure_from, arrival + self.min_layover + 1)
+        latest = self.departure_to
+        if self.max_layover is not None:
+            latest = min(latest, arrival + self.max_layover)
+        return earliest, latest
+
+    @property
+    def key(self):
+        return self.departure_from, self.departure_to, self.min_layover, self.max_layover
+
+
+class SearchStats:
+    """
+    Counters filled in by a search: labels expanded and pruned in total and
+    the number of labels kept at every node when the search finished.
+    """
+
+    def __init__(self):
+        self.expanded = 0
+        self.pruned = 0
+        self.label_counts = {}
+
+    @property
+    def labels(self):
+        return sum(self.label_counts.values())
+
+    def __repr__(self):
+        return 'SearchStats(expanded={}, pruned={}, labels={})'.format(
+            self.expanded, self.pruned, self.labels,
+        )
+
+
+class LowerBounds:
+    """
+    Per-km bounds over every live connection of a store: the lowest price
+    and the shortest travel time per great-circle km, the cheapest and the
+    shortest connection and the longest distance covered by one. Any
+    itinerary to a target `d` km away costs at least `price_per_km * d`,
+    since the legs of an itinerary can not be shorter than the great
+    circle, and needs at least `d / max_km` connections.
+    """
+
+    def __init__(self, store):
+        live = store.live()
+        lat = np.radians(store.lat[:store.node_count])
+        lon = np.radians(store.lon[:store.node_count])
+        origins, destinations = store.origin[live], store.destination[live]
+        km = haversine(lat[origins], lon[origins], lat[destinations], lon[destinations])
+        prices = store.price[live].astype(np.float64)
+        minutes = (store.arrival[live] - store.departure[live]).astype(np.float64)
+        far = km > 0
+        self.lat = lat
+        self.lon = lon
+        self.price_per_km = float((prices[far] / km[far]).min()) * SLACK if far.any() else 0.0
+        self.minutes_per_km = max(float((minutes[far] / km[far]).min()) * SLACK, 0.0) if far.any() else 0.0
+        self.min_price = float(prices.min()) if len(prices) else 0.0
+        self.min_minutes = max(float(minutes.min()), 0.0) if len(minutes) else 0.0
+        self.max_km = float(km.max()) if len(km) else 0.0
+
+    def distances(self, target):
+        """
+        Great-circle km from every node to node position `target`
+        """
+        return haversine(self.lat, self.lon, self.lat[target], self.lon[target])
+
+    def price_priority(self, target, max_hops):
+        """
+        A* priority of a label when searching for the cheapest itinerary
+        to `target`: its price plus a lower bound of the remaining price.
+        Labels too far from the target to reach it with the hops left get
+        None. The bound never decreases along a connection by more than the
+        connection costs, so labels are still settled in order.
+        """
+        distances = self.distances(target)
+        remaining = np.maximum(distances * self.price_per_km, self.min_price)
+        remaining[target] = 0
+        remaining = remaining.tolist()
+        reach = (distances / (self.max_km / SLACK) if self.max_km else np.where(distances > 0, np.inf, 0)).tolist()
+
+        def priority(label):
+            if reach[label.node] > max_hops - label.hops:
+                return None
+            return label.price + remaining[label.node]
+        return priority
+
+    def arrival_priority(self, target, max_hops, window):
+        """
+        A* priority of a label when searching for the earliest arrival at
+        `target`: its arrival plus a lower bound of the remaining travel
+        time, including the minimum layover before the next connection
+        """
+        distances = self.distances(target)
+        remaining = np.maximum(distances * self.minutes_per_km, self.min_minutes)
+        remaining[target] = 0
+        remaining = remaining.tolist()
+        reach = (distances / (self.max_km / SLACK) if self.max_km else np.where(distances > 0, np.inf, 0)).tolist()
+
+        def priority(label):
+            if reach[label.node] > max_hops - label.hops:
+                return None
+            if label.arrival is None:
+                return window.departure_from
+            if label.node == target:
+                return label.arrival
+            return label.arrival + window.min_layover + 1 + remaining[label.node]
+        return priority
+
+
+class Label:
+    """
+    Partial itinerary ending at node position `node`. Labels form a tree
+    through `parent`, so extending a label never copies the path. Prices
+    are EUR cents, times minutes since the epoch and `connection` is a
+    position in the store.
+    """
+    __slots__ = ('node', 'price', 'arrival', 'hops', 'connection', 'parent', 'start', 'dead')
+
+    def __init__(self, node, price, arrival, hops, connection=None, parent=None, departure=None):
+        self.node = node
+        self.price = price
+        self.arrival = arrival
+        self.hops = hops
+        self.connection = connection
+        self.parent = parent
+        if parent is None or parent.start is None:
+            self.start = departure
+        else:
+            self.start = parent.start
+        self.dead = False
+
+    def dominates(self, other, window):
+        """
+        True if this label is at least as good as `other` in every criterion:
+        cheaper, arrived earlier and used fewer hops. With a maximum layover
+        an earlier arrival misses late departures, so arrivals must match.
+        """
+        if self.price > other.price or self.hops > other.hops:
+            return False
+        if self.arrival is None:
+            return True
+        if other.arrival is None:
+            return False
+        if window.max_layover is not None:
+            return self.arrival == other.arrival
+        return self.arrival <= other.arrival
+
+    def dominates_pareto(self, other, window):
+        """
+        Multi-criteria dominance: on top of `dominates`, a label that left
+        the origin earlier can not dominate one that left later, since the
+        later one may end up with a shorter total travel time.
+        """
+        if not self.dominates(other, window):
+            return False
+        if self.start is None:
+            return True
+        if other.start is None:
+            return False
+        return self.start >= other.start
+
+    @property
+    def duration(self):
+        if self.start is None:
+            return None
+        return (self.arrival - self.start) * MINUTE
+
+    def connections(self):
+        path = []
+        label = self
+        while label.connection is not None:
+            path.append(label.connection)
+            label = label.parent
+        path.reverse()
+        return path
+
+    def as_route(self, graph):
+        return {
+            'path': [graph.connection(i) for i in self.connections()],
+            'price': from_minor(self.price),
+            'hops': self.hops,
+            'duration': self.duration,
+        }
+
+
+def _dominated(label, settled, window):
+    for other in settled:
+        if other.dominates(label, window):
+            return True
+    return False
+
+
+def _extensions(store, label, max_price, window):
+    """
+    Labels reachable from `label` with one more connection. The node's
+    departures are sorted, so the feasible ones are found by binary search
+    and only they are looked at.
+    """
+    begin, end = store.departures_between(label.node, *window.bounds(label.arrival))
+    if begin == end:
+        return
+    _, order, departures = store.adjacency()
+    connections = order[begin:end]
+    prices = label.price + store.price[connections].astype(np.int64)
+    affordable = prices <= max_price
+    connections = connections[affordable]
+    for c, price, destination, arrival, departure in zip(
+            connections.tolist(), prices[affordable].tolist(),
+            store.destination[connections].tolist(), store.arrival[connections].tolist(),
+            departures[begin:end][affordable].tolist()):
+        yield Label(destination, price, arrival, label.hops + 1, c, label, departure)
+
+
+def _settle(graph, origin, max_price, max_hops, window, stats, priority=None, reached=None):
+    """
+    Label-setting search from `origin` that yields labels in order of
+    priority, the price unless `priority` is given, as they are taken off
+    the queue, before they are checked for dominance. A label is discarded
+    when another label at the same node is cheaper, arrived earlier and used
+    no more hops, or when `priority` returns None for it.
+    :param reached: optional dict filled with every label created at every
+    node, discarded ones included
+    """
+    store = graph.store
+    max_price = to_minor(max_price)
+    counter = 0
+    label = Label(origin.id, 0, None, 0)
+    queue = [(priority(label) if priority is not None else 0, 0, counter, label)]
+    settled = {}
+    try:
+        while queue:
+            _, _, _, label = heapq.heappop(queue)
+            yield label
+            node_labels = settled.setdefault(label.node, [])
+            if _dominated(label, node_labels, window):
+                stats.pruned += 1
+                continue
+            node_labels.append(label)
+            stats.expanded += 1
+            if label.hops >= max_hops:
+                continue
+            for next_label in _extensions(store, label, max_price, window):
+                if reached is not None:
+                    reached.setdefault(next_label.node, []).append(next_label)
+                if _dominated(next_label, settled.get(next_label.node, ()), window):
+                    stats.pruned += 1
+                    continue
+                if priority is None:
+                    key = next_label.price
+                else:
+                    key = priority(next_label)
+                    if key is None:
+                        stats.pruned += 1
+                        continue
+                counter += 1
+                heapq.heappush(queue, (key, next_label.hops, counter, next_label))
+    finally:
+        stats.label_counts = {graph.nodes[node]: len(labels) for node, labels in settled.items()}
+
+
+def cheapest_path(graph, origin, destination, max_price=1000, max_hops=2, window=None, stats=None, bounds=None):
+    """
+    Time-dependent label-setting search for the cheapest itinerary.
+
+    Labels are expanded in order of price, so the first label that reaches
+    `destination` is the cheapest one. With `bounds` the search is A*: a
+    lower bound of the price left to the destination is added to the
+    order and labels that can not reach it in the hops left are dropped.
+    :param graph: Graph to search
+    :param origin: start Node
+    :param destination: target Node
+    :param max_price: max total price in EUR
+    :param max_hops: max number of connections
+    :param window: departure window and layover limits, Window() if None
+    :param stats: optional SearchStats to fill in
+    :param bounds: optional LowerBounds of the graph's store
+    :return: route dict with `path`, `price` and `hops` or None
+    """
+    window = window if window is not None else Window()
+    stats = stats if stats is not None else SearchStats()
+    priority = bounds.price_priority(destination.id, max_hops) if bounds is not None else None
+    return _first_arrival(graph, origin, destination, max_price, max_hops, window, stats, priority)
+
+
+def fastest_path(graph, origin, destination, max_price=1000, max_hops=2, window=None, stats=None, bounds=None):
+    """
+    Time-dependent label-setting search for the itinerary arriving first.
+    Labels are expanded in order of arrival, with `bounds` plus a lower
+    bound of the time left to the destination.
+    :param graph: Graph to search
+    :param origin: start Node
+    :param destination: target Node
+    :param max_price: max total price in EUR
+    :param max_hops: max number of connections
+    :param window: departure window and layover limits, Window() if None
+    :param stats: optional SearchStats to fill in
+    :param bounds: optional LowerBounds of the graph's store
+    :return: route dict with `path`, `price` and `hops` or None
+    """
+    window = window if window is not None else Window()
+    stats = stats if stats is not None else SearchStats()
+    if bounds is not None:
+        priority = bounds.arrival_priority(destination.id, max_hops, window)
+    else:
+        def priority(label):
+            return label.arrival if label.arrival is not None else window.departure_from
+    return _first_arrival(graph, origin, destination, max_price, max_hops, window, stats, priority)
+
+
+def _first_arrival(graph, origin, destination, max_price, max_hops, window, stats, priority):
+    destination = destination.id
+    labels = _settle(graph, origin, max_price, max_hops, window, stats, priority)
+    try:
+        for label in labels:
+            if label.hops and label.node == destination:
+                return label.as_route(graph)
+    finally:
+        labels.close()
+
+
+def cheapest_tree(graph, origin, max_price=1000, max_hops=2, window=None, stats=None):
+    """
+    One-to-all variant of `cheapest_path`: a single search that keeps going
+    after a destination is reached and records the first, i.e. cheapest,
+    label arriving at every node. The label for a node is the one
+    `cheapest_path` would return for it.
+    :param graph: Graph to search
+    :param origin: start Node
+    :param max_price: max total price in EUR
+    :param max_hops: max number of connections
+    :param window: departure window and layover limits, Window() if None
+    :param stats: optional SearchStats to fill in
+    :return: dict of node position to its cheapest Label
+    """
+    window = window if window is not None else Window()
+    stats = stats if stats is not None else SearchStats()
+    tree = {}
+    for label in _settle(graph, origin, max_price, max_hops, window, stats):
+        if label.hops and label.node not in tree:
+            tree[label.node] = label
+    return tree
+
+
+class Suffix:
+    """
+    Backward counterpart of Label: a partial itinerary from node position
+    `node` to the destination, starting with the connection that departs
+    at `departure`, None for the empty itinerary at the destination.
+    `parent` continues the itinerary towards the destination.
+    """
+    __slots__ = ('node', 'price', 'departure', 'hops', 'connection', 'parent')
+
+    def __init__(self, node, price, departure, hops, connection=None, parent=None):
+        self.node = node
+        self.price = price
+        self.departure = departure
+        self.hops = hops
+        self.connection = connection
+        self.parent = parent
+
+    def dominates(self, other, window):
+        """
+        Cheaper, departing later, so it fits behind more arrivals, and no
+        more hops. With a maximum layover departures must match.
+        """
+        if self.price > other.price or self.hops > other.hops:
+            return False
+        if self.departure is None:
+            return True
+        if other.departure is None:
+            return False
+        if window.max_layover is not None:
+            return self.departure == other.departure
+        return self.departure >= other.departure
+
+    def connections(self):
+        path = []
+        suffix = self
+        while suffix.connection is not None:
+            path.append(suffix.connection)
+            suffix = suffix.parent
+        return path
+
+    def as_route(self, graph):
+        path = self.connections()
+        store = graph.store
+        return {
+            'path': [graph.connection(i) for i in path],
+            'price': from_minor(self.price),
+            'hops': self.hops,
+            'duration': int(store.arrival[path[-1]] - store.departure[path[0]]) * MINUTE if path else None,
+        }
+
+
+def _predecessors(store, suffix, max_price, window):
+    """
+    Suffixes reachable from `suffix` with one more connection in front,
+    found by binary search over the arrivals at its node
+    """
+    earliest, latest = np.iinfo(np.int64).min, np.iinfo(np.int64).max - 1
+    if suffix.departure is not None:
+        if window.max_layover is not None:
+            earliest = suffix.departure - window.max_layover
+        latest = suffix.departure - window.min_layover - 1
+    begin, end = store.arrivals_between(suffix.node, earliest, latest)
+    if begin == end:
+        return
+    _, order, _ = store.reverse_adjacency()
+    connections = order[begin:end]
+    departures = store.departure[connections]
+    prices = suffix.price + store.price[connections].astype(np.int64)
+    feasible = (departures >= window.departure_from) & (departures <= window.departure_to) & (prices <= max_price)
+    connections = connections[feasible]
+    for c, price, origin, departure in zip(
+            connections.tolist(), prices[feasible].tolist(),
+            store.origin[connections].tolist(), departures[feasible].tolist()):
+        yield Suffix(origin, price, departure, suffix.hops + 1, c, suffix)
+
+
+def _settle_backward(graph, destination, max_price, max_hops, window, stats, reached):
+    """
+    All-to-one counterpart of `_settle`: a label-setting search by price
+    backward from `destination` over the reverse adjacency. Fills
+    `reached` with every suffix created at every node, discarded ones
+    included.
+    """
+    store = graph.store
+    counter = 0
+    queue = [(0, 0, counter, Suffix(destination.id, 0, None, 0))]
+    settled = {}
+    while queue:
+        _, _, _, suffix = heapq.heappop(queue)
+        node_suffixes = settled.setdefault(suffix.node, [])
+        if _dominated(suffix, node_suffixes, window):
+            stats.pruned += 1
+            continue
+        node_suffixes.append(suffix)
+        stats.expanded += 1
+        if suffix.hops >= max_hops:
+            continue
+        for next_suffix in _predecessors(store, suffix, max_price, window):
+            reached.setdefault(next_suffix.node, []).append(next_suffix)
+            if _dominated(next_suffix, settled.get(next_suffix.node, ()), window):
+                stats.pruned += 1
+                continue
+            counter += 1
+            heapq.heappush(queue, (next_suffix.price, next_suffix.hops, counter, next_suffix))
+    for node, node_suffixes in settled.items():
+        stats.label_counts[graph.nodes[node]] = stats.label_counts.get(graph.nodes[node], 0) + len(node_suffixes)
+
+
+def _joins(label, suffix, max_price, max_hops, window):
+    if not 0 < label.hops + suffix.hops <= max_hops or label.price + suffix.price > max_price:
+        return False
+    if label.arrival is None or suffix.departure is None:
+        return True
+    earliest, latest = window.bounds(label.arrival)
+    return earliest <= suffix.departure <= latest
+
+
+def bidirectional_path(graph, origin, destination, max_price=1000, max_hops=2, window=None, stats=None):
+    """
+    Cheapest itinerary by two label-setting searches by price, forward
+    from `origin` over departures and backward from `destination` over the
+    reverse adjacency, expanding whichever side has the cheaper label next.
+    Every new label is joined with the labels the other side has at its
+    node. The search stops once the two cheapest unexpanded labels together
+    cost at least the best itinerary joined so far.
+    :param graph: Graph to search
+    :param origin: start Node
+    :param destination: target Node
+    :param max_price: max total price in EUR
+    :param max_hops: max number of connections
+    :param window: departure window and layover limits, Window() if None
+    :param stats: optional SearchStats to fill in, counts both sides
+    :return: route dict with `path`, `price` and `hops` or None
+    """
+    window = window if window is not None else Window()
+    stats = stats if stats is not None else SearchStats()
+    store = graph.store
+    max_price = to_minor(max_price)
+    counter = 0
+    start = Label(origin.id, 0, None, 0)
+    end = Suffix(destination.id, 0, None, 0)
+    forward = [(0, 0, 0, start)]
+    backward = [(0, 0, 1, end)]
+    labels = {start.node: [start]}
+    suffixes = {end.node: [end]}
+    settled = {}
+    settled_suffixes = {}
+    best = [None, None]
+
+    def join(label, suffix):
+        if _joins(label, suffix, max_price, max_hops, window):
+            if best[0] is None or label.price + suffix.price < best[0].price + best[1].price:
+                best[0], best[1] = label, suffix
+
+    join(start, end)
+    while forward and backward:
+        if best[0] is not None and forward[0][0] + backward[0][0] >= best[0].price + best[1].price:
+            break
+        if forward[0][0] <= backward[0][0]:
+            _, _, _, label = heapq.heappop(forward)
+            node_labels = settled.setdefault(label.node, [])
+            if _dominated(label, node_labels, window):
+                stats.pruned += 1
+                continue
+            node_labels.append(label)
+            stats.expanded += 1
+            if label.hops >= max_hops or (label.hops and label.node == destination.id):
+                continue
+            for next_label in _extensions(store, label, max_price, window):
+                if _dominated(next_label, settled.get(next_label.node, ()), window):
+                    stats.pruned += 1
+                    continue
+                labels.setdefault(next_label.node, []).append(next_label)
+                for suffix in suffixes.get(next_label.node, ()):
+                    join(next_label, suffix)
+                counter += 2
+                heapq.heappush(forward, (next_label.price, next_label.hops, counter, next_label))
+        else:
+            _, _, _, suffix = heapq.heappop(backward)
+            node_suffixes = settled_suffixes.setdefault(suffix.node, [])
+            if _dominated(suffix, node_suffixes, window):
+                stats.pruned += 1
+                continue
+            node_suffixes.append(suffix)
+            stats.expanded += 1
+            if suffix.hops >= max_hops or (suffix.hops and suffix.node == origin.id):
+                continue
+            for next_suffix in _predecessors(store, suffix, max_price, window):
+                if _dominated(next_suffix, settled_suffixes.get(next_suffix.node, ()), window):
+                    stats.pruned += 1
+                    continue
+                suffixes.setdefault(next_suffix.node, []).append(next_suffix)
+                for label in labels.get(next_suffix.node, ()):
+                    join(label, next_suffix)
+                counter += 2
+                heapq.heappush(backward, (next_suffix.price, next_suffix.hops, counter, next_suffix))
+    stats.label_counts = {graph.nodes[node]: len(node_labels) for node, node_labels in settled.items()}
+    for node, node_suffixes in settled_suffixes.items():
+        stats.label_counts[graph.nodes[node]] = stats.label_counts.get(graph.nodes[node], 0) + len(node_suffixes)
+
+    label, suffix = best
+    if label is None:
+        return None
+    path = label.connections() + suffix.connections()
+    departure = graph.store.departure[path[0]]
+    arrival = graph.store.arrival[path[-1]]
+    return {
+        'path': [graph.connection(i) for i in path],
+        'price': from_minor(label.price + suffix.price),
+        'hops': label.hops + suffix.hops,
+        'duration': int(arrival - departure) * MINUTE,
+    }
+
+
+def _insert_pareto(bag, label, max_labels, window):
+    """
+    Adds `label` to the Pareto bag of its node, dropping the labels it
+    dominates. When the bag is full the most expensive label is evicted if
+    the new one is cheaper, otherwise the new label is rejected.
+    :return: True if the label was kept
+    """
+    for other in bag:
+        if other.dominates_pareto(label, window):
+            return False
+    for other in [other for other in bag if label.dominates_pareto(other, window)]:
+        other.dead = True
+        bag.remove(other)
+    if len(bag) >= max_labels:
+        worst = max(bag, key=lambda other: other.price)
+        if worst.price <= label.price:
+            return False
+        worst.dead = True
+        bag.remove(worst)
+    bag.append(label)
+    return True
+
+
+def pareto_paths(graph, origin, destination, max_price=1000, max_hops=2, max_labels=16, window=None, stats=None):
+    """
+    Multi-criteria label-correcting search for the Pareto front of price,
+    total travel time and number of hops.
+
+    Every node keeps a bag of at most `max_labels` non-dominated labels,
+    which bounds both memory and the size of the returned front.
+    :param graph: Graph to search
+    :param origin: start Node
+    :param destination: target Node
+    :param max_price: max total price in EUR
+    :param max_hops: max number of connections
+    :param max_labels: max number of labels kept per node
+    :param window: departure window and layover limits, Window() if None
+    :param stats: optional SearchStats to fill in
+    :return: list of route dicts sorted by price
+    """
+    window = window if window is not None else Window()
+    stats = stats if stats is not None else SearchStats()
+    store = graph.store
+    max_price = to_minor(max_price)
+    destination = destination.id
+    counter = 0
+    queue = [(0, counter, Label(origin.id, 0, None, 0))]
+    bags = {origin.id: [queue[0][2]]}
+    while queue:
+        _, _, label = heapq.heappop(queue)
+        if label.dead:
+            stats.pruned += 1
+            continue
+        if label.hops and label.node == destination:
+            continue
+        stats.expanded += 1
+        if label.hops >= max_hops:
+            continue
+        for next_label in _extensions(store, label, max_price, window):
+            if not _insert_pareto(bags.setdefault(next_label.node, []), next_label, max_labels, window):
+                stats.pruned += 1
+                continue
+            counter += 1
+            heapq.heappush(queue, (next_label.price, counter, next_label))
+    stats.label_counts = {graph.nodes[node]: len(bag) for node, bag in bags.items()}
+    front = []
+    arrived = [label for label in bags.get(destination, ()) if label.hops]
+    for label in sorted(arrived, key=lambda label: (label.price, label.duration, label.hops)):
+        if any(other.duration <= label.duration and other.hops <= label.hops for other in front):
+            continue
+        front.append(label)
+    return [label.as_route(graph) for label in front]
+
+
+def _cheapest_stay(labels, suffixes, min_stay, max_stay):
+    """
+    Cheapest pair of an outbound label arriving at a node and a return
+    suffix leaving it `min_stay` to `max_stay` minutes later, both
+    inclusive. Both sides are sorted by time and merged once, a deque
+    keeps the cheapest labels of the sliding stay window in front.
+    :return: (price, label, suffix) or None
+    """
+    labels = sorted(labels, key=lambda label: label.arrival)
+    best = None
+    window = deque()
+    i = 0
+    for suffix in sorted(suffixes, key=lambda suffix: suffix.departure):
+        while i < len(labels) and labels[i].arrival <= suffix.departure - min_stay:
+            while window and window[-1].price >= labels[i].price:
+                window.pop()
+            window.append(labels[i])
+            i += 1
+        while window and window[0].arrival < suffix.departure - max_stay:
+            window.popleft()
+        if window and (best is None or window[0].price + suffix.price < best[0]):
+            best = (window[0].price + suffix.price, window[0], suffix)
+    return best
+
+
+def round_trips(graph, origin, pairs=None, return_to=None, max_price=1000, max_hops=2, window=None,
+                return_window=None, min_stay=MIN_STAY, max_stay=MAX_STAY, stats=None):
+    """
+    Cheapest round trips, or open-jaw trips, from `origin` in one pass: a
+    one-to-all search forward from `origin` and an all-to-one search
+    backward to `return_to` find every way to arrive at and to leave every
+    node, which are then joined node by node, see `_cheapest_stay`. Every
+    label reaching a node is kept, not only the non-dominated ones, as a
+    maximum stay can rule out an earlier cheaper arrival.
+    :param graph: Graph to search
+    :param origin: start Node
+    :param pairs: list of (Node flown to, Node the return leaves from),
+    every node flown to and back from if None
+    :param return_to: Node the return ends at, `origin` if None
+    :param max_price: max total price of both directions in EUR
+    :param max_hops: max number of connections of each direction
+    :param window: departure window and layover limits of the outbound
+    connections, Window() if None
+    :param return_window: the same for the return connections, `window`
+    if None
+    :param min_stay: min time between arrival and return departure
+    :param max_stay: max time between arrival and return departure
+    :param stats: optional SearchStats to fill in, counts both searches
+    :return: list of trip dicts with `outbound` and `return` routes,
+    `price` and `stay`, the cheapest trip of every pair sorted by price
+    """
+    window = window if window is not None else Window()
+    return_window = return_window if return_window is not None else window
+    return_to = return_to if return_to is not None else origin
+    stats = stats if stats is not None else SearchStats()
+    min_stay //= MINUTE
+    max_stay //= MINUTE
+    arrivals = {}
+    for _ in _settle(graph, origin, max_price, max_hops, window, stats, reached=arrivals):
+        pass
+    departures = {}
+    _settle_backward(graph, return_to, to_minor(max_price), max_hops, return_window, stats, departures)
+
+    if pairs is None:
+        pairs = [(node, node) for node in arrivals if node in departures and node not in (origin.id, return_to.id)]
+    else:
+        pairs = [(n1.id, n2.id) for n1, n2 in pairs]
+    trips = []
+    for outbound, inbound in pairs:
+        best = _cheapest_stay(arrivals.get(outbound, ()), departures.get(inbound, ()), min_stay, max_stay)
+        if best is None or best[0] > to_minor(max_price):
+            continue
+        price, label, suffix = best
+        trips.append({
+            'outbound': label.as_route(graph),
+            'return': suffix.as_route(graph),
+            'price': from_minor(price),
+            'stay': (suffix.departure - label.arrival) * MINUTE,
+        })
+    trips.sort(key=lambda trip: trip['price'])
+    return trips
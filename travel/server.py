@@ -0,0 +1,314 @@
+import argparse
+import asyncio
+import collections
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from urllib.parse import parse_qsl, urlsplit
+
+import numpy as np
+
+from travel.graph import SNAPSHOT, Graph
+from travel.loader import load_parallel
+from travel.profiling import INSTRUMENTS
+from travel.snapshot import SnapshotError
+
+REASONS = {
+    200: 'OK', 400: 'Bad Request', 403: 'Forbidden', 404: 'Not Found', 405: 'Method Not Allowed',
+    500: 'Internal Server Error',
+}
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class Metrics:
+    """
+    Latencies of the last `size` queries and their timestamps, for
+    percentiles and queries per second over the last `period` seconds
+    """
+
+    def __init__(self, size=10000, period=60, clock=time.monotonic):
+        self.latencies = collections.deque(maxlen=size)
+        self.timestamps = collections.deque(maxlen=size)
+        self.period = period
+        self.clock = clock
+        self.started = clock()
+        self.queries = 0
+        self.errors = 0
+
+    def record(self, latency, error=False):
+        self.latencies.append(latency)
+        self.timestamps.append(self.clock())
+        self.queries += 1
+        if error:
+            self.errors += 1
+
+    def qps(self):
+        now = self.clock()
+        since = now - self.period
+        recent = sum(1 for timestamp in self.timestamps if timestamp >= since)
+        return recent / min(self.period, max(now - self.started, 1e-9))
+
+    def as_dict(self):
+        latencies = np.array(self.latencies, dtype=np.float64) * 1000
+        percentiles = {}
+        if len(latencies):
+            for percentile, value in zip((50, 90, 99), np.percentile(latencies, (50, 90, 99)).tolist()):
+                percentiles['p{}_ms'.format(percentile)] = round(value, 3)
+        return dict(percentiles, queries=self.queries, errors=self.errors, qps=round(self.qps(), 2),
+                    uptime=round(self.clock() - self.started, 1))
+
+
+def route_json(route):
+    if route is None:
+        return None
+    return {
+        'price': round(route['price'], 2),
+        'hops': route['hops'],
+        'duration_minutes': int(route['duration'].total_seconds() // 60) if route['duration'] is not None else None,
+        'path': [{
+            'from': c.n1.city,
+            'to': c.n2.city,
+            'carrier': c.name,
+            'departure': c.departure.isoformat(),
+            'arrival': c.arrival.isoformat(),
+            'price': round(c.price, 2),
+        } for c in route['path']],
+    }
+
+
+def city_nodes(graph):
+    """
+    Node of every city name, the first one of names used more than once
+    """
+    nodes = {}
+    for city, node in zip(graph.store.cities, graph.nodes):
+        nodes.setdefault(city, node)
+    return nodes
+
+
+class RouteServer:
+    """
+    Answers route queries over HTTP/JSON from a graph loaded once.
+
+    The event loop only parses requests. Searches and updates run in a
+    thread pool. An update changes a copy of the graph and then swaps it
+    in, so queries never wait for it: they keep searching the graph they
+    started with. Updates run one at a time.
+
+    GET  /route?from=&to=[&max_price=&max_hops=&departure_from=&departure_to=]
+         `from` and `to` are a city name or "lat,lon"
+    GET  /stats, with load and search instruments if they are enabled
+    POST /update {"carrier": name, "path": feed CSV relative to `feed_dir`}
+    """
+
+    def __init__(self, graph, workers=4, feed_dir=None):
+        """
+        :param graph: Graph to serve
+        :param workers: search and update threads
+        :param feed_dir: directory updates read feeds from, updates are refused if None
+        """
+        self.feed_dir = feed_dir
+        # The graph and its city names, replaced together by an update
+        self.current = (graph, city_nodes(graph))
+        self.update_lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(workers)
+        self.metrics = Metrics()
+        self.server = None
+
+    @property
+    def graph(self):
+        return self.current[0]
+
+    async def start(self, host='127.0.0.1', port=8080):
+        self.server = await asyncio.start_server(self.handle, host, port)
+        return self.server.sockets[0].getsockname()[:2]
+
+    async def close(self):
+        self.server.close()
+        await self.server.wait_closed()
+        self.executor.shutdown()
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if not line.strip():
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                body = b''
+                if 'content-length' in headers:
+                    body = await reader.readexactly(int(headers['content-length']))
+                method, target, version = request_line.decode('latin-1').split()
+                status, payload = await self.respond(method, target, body)
+                data = json.dumps(payload).encode('utf-8')
+                keep_alive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+                writer.write('{} {} {}\r\nContent-Type: application/json\r\nContent-Length: {}\r\n{}\r\n'.format(
+                    version, status, REASONS[status], len(data), '' if keep_alive else 'Connection: close\r\n',
+                ).encode('latin-1') + data)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def respond(self, method, target, body):
+        url = urlsplit(target)
+        query = dict(parse_qsl(url.query))
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+        try:
+            if url.path == '/route' and method == 'GET':
+                status, payload = 200, await loop.run_in_executor(self.executor, self.route, query)
+            elif url.path == '/stats' and method == 'GET':
+                status, payload = 200, self.stats()
+            elif url.path == '/update' and method == 'POST':
+                try:
+                    request = json.loads(body.decode('utf-8'))
+                except (ValueError, UnicodeDecodeError) as e:
+                    raise HTTPError(400, 'Bad update: {}'.format(e))
+                status, payload = 200, await loop.run_in_executor(self.executor, self.update, request)
+            elif url.path in ('/route', '/stats', '/update'):
+                raise HTTPError(405, 'Method not allowed')
+            else:
+                raise HTTPError(404, 'Not found')
+        except HTTPError as e:
+            status, payload = e.status, {'error': str(e)}
+        except Exception as e:
+            status, payload = 500, {'error': repr(e)}
+        if url.path == '/route':
+            self.metrics.record(time.perf_counter() - started, error=status != 200)
+        return status, payload
+
+    def find(self, graph, cities, value):
+        try:
+            lat, lon = (float(part) for part in value.split(','))
+        except ValueError:
+            if value in cities:
+                return cities[value]
+            raise HTTPError(404, 'Unknown city {}'.format(value))
+        node = graph.closest(lat, lon)
+        if node is None:
+            raise HTTPError(404, 'No city near {}'.format(value))
+        return node
+
+    def route(self, query):
+        try:
+            origin, destination = query['from'], query['to']
+            options = {}
+            if 'max_price' in query:
+                options['max_price'] = float(query['max_price'])
+            if 'max_hops' in query:
+                options['max_hops'] = int(query['max_hops'])
+            for option in ('departure_from', 'departure_to'):
+                if option in query:
+                    options[option] = datetime.strptime(query[option], '%Y-%m-%d')
+        except (KeyError, ValueError) as e:
+            raise HTTPError(400, 'Bad query: {}'.format(e))
+        graph, cities = self.current
+        return route_json(graph.path(self.find(graph, cities, origin), self.find(graph, cities, destination),
+                                     **options))
+
+    def feed_path(self, path):
+        """
+        Resolves a feed path relative to `feed_dir`, refusing paths that
+        lead outside of it
+        """
+        if self.feed_dir is None:
+            raise HTTPError(403, 'Updates are disabled, no feed directory is configured')
+        root = os.path.realpath(self.feed_dir)
+        full = os.path.realpath(os.path.join(root, path))
+        if os.path.commonpath([root, full]) != root:
+            raise HTTPError(403, 'Feed {} is outside of the feed directory'.format(path))
+        return full
+
+    def update(self, request):
+        try:
+            carrier, path = request['carrier'], request['path']
+            path = self.feed_path(path)
+        except (KeyError, TypeError, ValueError) as e:
+            raise HTTPError(400, 'Bad update: {}'.format(e))
+        with self.update_lock:
+            graph = self.graph.copy()
+            try:
+                with open(path) as f:
+                    delta = graph.update(f, carrier)
+            except IOError as e:
+                raise HTTPError(400, 'Cannot read feed {}: {}'.format(request['path'], e.strerror or e))
+            except (KeyError, ValueError) as e:
+                raise HTTPError(400, 'Bad feed {}: {!r}'.format(request['path'], e))
+            self.current = (graph, city_nodes(graph))
+        return {
+            'carrier': carrier, 'added': delta.added, 'removed': delta.removed,
+            'updated': delta.updated, 'unchanged': delta.unchanged,
+        }
+
+    def stats(self):
+        graph = self.graph
+        cache = graph.cache
+        stats = dict(
+            self.metrics.as_dict(),
+            nodes=graph.store.node_count,
+            connections=len(graph.store.live()),
+            cache={'size': len(cache), 'hits': cache.hits, 'misses': cache.misses, 'hit_rate': cache.hit_rate},
+        )
+        if INSTRUMENTS.enabled:
+            stats['instruments'] = INSTRUMENTS.as_dict()
+        return stats
+
+
+def load_graph(feeds, snapshot=SNAPSHOT):
+    sources = [path for path, _ in feeds]
+    try:
+        return Graph.load(snapshot, sources)
+    except (IOError, SnapshotError):
+        graph = Graph()
+        for _ in load_parallel(graph, feeds):
+            pass
+        graph.save(snapshot, sources)
+        return graph
+
+
+async def serve(graph, host, port, workers, feed_dir=None):
+    server = RouteServer(graph, workers, feed_dir)
+    host, port = await server.start(host, port)
+    print('Serving {} connections on http://{}:{}'.format(len(graph.store), host, port))
+    async with server.server:
+        await server.server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Route query server')
+    parser.add_argument('feeds', nargs='+', help='feed CSVs or .fares files as path:carrier')
+    parser.add_argument('--snapshot', default=SNAPSHOT)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--feed-dir', help='directory POST /update may read feeds from, updates are refused without it')
+    parser.add_argument('--instrument', action='store_true',
+                        help='count and time loading, snapping and searches, reported by /stats')
+    args = parser.parse_args()
+    if args.instrument:
+        INSTRUMENTS.enable()
+    feeds = [tuple(feed.rsplit(':', 1)) for feed in args.feeds]
+    graph = load_graph(feeds, args.snapshot)
+    asyncio.run(serve(graph, args.host, args.port, args.workers, args.feed_dir))
+
+
+if __name__ == '__main__':
+    main()
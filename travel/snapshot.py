@@ -0,0 +1,171 @@
+import hashlib
+import json
+import mmap
+import os
+import struct
+import tempfile
+
+import numpy as np
+
+from travel.store import CONNECTION_COLUMNS, NODE_COLUMNS
+
+MAGIC = b'TRAVELGR'
+VERSION = 3
+PREAMBLE = struct.Struct('<8sIQ')
+ALIGNMENT = 64
+
+ADJACENCY_COLUMNS = ['adjacency_offsets', 'adjacency_order', 'adjacency_departures']
+CACHE_COLUMNS = ['cache_lat', 'cache_lon', 'cache_node']
+REQUIRED_COLUMNS = [column for column, _ in NODE_COLUMNS + CONNECTION_COLUMNS] + ADJACENCY_COLUMNS + CACHE_COLUMNS
+
+
+class SnapshotError(ValueError):
+    pass
+
+
+def fingerprint(path):
+    """
+    Size and SHA-1 of a source file, used to tell whether a snapshot was
+    built from the current version of it
+    """
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return {
+        'path': os.path.basename(path),
+        'size': os.path.getsize(path),
+        'sha1': digest.hexdigest(),
+    }
+
+
+def _padding(offset):
+    return -offset % ALIGNMENT
+
+
+def save(graph, path, sources=()):
+    """
+    Writes the graph to `path`: a fixed preamble, a JSON header describing
+    the columns and the raw column buffers, each aligned to 64 bytes
+    :param graph: Graph to save
+    :param path: snapshot file
+    :param sources: source files the graph was built from
+    """
+    store = graph.store
+    cached = list(graph.coords_cache.items())
+    arrays = [(column, getattr(store, column)[:store.node_count]) for column, _ in NODE_COLUMNS]
+    arrays += [(column, store.column(column)) for column, _ in CONNECTION_COLUMNS]
+    arrays += list(zip(ADJACENCY_COLUMNS, store.adjacency()))
+    arrays += [
+        ('cache_lat', np.array([lat for (lat, _), _ in cached], dtype=np.float64)),
+        ('cache_lon', np.array([lon for (_, lon), _ in cached], dtype=np.float64)),
+        ('cache_node', np.array([node.id for _, node in cached], dtype=np.int32)),
+    ]
+
+    columns = []
+    offset = 0
+    for column, array in arrays:
+        columns.append({
+            'name': column,
+            'dtype': array.dtype.str,
+            'offset': offset,
+            'length': len(array),
+        })
+        offset += array.nbytes + _padding(array.nbytes)
+    header = json.dumps({
+        'version': VERSION,
+        'sources': [fingerprint(source) for source in sources],
+        'cities': store.cities,
+        'carriers': store.carriers,
+        'columns': columns,
+    }).encode('utf-8')
+    header += b' ' * _padding(PREAMBLE.size + len(header))
+
+    # written next to the target and renamed over it, so a crash mid-write
+    # never leaves a truncated snapshot behind
+    fd, temporary = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(PREAMBLE.pack(MAGIC, VERSION, len(header)))
+            f.write(header)
+            for column, array in arrays:
+                f.write(np.ascontiguousarray(array).tobytes())
+                f.write(b'\0' * _padding(array.nbytes))
+        os.replace(temporary, path)
+    except BaseException:
+        os.unlink(temporary)
+        raise
+
+
+def read_header(f):
+    try:
+        magic, version, length = PREAMBLE.unpack(f.read(PREAMBLE.size))
+    except struct.error:
+        raise SnapshotError('Not a graph snapshot')
+    if magic != MAGIC:
+        raise SnapshotError('Not a graph snapshot')
+    if version != VERSION:
+        raise SnapshotError('Snapshot version {} is not supported'.format(version))
+    data = f.read(length)
+    if len(data) != length:
+        raise SnapshotError('Snapshot is truncated')
+    try:
+        header = json.loads(data.decode('utf-8'))
+    except ValueError as e:
+        raise SnapshotError('Corrupt snapshot header: {}'.format(e))
+    if not isinstance(header, dict):
+        raise SnapshotError('Corrupt snapshot header')
+    return header, PREAMBLE.size + length
+
+
+def validate(header, sources):
+    """
+    Raises SnapshotError if `sources` differ from the files the snapshot
+    was built from
+    """
+    expected = header.get('sources')
+    current = [fingerprint(source) for source in sources]
+    if current != expected:
+        raise SnapshotError('Snapshot is stale, source files changed')
+
+
+def load(graph, path, sources=None):
+    """
+    Memory-maps the snapshot at `path` into the empty `graph`. Columns are
+    NumPy views over the mapping, so nothing is copied and processes that
+    load the same file share its pages. The mapping is copy-on-write:
+    adding connections afterwards reallocates the columns privately.
+    :param graph: empty Graph to fill
+    :param path: snapshot file
+    :param sources: source files to validate the snapshot against, skipped if None
+    """
+    with open(path, 'rb') as f:
+        header, data_offset = read_header(f)
+        if sources is not None:
+            validate(header, sources)
+        size = os.fstat(f.fileno()).st_size
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+
+    try:
+        arrays = {}
+        for column in header['columns']:
+            dtype = np.dtype(column['dtype'])
+            offset = data_offset + column['offset']
+            if offset + column['length'] * dtype.itemsize > size:
+                raise SnapshotError('Snapshot is truncated, column {} is incomplete'.format(column['name']))
+            arrays[column['name']] = np.frombuffer(buffer, dtype=dtype, count=column['length'], offset=offset)
+        cities, carriers = header['cities'], header['carriers']
+    except SnapshotError:
+        raise
+    except (KeyError, TypeError, ValueError) as e:
+        raise SnapshotError('Corrupt snapshot: {!r}'.format(e))
+    missing = [column for column in REQUIRED_COLUMNS if column not in arrays]
+    if missing:
+        raise SnapshotError('Snapshot lacks columns {}'.format(', '.join(missing)))
+
+    graph.store.restore(arrays, cities, carriers, tuple(arrays[column] for column in ADJACENCY_COLUMNS))
+    graph.rebuild_nodes()
+    for lat, lon, node in zip(arrays['cache_lat'].tolist(), arrays['cache_lon'].tolist(),
+                              arrays['cache_node'].tolist()):
+        graph.coords_cache[(lat, lon)] = graph.nodes[node]
+    return graph
@@ -0,0 +1,112 @@
+import math
+
+import numpy as np
+
+from travel.utils import EARTH_RADIUS, haversine
+
+KM_PER_DEGREE = math.pi * EARTH_RADIUS / 180
+
+
+class GridIndex:
+    """
+    Nearest-neighbour index over lat/lon points bucketed into square cells
+    of `cell_km` along the meridian. A lookup only visits the cells that can
+    hold a point within the search radius, so it costs the same no matter
+    how many points are indexed elsewhere.
+
+    Coordinates are converted to radians once on insert and kept in
+    contiguous arrays, cells hold positions into them, and the candidates
+    of a lookup are measured in one vectorised haversine call.
+    """
+
+    def __init__(self, cell_km=50, capacity=1024):
+        self.cell = cell_km / KM_PER_DEGREE
+        self.columns = int(math.ceil(360 / self.cell))
+        self.cells = {}
+        self.radians = np.empty((capacity, 2), dtype=np.float64)
+        self.items = []
+        self.size = 0
+
+    def _key(self, lat, lon):
+        return int(math.floor((lat + 90) / self.cell)), int(math.floor((lon + 180) / self.cell)) % self.columns
+
+    def insert(self, lat, lon, item):
+        if self.size == len(self.radians):
+            grown = np.empty((2 * len(self.radians), 2), dtype=np.float64)
+            grown[:self.size] = self.radians[:self.size]
+            self.radians = grown
+        self.radians[self.size] = (math.radians(lat), math.radians(lon))
+        self.cells.setdefault(self._key(lat, lon), []).append(self.size)
+        self.items.append(item)
+        self.size += 1
+
+    def _columns(self, lat, lat_from, lat_to, maximum):
+        """
+        Column offsets around the query that may hold points within
+        `maximum` km. Haversine gives a bound on the longitude difference
+        from the cosine of the query latitude and of the most polar latitude
+        of the band.
+        """
+        widest = max(abs(lat_from), abs(lat_to))
+        cosines = math.cos(math.radians(lat)) * math.cos(math.radians(min(widest, 90)))
+        if cosines <= 0:
+            return None
+        ratio = math.sin(maximum / (2 * EARTH_RADIUS)) / math.sqrt(cosines)
+        if ratio >= 1:
+            return None
+        dlon = math.degrees(2 * math.asin(ratio))
+        span = int(math.ceil(dlon / self.cell))
+        if 2 * span + 1 >= self.columns:
+            return None
+        return span
+
+    def candidates(self, lat, lon, maximum):
+        dlat = maximum / KM_PER_DEGREE
+        row, column = self._key(lat, lon)
+        rows = int(math.ceil(dlat / self.cell))
+        span = self._columns(lat, lat - dlat, lat + dlat, maximum)
+        if span is None:
+            columns = range(self.columns)
+        else:
+            columns = [(column + offset) % self.columns for offset in range(-span, span + 1)]
+        positions = []
+        for r in range(row - rows, row + rows + 1):
+            for c in columns:
+                positions.extend(self.cells.get((r, c), ()))
+        return np.array(positions, dtype=np.intp)
+
+    def distances(self, lat, lon, positions):
+        points = self.radians[positions]
+        return haversine(points[:, 0], points[:, 1], math.radians(lat), math.radians(lon))
+
+    def nearest(self, lat, lon, maximum):
+        """
+        Returns the item closest to lat, lon
+        :param lat: latitude
+        :param lon: longitude
+        :param maximum: max distance in kilometers
+        :return: (distance, item) or None if nothing is within maximum
+        """
+        positions = self.candidates(lat, lon, maximum)
+        if not len(positions):
+            return None
+        distances = self.distances(lat, lon, positions)
+        best = int(np.argmin(distances))
+        if distances[best] <= maximum:
+            return float(distances[best]), self.items[positions[best]]
+
+    def within(self, lat, lon, maximum):
+        """
+        Returns items within `maximum` km of lat, lon
+        :return: list of (distance, item) sorted by distance
+        """
+        positions = self.candidates(lat, lon, maximum)
+        if not len(positions):
+            return []
+        distances = self.distances(lat, lon, positions)
+        close = np.flatnonzero(distances <= maximum)
+        close = close[np.argsort(distances[close], kind='stable')]
+        return [(float(distances[i]), self.items[positions[i]]) for i in close]
+
+    def __len__(self):
+        return self.size
@@ -0,0 +1,320 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+
+EPOCH = datetime(1970, 1, 1)
+MINUTE = timedelta(minutes=1)
+
+NODE_COLUMNS = [
+    ('lat', np.float64),
+    ('lon', np.float64),
+]
+
+CONNECTION_COLUMNS = [
+    ('origin', np.int32),
+    ('destination', np.int32),
+    ('departure', np.int64),
+    ('arrival', np.int64),
+    ('price', np.int32),
+    ('carrier', np.uint8),
+    ('removed', np.bool_),
+]
+
+
+def to_minutes(dt):
+    """
+    Naive datetime to minutes since the epoch
+    """
+    return (dt - EPOCH) // MINUTE
+
+
+def from_minutes(minutes):
+    return EPOCH + timedelta(minutes=int(minutes))
+
+
+def _grow(array, size):
+    capacity = len(array)
+    if size <= capacity:
+        return array
+    while capacity < size:
+        capacity = max(2 * capacity, 1024)
+    grown = np.empty(capacity, dtype=array.dtype)
+    grown[:len(array)] = array
+    return grown
+
+
+class ConnectionStore:
+    """
+    Columnar storage for nodes and connections. Every column is a NumPy
+    array that grows by doubling, connections refer to nodes by their
+    position and carriers by a one byte code.
+
+    Outgoing connections are indexed CSR style: `offsets[n]:offsets[n + 1]`
+    is the range of `order` holding the connections of node `n` sorted by
+    departure. The index is rebuilt lazily after connections are added or
+    removed.
+
+    Removing a connection only sets its `removed` flag, so positions of the
+    other connections, and Connection views of them, stay valid. Removed
+    connections are left out of the index until `compact` drops them.
+    """
+
+    def __init__(self):
+        for column, dtype in NODE_COLUMNS + CONNECTION_COLUMNS:
+            setattr(self, column, np.empty(0, dtype=dtype))
+        self.cities = []
+        self.carriers = []
+        self.carrier_codes = {}
+        self.size = 0
+        self.version = 0
+        self._adjacency = None
+        self._reverse = None
+
+    def _changed(self):
+        """
+        Drops the indexes after connections changed
+        """
+        self._adjacency = None
+        self._reverse = None
+        self.version += 1
+
+    @property
+    def node_count(self):
+        return len(self.cities)
+
+    def add_node(self, lat, lon, city):
+        node = self.node_count
+        for column, _ in NODE_COLUMNS:
+            setattr(self, column, _grow(getattr(self, column), node + 1))
+        self.lat[node] = lat
+        self.lon[node] = lon
+        self.cities.append(city)
+        self._changed()
+        return node
+
+    def carrier_code(self, name):
+        code = self.carrier_codes.get(name)
+        if code is None:
+            code = len(self.carriers)
+            if code > np.iinfo(np.uint8).max:
+                raise ValueError('Too many carriers: {}'.format(name))
+            self.carriers.append(name)
+            self.carrier_codes[name] = code
+        return code
+
+    def add(self, origin, destination, departure, arrival, price, carrier):
+        """
+        Appends a connection
+        :param origin: origin node position
+        :param destination: destination node position
+        :param departure: departure in minutes since the epoch
+        :param arrival: arrival in minutes since the epoch
+        :param price: price in EUR cents
+        :param carrier: carrier name
+        :return: position of the new connection
+        """
+        index = self.size
+        for column, _ in CONNECTION_COLUMNS:
+            setattr(self, column, _grow(getattr(self, column), index + 1))
+        self.origin[index] = origin
+        self.destination[index] = destination
+        self.departure[index] = departure
+        self.arrival[index] = arrival
+        self.price[index] = price
+        self.carrier[index] = self.carrier_code(carrier)
+        self.removed[index] = False
+        self.size += 1
+        self._changed()
+        return index
+
+    def extend(self, origins, destinations, departures, arrivals, prices, carrier):
+        """
+        Appends connections of one carrier given as columns
+        :return: positions of the new connections
+        """
+        begin = self.size
+        end = begin + len(origins)
+        for column, _ in CONNECTION_COLUMNS:
+            setattr(self, column, _grow(getattr(self, column), end))
+        self.origin[begin:end] = origins
+        self.destination[begin:end] = destinations
+        self.departure[begin:end] = departures
+        self.arrival[begin:end] = arrivals
+        self.price[begin:end] = prices
+        self.carrier[begin:end] = self.carrier_code(carrier)
+        self.removed[begin:end] = False
+        self.size = end
+        self._changed()
+        return np.arange(begin, end)
+
+    def restore(self, columns, cities, carriers, adjacency=None):
+        """
+        Replaces the contents of the store with the given arrays, e.g. views
+        over a memory-mapped snapshot. The arrays are used as they are, they
+        are only copied once the store has to grow them.
+        :param columns: dict of node and connection column arrays
+        :param cities: city name of every node
+        :param carriers: carrier name of every code
+        :param adjacency: (offsets, order, departures) if already built
+        """
+        for column, _ in NODE_COLUMNS + CONNECTION_COLUMNS:
+            setattr(self, column, columns[column])
+        self.cities = list(cities)
+        self.carriers = list(carriers)
+        self.carrier_codes = {name: code for code, name in enumerate(self.carriers)}
+        self.size = len(columns['origin'])
+        self._changed()
+        self._adjacency = adjacency
+
+    def copy(self):
+        """
+        Store with copies of the columns, sharing the indexes until one of
+        the stores changes
+        """
+        store = ConnectionStore()
+        columns = {column: self.column(column).copy() for column, _ in CONNECTION_COLUMNS}
+        for column, _ in NODE_COLUMNS:
+            columns[column] = getattr(self, column)[:self.node_count].copy()
+        store.restore(columns, self.cities, self.carriers, self._adjacency)
+        store._reverse = self._reverse
+        store.version = self.version
+        return store
+
+    def remove(self, positions):
+        """
+        Marks connections as removed
+        """
+        self.removed[positions] = True
+        self._changed()
+
+    def update(self, positions, prices, arrivals):
+        """
+        Changes price and arrival of connections in place. Departures do not
+        change, so the outgoing index stays valid.
+        """
+        self.price[positions] = prices
+        self.arrival[positions] = arrivals
+        self._reverse = None
+        self.version += 1
+
+    def live(self):
+        """
+        Positions of the connections that are not removed
+        """
+        return np.flatnonzero(~self.column('removed'))
+
+    def keys(self, carrier):
+        """
+        Live connections of `carrier` grouped by (origin, destination, departure)
+        :return: dict of key to list of positions
+        """
+        code = self.carrier_codes.get(carrier)
+        if code is None:
+            return {}
+        positions = np.flatnonzero((self.column('carrier') == code) & ~self.column('removed'))
+        keys = {}
+        for position, key in zip(positions.tolist(), zip(self.origin[positions].tolist(),
+                                                          self.destination[positions].tolist(),
+                                                          self.departure[positions].tolist())):
+            keys.setdefault(key, []).append(position)
+        return keys
+
+    def compact(self):
+        """
+        Drops removed connections, moving the rest down
+        :return: old position of every connection kept
+        """
+        kept = self.live()
+        for column, _ in CONNECTION_COLUMNS:
+            setattr(self, column, self.column(column)[kept].copy())
+        self.size = len(kept)
+        self._changed()
+        return kept
+
+    def column(self, name):
+        return getattr(self, name)[:self.size]
+
+    def adjacency(self):
+        """
+        :return: (offsets, order, departures) where `departures` is the
+        departure column in `order`
+        """
+        if self._adjacency is None:
+            origin = self.column('origin')
+            departure = self.column('departure')
+            removed = self.column('removed')
+            if removed.any():
+                live = self.live()
+                order = live[np.lexsort((departure[live], origin[live]))].astype(np.int32)
+                counts = np.bincount(origin[live], minlength=self.node_count)
+            else:
+                order = np.lexsort((departure, origin)).astype(np.int32)
+                counts = np.bincount(origin, minlength=self.node_count)
+            offsets = np.zeros(self.node_count + 1, dtype=np.int64)
+            np.cumsum(counts, out=offsets[1:])
+            self._adjacency = (offsets, order, departure[order])
+        return self._adjacency
+
+    def reverse_adjacency(self):
+        """
+        Incoming counterpart of `adjacency`, connections grouped by
+        destination and sorted by arrival
+        :return: (offsets, order, arrivals)
+        """
+        if self._reverse is None:
+            live = self.live()
+            destination = self.destination[live]
+            arrival = self.arrival[live]
+            order = live[np.lexsort((arrival, destination))].astype(np.int32)
+            counts = np.bincount(destination, minlength=self.node_count)
+            offsets = np.zeros(self.node_count + 1, dtype=np.int64)
+            np.cumsum(counts, out=offsets[1:])
+            self._reverse = (offsets, order, self.arrival[order])
+        return self._reverse
+
+    def arrivals_between(self, node, earliest, latest):
+        """
+        Range of the reverse `order` holding the connections arriving at
+        `node` between `earliest` and `latest` minutes inclusive
+        :return: (begin, end) positions into the reverse `order`
+        """
+        offsets, _, arrivals = self.reverse_adjacency()
+        begin, end = int(offsets[node]), int(offsets[node + 1])
+        if begin == end or earliest > latest:
+            return begin, begin
+        first, last = arrivals[begin:end].searchsorted((earliest, latest + 1)).tolist()
+        return begin + first, begin + last
+
+    def outgoing(self, node):
+        """
+        Positions of the connections leaving `node`, sorted by departure
+        """
+        offsets, order, _ = self.adjacency()
+        return order[offsets[node]:offsets[node + 1]]
+
+    def departures_between(self, node, earliest, latest):
+        """
+        Range of `order` holding the connections leaving `node` that depart
+        between `earliest` and `latest` minutes inclusive, found by binary
+        search over the node's sorted departures
+        :return: (begin, end) positions into `order`
+        """
+        offsets, _, departures = self.adjacency()
+        begin, end = int(offsets[node]), int(offsets[node + 1])
+        if begin == end or earliest > latest:
+            return begin, begin
+        first, last = departures[begin:end].searchsorted((earliest, latest + 1)).tolist()
+        return begin + first, begin + last
+
+    @property
+    def nbytes(self):
+        """
+        Bytes used by the connection columns and the adjacency index
+        """
+        total = sum(self.column(column).nbytes for column, _ in CONNECTION_COLUMNS)
+        if self._adjacency is not None:
+            total += sum(array.nbytes for array in self._adjacency)
+        return total
+
+    def __len__(self):
+        return self.size
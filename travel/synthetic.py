@@ -0,0 +1,226 @@
+"""
+Synthetic carrier networks written as feed CSVs in the spiders' schema,
+to measure loading, snapping and searching beyond the size of
+sample_data.
+
+A network of `scale` times the sample feeds has SAMPLE_FARES * scale
+fares between SAMPLE_AIRPORTS * sqrt(scale) airports, so busy airports
+get more routes as well as more flights. Airports get a heavy-tailed
+weight and route ends are drawn by weight, which gives a few hubs served
+from everywhere and many spokes with a handful of routes. Every route is
+flown both ways on fixed weekdays at a fixed time, priced by distance
+with a random spread, in EUR, PLN or UAH. Carriers split the routes
+like the sample feeds do, wizzair without and ryanair with arrival
+times.
+
+The same seed and scale always give the same files.
+
+    python -m travel.synthetic feeds --scale 10 --seed 0
+"""
+import argparse
+import csv
+import math
+import os
+import random
+from datetime import timedelta
+
+from travel.currency import default_rates
+from travel.search import DEPARTURE_FROM
+from travel.spatial import GridIndex
+from travel.store import to_minutes
+from travel.utils import coord_distance
+
+VERSION = 1
+SAMPLE_FARES = 2905
+SAMPLE_AIRPORTS = 138
+
+# Where airports are placed, far enough apart that snapping keeps them apart.
+# More than REGION_AIRPORTS do not fit, the region grows around its centre
+# for them.
+LATITUDES = (35.0, 65.0)
+LONGITUDES = (-10.0, 40.0)
+MIN_SPACING = 60
+REGION_AIRPORTS = 1500
+MAX_ATTEMPTS = 10000
+HUB_SHAPE = 1.5
+# Days of fares from DEPARTURE_FROM, about what one crawl sees
+CRAWL_DAYS = 28
+
+# Share of routes, and whether the feed has arrival times
+CARRIERS = [
+    ('wizzair', 0.9, False),
+    ('ryanair', 0.1, True),
+]
+CURRENCIES = ['EUR', 'PLN', 'UAH']
+STATES = ['DE', 'EE', 'FR', 'GB', 'IT', 'LV', 'PL', 'SK', 'UA']
+
+HEADER = [
+    'origin_airport', 'origin_title', 'origin_state', 'origin_lat', 'origin_lon',
+    'destination_airport', 'destination_title', 'destination_state', 'destination_lat', 'destination_lon',
+    'departureDate', 'arrivalDate', 'price', 'currencyCode',
+]
+WIZZAIR_DATE = '%Y-%m-%dT%H:%M:%S'
+RYANAIR_DATE = '%Y-%m-%d %H:%M:%S+00:00'
+
+
+class Airport:
+    def __init__(self, code, title, state, lat, lon, weight, currency):
+        self.code = code
+        self.title = title
+        self.state = state
+        self.lat = lat
+        self.lon = lon
+        self.weight = weight
+        self.currency = currency
+
+
+def airport_code(i):
+    letters = []
+    for _ in range(3):
+        i, letter = divmod(i, 26)
+        letters.append(chr(ord('A') + letter))
+    return ''.join(reversed(letters)) + (str(i) if i else '')
+
+
+def region(count):
+    """
+    Latitude and longitude ranges with room for `count` airports
+    """
+    growth = max(1.0, math.sqrt(count / REGION_AIRPORTS))
+    (south, north), (west, east) = LATITUDES, LONGITUDES
+    lat, lon = (south + north) / 2, (west + east) / 2
+    half_lat, half_lon = (north - south) / 2 * growth, (east - west) / 2 * growth
+    return (max(-80.0, lat - half_lat), min(80.0, lat + half_lat)), (max(-180.0, lon - half_lon),
+                                                                     min(180.0, lon + half_lon))
+
+
+def airports(rnd, count):
+    """
+    `count` airports at least MIN_SPACING km apart with Pareto weights
+    :raise ValueError: when MAX_ATTEMPTS places in a row were too close to
+    another airport, `count` does not fit on the globe
+    """
+    latitudes, longitudes = region(count)
+    index = GridIndex()
+    result = []
+    attempts = 0
+    while len(result) < count:
+        attempts += 1
+        if attempts > MAX_ATTEMPTS:
+            raise ValueError('No room for {} airports {} km apart, placed {}'.format(count, MIN_SPACING, len(result)))
+        lat = round(rnd.uniform(*latitudes), 4)
+        lon = round(rnd.uniform(*longitudes), 4)
+        if index.nearest(lat, lon, MIN_SPACING):
+            continue
+        attempts = 0
+        code = airport_code(len(result))
+        index.insert(lat, lon, code)
+        result.append(Airport(
+            code, 'Synthetic {}'.format(code), rnd.choice(STATES), lat, lon,
+            rnd.paretovariate(HUB_SHAPE), rnd.choice(CURRENCIES),
+        ))
+    return result
+
+
+def routes(rnd, places, fares, days):
+    """
+    Routes drawn by airport weight, each flown both ways, until their
+    flights add up to `fares`
+    :return: list of (origin, destination, weekdays, minute of day)
+    """
+    cumulative = []
+    total = 0
+    for place in places:
+        total += place.weight
+        cumulative.append(total)
+    served = set()
+    result = []
+    flights = 0
+    while flights < fares:
+        origin, destination = rnd.choices(places, cum_weights=cumulative, k=2)
+        if origin is destination or (origin.code, destination.code) in served:
+            continue
+        # Busier pairs are flown more often
+        frequency = min(7, int(math.sqrt(origin.weight * destination.weight)))
+        for a, b in ((origin, destination), (destination, origin)):
+            served.add((a.code, b.code))
+            weekdays = frozenset(rnd.sample(range(7), frequency))
+            result.append((a, b, weekdays, rnd.randrange(6 * 60, 22 * 60, 5)))
+            flights += sum(1 for day in days if day.weekday() in weekdays)
+    return result
+
+
+def fares_of(rnd, route, days, rates):
+    """
+    Every flight of a route: (departure, arrival, price, currency)
+    """
+    origin, destination, weekdays, minute = route
+    distance = coord_distance((origin.lat, origin.lon), (destination.lat, destination.lon))
+    duration = timedelta(minutes=30 + int(distance / 800 * 60))
+    base = 15 + 0.06 * distance
+    currency = origin.currency
+    for day in days:
+        if day.weekday() not in weekdays:
+            continue
+        departure = day + timedelta(minutes=minute)
+        eur = base * rnd.lognormvariate(0, 0.35)
+        price = round(eur / float(rates.rate(currency, to_minutes(departure)))) - 0.01
+        yield departure, departure + duration, max(price, 0.99), currency
+
+
+def generate(directory, scale=1, seed=0):
+    """
+    Writes one feed CSV per carrier to `directory`
+    :param scale: size relative to the sample feeds
+    :return: list of (path, carrier name)
+    """
+    rnd = random.Random(seed)
+    rates = default_rates()
+    days = [DEPARTURE_FROM + timedelta(days=i) for i in range(CRAWL_DAYS)]
+    places = airports(rnd, max(2, int(round(SAMPLE_AIRPORTS * math.sqrt(scale)))))
+    network = routes(rnd, places, int(SAMPLE_FARES * scale), days)
+    carriers = [name for name, _, _ in CARRIERS]
+    shares = [share for _, share, _ in CARRIERS]
+    by_carrier = {name: [] for name in carriers}
+    for route in network:
+        by_carrier[rnd.choices(carriers, shares)[0]].append(route)
+
+    os.makedirs(directory, exist_ok=True)
+    feeds = []
+    for name, _, arrivals in CARRIERS:
+        path = os.path.join(directory, '{}.csv'.format(name))
+        header = HEADER if arrivals else [column for column in HEADER if column != 'arrivalDate']
+        date_format = RYANAIR_DATE if arrivals else WIZZAIR_DATE
+        with open(path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(header)
+            for route in by_carrier[name]:
+                origin, destination = route[:2]
+                ends = [
+                    origin.code, origin.title, origin.state, origin.lat, origin.lon,
+                    destination.code, destination.title, destination.state, destination.lat, destination.lon,
+                ]
+                for departure, arrival, price, currency in fares_of(rnd, route, days, rates):
+                    dates = [departure.strftime(date_format)]
+                    if arrivals:
+                        dates.append(arrival.strftime(date_format))
+                    writer.writerow(ends + dates + ['{:.2f}'.format(price), currency])
+        feeds.append((path, name))
+    return feeds
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Write synthetic hub-and-spoke feed CSVs')
+    parser.add_argument('directory')
+    parser.add_argument('--scale', type=float, default=10, help='size relative to the sample feeds')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    for path, name in generate(args.directory, args.scale, args.seed):
+        with open(path) as f:
+            rows = sum(1 for _ in f) - 1
+        print('{}: {} fares, {} bytes'.format(path, rows, os.path.getsize(path)))
+
+
+if __name__ == '__main__':
+    main()
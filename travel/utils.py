@@ -1,4 +1,4 @@
-import math
+import numpy as np
 
 STATES = [
     'UA',
@@ -10,17 +10,40 @@ STATES = [
     'SK',
 ]
 
+EARTH_RADIUS = 6371  # km
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    """
+    Great-circle distance in kilometers between points given in radians.
+    Arguments are scalars or NumPy arrays and broadcast against each other,
+    so a column of points against one point gives a distance vector and
+    a column against a row gives a distance matrix.
+    """
+    dlat = lat2 - lat1
+    dlon = lon2 - lon1
+    a = np.sin(dlat / 2) * np.sin(dlat / 2) + np.cos(lat1) \
+        * np.cos(lat2) * np.sin(dlon / 2) * np.sin(dlon / 2)
+    c = 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+    return EARTH_RADIUS * c
+
+
+def distance_matrix(origins, destinations):
+    """
+    Distances in kilometers between every origin and every destination
+    :param origins: sequence of (lat, lon) in degrees
+    :param destinations: sequence of (lat, lon) in degrees
+    :return: array of shape (len(origins), len(destinations))
+    """
+    origins = np.radians(np.asarray(origins, dtype=np.float64).reshape(-1, 2))
+    destinations = np.radians(np.asarray(destinations, dtype=np.float64).reshape(-1, 2))
+    return haversine(
+        origins[:, 0, np.newaxis], origins[:, 1, np.newaxis],
+        destinations[np.newaxis, :, 0], destinations[np.newaxis, :, 1],
+    )
+
 
 def coord_distance(origin, destination):
     lat1, lon1 = origin
     lat2, lon2 = destination
-    radius = 6371  # km
-
-    dlat = math.radians(lat2-lat1)
-    dlon = math.radians(lon2-lon1)
-    a = math.sin(dlat/2) * math.sin(dlat/2) + math.cos(math.radians(lat1)) \
-        * math.cos(math.radians(lat2)) * math.sin(dlon/2) * math.sin(dlon/2)
-    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1-a))
-    d = radius * c
-
-    return d
+    return float(haversine(np.radians(lat1), np.radians(lon1), np.radians(lat2), np.radians(lon2)))
@@ -22,7 +22,7 @@
 # https://be.wizzair.com/7.7.5/Api/asset/map?languageCode=en-gb
 
 import json
-from collections import OrderedDict
+from collections import OrderedDict, namedtuple
 
 import scrapy
 from datetime import datetime
@@ -39,10 +39,28 @@ DAY_TO = 31
 AIRPORTS_URL = 'https://be.wizzair.com/7.7.5/Api/asset/map?languageCode=en-gb'
 TIMETABLE = 'https://be.wizzair.com/7.7.5/Api/search/timetable'
 
+FIELDS = [
+    'origin_airport', 'origin_title', 'origin_state', 'origin_lat', 'origin_lon',
+    'destination_airport', 'destination_title', 'destination_state',
+    'destination_lat', 'destination_lon',
+    'departureDate',  # 'arrivalDate',
+    'price', 'currencyCode',
+]
+
+# Per-request context: the route fields of the items, the airports are
+# shared on the spider
+Route = namedtuple('Route', FIELDS[:10])
+
 
 class WizzairSpider(scrapy.Spider):
     name = 'wizzair'
     allowed_domains = ['be.wizzair.com']
+    airports = {}
+
+    async def start(self):
+        # Newer Scrapy versions start a spider with start() and not start_requests()
+        for request in self.start_requests():
+            yield request
 
     def start_requests(self):
         return [
@@ -65,8 +83,8 @@ class WizzairSpider(scrapy.Spider):
         ]
 
     def parse(self, response):
-        jsonresponse = json.loads(response.body_as_unicode())
-        airports = self._airport_mapping(jsonresponse)
+        jsonresponse = json.loads(response.text)
+        self.airports = airports = self._airport_mapping(jsonresponse)
         for origin in jsonresponse['cities']:
             if origin['countryCode'].upper() not in STATES:
                 continue
@@ -103,18 +121,19 @@ class WizzairSpider(scrapy.Spider):
                     },
                     callback=self.timetable,
                     meta={
-                        'origin_airport': origin['iata'],
-                        'origin_title': origin['shortName'],
-                        'origin_state': origin['countryCode'],
-                        'origin_lat': origin['latitude'],
-                        'origin_lon': origin['longitude'],
-                        'destination_airport': destination['iata'],
-                        'destination_title': airports[dest_iata]['shortName'],
-                        'destination_state': airports[dest_iata]['countryCode'],
-                        'destination_lat': airports[dest_iata]['latitude'],
-                        'destination_lon': airports[dest_iata]['longitude'],
+                        'route': Route(
+                            origin['iata'],
+                            origin['shortName'],
+                            origin['countryCode'],
+                            origin['latitude'],
+                            origin['longitude'],
+                            destination['iata'],
+                            airports[dest_iata]['shortName'],
+                            airports[dest_iata]['countryCode'],
+                            airports[dest_iata]['latitude'],
+                            airports[dest_iata]['longitude'],
+                        ),
                         'cookiejar': None,
-                        'airports': airports,
                     }
                 )
 
@@ -125,25 +144,13 @@ class WizzairSpider(scrapy.Spider):
         }
 
     def timetable(self, response):
-        jsonresponse = json.loads(response.body_as_unicode())
+        jsonresponse = json.loads(response.text)
+        route = response.meta['route']
         for item in jsonresponse['outboundFlights']:
             if not item.get('price'):
                 continue
-            data = response.meta.copy()
-            data.update({
-                'departureDate': item['departureDate'],
-                'price': item['price']['amount'],
-                'currencyCode': item['price']['currencyCode'],
-                'classOfService': item['classOfService'],
-            })
-
-            yield OrderedDict([
-                (key, data[key])
-                for key in [
-                    'origin_airport', 'origin_title', 'origin_state', 'origin_lat', 'origin_lon',
-                    'destination_airport', 'destination_title', 'destination_state',
-                    'destination_lat', 'destination_lon',
-                    'departureDate',  # 'arrivalDate',
-                    'price', 'currencyCode',
-                ]
-            ])
+            yield OrderedDict(zip(FIELDS, route + (
+                item['departureDate'],
+                item['price']['amount'],
+                item['price']['currencyCode'],
+            )))